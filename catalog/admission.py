@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""Admission control of the requests.
+
+Every route belongs to a class (ROUTE_CLASSES, the others to 'default')
+with its own limits in ADMISSION_LIMITS: the number of its requests
+served at once by a process, the number waiting for one of them, in
+arrival order, and the seconds they may wait. A request finding the
+queue full, or still waiting at its deadline, gets a 503 with a
+Retry-After header right away, so a burst of catalog exports cannot
+hold every thread and database connection while item pages and sign in
+wait behind it. The async views of asgi_app wait for their turn
+without holding a thread.
+
+The queue depth, wait times and turned away requests of every class are
+on /stats/admission/json.
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+
+from flask import g, jsonify, request
+
+from instrumentation import percentile
+
+
+# endpoint -> route class, None for the endpoints never limited
+ROUTE_CLASSES = {
+    'catalog_json': 'export',
+    'catalog_export': 'export',
+    'import_items': 'export',
+    'search': 'search',
+    'search_json': 'search',
+    'gconnect_state': 'login',
+    'gconnect': 'login',
+    'gdisconnect': 'login',
+    'static': None,
+    'asset': None,
+    'request_stats': None,
+    'cache_stats_json': None,
+    'replica_stats_json': None,
+    'snapshot_stats_json': None,
+    'admission_stats': None,
+}
+
+
+class _Waiter(object):
+    __slots__ = ('started', 'wake', 'granted')
+
+    def __init__(self, wake):
+        self.started = time.monotonic()
+        # called with the lock held when a slot is handed over
+        self.wake = wake
+        self.granted = False
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class Limiter(object):
+    """Admission of the requests of one route class. A request leaving
+    hands its slot over to the longest waiting one
+    """
+
+    def __init__(self, concurrency, queue_size, timeout, window=1000):
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.active = 0
+        self.max_waiting = 0
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.waits = deque(maxlen=window)
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    def _enter(self, wake):
+        """True when admitted at once, False when the queue is full, else
+        the _Waiter queued; called with the lock held
+        """
+        if self.active < self.concurrency and not self._waiters:
+            self.active += 1
+            self.admitted += 1
+            return True
+        if len(self._waiters) >= self.queue_size:
+            self.rejected += 1
+            return False
+        waiter = _Waiter(wake)
+        self._waiters.append(waiter)
+        self.queued += 1
+        self.max_waiting = max(self.max_waiting, len(self._waiters))
+        return waiter
+
+    def _leave(self, waiter):
+        """Whether waiter got a slot, leaving the queue when it did not"""
+        with self._lock:
+            if waiter.granted:
+                self.admitted += 1
+                self.waits.append((time.monotonic() - waiter.started) * 1000)
+                return True
+            self._waiters.remove(waiter)
+            self.timed_out += 1
+            return False
+
+    def acquire(self):
+        """Whether a request is admitted, waiting for its turn; release()
+        must follow an admission
+        """
+        event = threading.Event()
+        with self._lock:
+            waiter = self._enter(event.set)
+        if isinstance(waiter, bool):
+            return waiter
+        event.wait(self.timeout)
+        return self._leave(waiter)
+
+    async def acquire_async(self):
+        """acquire() of a coroutine, waiting without blocking its loop"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:
+            waiter = self._enter(
+                lambda: loop.call_soon_threadsafe(_resolve, future))
+        if isinstance(waiter, bool):
+            return waiter
+        try:
+            await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            pass
+        except BaseException:
+            # cancelled, with the slot it may have been given
+            if self._leave(waiter):
+                self.release()
+            raise
+        return self._leave(waiter)
+
+    def release(self):
+        with self._lock:
+            if self._waiters:
+                waiter = self._waiters.popleft()
+                waiter.granted = True
+                waiter.wake()
+            else:
+                self.active -= 1
+
+    @property
+    def stats(self):
+        with self._lock:
+            waits = sorted(self.waits)
+            return {'concurrency': self.concurrency,
+                    'queue_size': self.queue_size,
+                    'timeout': self.timeout,
+                    'active': self.active,
+                    'waiting': len(self._waiters),
+                    'max_waiting': self.max_waiting,
+                    'admitted': self.admitted,
+                    'queued': self.queued,
+                    'rejected': self.rejected,
+                    'timed_out': self.timed_out,
+                    'wait_ms': {'p50': percentile(waits, 0.50),
+                                'p95': percentile(waits, 0.95),
+                                'p99': percentile(waits, 0.99),
+                                'max': waits[-1] if waits else 0}}
+
+
+class Admission(object):
+
+    def __init__(self, app=None):
+        self.limiters = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not app.config['ADMISSION_CONTROL']:
+            return
+        self.route_classes = dict(ROUTE_CLASSES,
+                                  **app.config['ADMISSION_ROUTES'])
+        self.retry_after = app.config['ADMISSION_RETRY_AFTER']
+        self.limiters = {
+            name: Limiter(concurrency, queue_size, timeout,
+                          app.config['STATS_WINDOW'])
+            for name, (concurrency, queue_size, timeout)
+            in app.config['ADMISSION_LIMITS'].items()}
+
+        app.extensions['admission'] = self
+        app.before_request(self.admit)
+        # run after the database session gave its connection back
+        app.teardown_appcontext(self.release)
+        app.add_url_rule('/stats/admission/json', 'admission_stats',
+                         self.stats_json)
+
+    def _limiter(self):
+        if request.endpoint is None:
+            # a 404, no view runs
+            return None
+        route_class = self.route_classes.get(request.endpoint, 'default')
+        if route_class is None:
+            return None
+        return self.limiters.get(route_class)
+
+    def admit(self):
+        if 'admitted_by' in g:
+            # by admit_async
+            return None
+        limiter = self._limiter()
+        if limiter is None:
+            return None
+        if limiter.acquire():
+            g.admitted_by = limiter
+            return None
+        return self._busy()
+
+    async def admit_async(self):
+        """admit() of the async views of asgi_app, run before the request
+        hooks: None once admitted, else the 503 response
+        """
+        limiter = self._limiter()
+        if limiter is None:
+            return None
+        if await limiter.acquire_async():
+            g.admitted_by = limiter
+            return None
+        return self._busy()
+
+    def _busy(self):
+        response = jsonify(Error='Server busy, retry later')
+        response.status_code = 503
+        response.headers['Retry-After'] = str(self.retry_after)
+        response.cache_control.no_store = True
+        return response
+
+    def release(self, exception=None):
+        limiter = g.pop('admitted_by', None)
+        if limiter is not None:
+            limiter.release()
+
+    def stats_json(self):
+        return jsonify(Admission={name: limiter.stats for name, limiter
+                                  in self.limiters.items()})
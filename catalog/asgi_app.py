@@ -0,0 +1,476 @@
+#!/usr/bin/env python3
+"""ASGI serving mode.
+
+The read heavy routes (show_catalog, show_category, show_item and the
+catalog, category and item JSON endpoints) run as coroutines on an async
+engine (asyncpg on Postgres, aiosqlite on SQLite), so a waiting client
+or a slow query holds no thread. They render the same templates and
+JSON as the Flask views, in a Flask request context built from the ASGI
+scope, with the same conditional GET, session and cache behaviour. With
+SNAPSHOT on, the catalog snapshot is loaded at startup and the Flask
+views answer from it directly.
+Every other request is handed to the Flask app, run in a thread pool by
+asgiref's WsgiToAsgi.
+
+Usage:
+    uvicorn asgi_app:application --workers 4
+"""
+
+import asyncio
+import io
+import sys
+
+from asgiref.wsgi import WsgiToAsgi
+from flask import g, redirect, render_template, request, url_for, flash,\
+    abort
+from flask import session as login_session
+from sqlalchemy import event, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import joinedload, sessionmaker
+from werkzeug.exceptions import HTTPException
+
+from catalog_service import app, category_refs, item_refs, session
+from catalog_service import catalog_tree, catalog_validators,\
+    set_catalog_validators, reads_from_primary, current_snapshot,\
+    sidebar_page
+from config import check_secret_key
+from database_setup import Category, Item, Revision
+from database_setup import enable_foreign_keys
+from fragment_cache import has_fragment
+from lookup_cache import CategoryRef, ItemRef
+from pagination import keyset_query, page_of
+from replicas import ReplicaSet, RoutingSession
+import revisions
+import summaries
+import serializers
+
+
+ASYNC_DRIVERS = {'postgresql': 'postgresql+asyncpg',
+                 'sqlite': 'sqlite+aiosqlite'}
+
+
+def create_async_db_engine(url, pool_size=5, max_overflow=10,
+                           pool_timeout=30, pool_recycle=1800,
+                           pool_pre_ping=True):
+    """Async counterpart of database_setup.create_db_engine. A url
+    naming no driver gets the async one of its database
+    """
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if url.drivername == backend:
+        url = url.set(drivername=ASYNC_DRIVERS[backend])
+    if backend == 'sqlite':
+        engine = create_async_engine(url)
+        event.listen(engine.sync_engine, 'connect', enable_foreign_keys)
+        return engine
+
+    return create_async_engine(url,
+                               pool_size=pool_size,
+                               max_overflow=max_overflow,
+                               pool_timeout=pool_timeout,
+                               pool_recycle=pool_recycle,
+                               pool_pre_ping=pool_pre_ping)
+
+
+async_engine = create_async_db_engine(
+    app.config['ASYNC_DATABASE_URL'] or app.config['DATABASE_URL'],
+    pool_size=app.config['DB_POOL_SIZE'],
+    max_overflow=app.config['DB_MAX_OVERFLOW'],
+    pool_timeout=app.config['DB_POOL_TIMEOUT'],
+    pool_recycle=app.config['DB_POOL_RECYCLE'],
+    pool_pre_ping=app.config['DB_POOL_PRE_PING'])
+async_replicas = [
+    create_async_db_engine(url,
+                           pool_size=app.config['DB_POOL_SIZE'],
+                           max_overflow=app.config['DB_MAX_OVERFLOW'],
+                           pool_timeout=app.config['DB_POOL_TIMEOUT'],
+                           pool_recycle=app.config['DB_POOL_RECYCLE'],
+                           pool_pre_ping=app.config['DB_POOL_PRE_PING'])
+    for url in app.config['REPLICA_URLS']]
+async_replica_set = None
+if async_replicas:
+    async_replica_set = ReplicaSet(
+        [replica.sync_engine for replica in async_replicas],
+        strategy=app.config['REPLICA_STRATEGY'],
+        retry_interval=app.config['REPLICA_RETRY_INTERVAL'],
+        probe=False)
+AsyncDBSession = sessionmaker(async_engine, class_=AsyncSession,
+                              sync_session_class=RoutingSession,
+                              replicas=async_replica_set,
+                              expire_on_commit=False)
+
+flask_application = WsgiToAsgi(app)
+
+
+async def _revision(db):
+    """(value, updated) of the catalog revision, as revisions.current"""
+    row = (await db.execute(
+        select(Revision.value, Revision.updated)
+        .filter_by(name=revisions.CATALOG))).first()
+    return (row.value, row.updated) if row else (0, None)
+
+
+async def _catalog_revision(db):
+    if 'catalog_revision' not in g:
+        g.catalog_revision = (await _revision(db))[0]
+    return g.catalog_revision
+
+
+async def _find_category(db, category_name):
+    ref = category_refs.get(category_name)
+    if ref is None:
+        row = (await db.execute(
+            select(Category.id, Category.name, Category.user_id)
+            .filter_by(name=category_name))).first()
+        if row is None:
+            return None
+        ref = CategoryRef(*row)
+        category_refs.set(category_name, ref)
+    return ref
+
+
+async def _find_item(db, item_name):
+    ref = item_refs.get(item_name)
+    if ref is None:
+        row = (await db.execute(
+            select(Item.id, Item.title, Item.category_id, Item.user_id)
+            .filter_by(title=item_name))).first()
+        if row is None:
+            return None
+        ref = ItemRef(*row)
+        item_refs.set(item_name, ref)
+    return ref
+
+
+async def _page(db, query, columns, cursor_arg='next', descending=False,
+                limit=None, entities=False):
+    """Page of the select() query, as catalog_service's __page"""
+    try:
+        if limit is None:
+            limit = int(request.args.get('limit', app.config['PAGE_SIZE']))
+        limit = max(1, min(limit, app.config['MAX_PAGE_SIZE']))
+        query = keyset_query(query, columns, limit,
+                             request.args.get(cursor_arg),
+                             descending=descending)
+    except ValueError:
+        abort(400)
+    result = await db.execute(query)
+    rows = result.scalars().all() if entities else result.all()
+    return page_of(rows, columns, limit)
+
+
+def _page_url(cursor_arg, cursor):
+    if cursor is None:
+        return None
+    args = request.args.to_dict()
+    args.update(request.view_args)
+    args[cursor_arg] = cursor
+    return url_for(request.endpoint, **args)
+
+
+def _paginated():
+    return 'limit' in request.args or 'next' in request.args
+
+
+async def _sidebar(db, revision):
+    """The sidebar callable of the templates: the page loaded here unless
+    its fragment is cached, else the loader of the Flask views
+    """
+    sidebar_next = request.args.get('sidebar_next')
+    if has_fragment(app.jinja_env, 'sidebar', revision, sidebar_next):
+        # only called when the fragment is gone by the time it renders
+        # (a write cleared the cache, or it was evicted), blocking the
+        # loop for its query
+        return sidebar_page
+    page = await _page(db, select(Category.id, Category.name),
+                       [Category.id], cursor_arg='sidebar_next',
+                       limit=app.config['PAGE_SIZE'])
+    more = None
+    if page.next_cursor is not None:
+        more = url_for('show_catalog', sidebar_next=page.next_cursor)
+    return lambda: (page.rows, more)
+
+
+def _render(template_name, **context):
+    return render_template(template_name,
+                           user_logged_in='user_id' in login_session,
+                           **context)
+
+
+async def show_catalog(db):
+    revision = await _catalog_revision(db)
+    if has_fragment(app.jinja_env, 'latest', revision):
+        # lazy, as in the Flask view: only read when the fragment is gone
+        # by the time it renders
+        items = summaries.latest(session.query(Item))
+    else:
+        items = (await db.execute(
+            summaries.latest(select(Item)))).scalars().all()
+    return _render("catalog.html",
+                   sidebar=await _sidebar(db, revision),
+                   revision=revision,
+                   items=items)
+
+
+async def show_category(db, category_name):
+    selected_category = await _find_category(db, category_name)
+    if selected_category is None:
+        flash('{} not found'.format(category_name))
+        return redirect(url_for('show_catalog'))
+
+    revision = await _catalog_revision(db)
+    items = await _page(db,
+                        select(Item)
+                        .filter_by(category_id=selected_category.id),
+                        [Item.creation_date, Item.id], descending=True,
+                        entities=True)
+
+    user_authorized = 'user_id' in login_session and\
+                      selected_category.user_id == login_session["user_id"]
+
+    return _render("category.html",
+                   sidebar=await _sidebar(db, revision),
+                   revision=revision,
+                   items=items.rows,
+                   more_items=_page_url('next', items.next_cursor),
+                   selectedCategory=selected_category,
+                   user_authorized=user_authorized)
+
+
+async def show_item(db, category_name, item_name):
+    item = (await db.execute(
+        select(Item)
+        .options(joinedload(Item.category))
+        .filter_by(title=item_name))).scalars().first()
+    if item is None:
+        flash('{} not found'.format(item_name))
+        return redirect(url_for('show_catalog'))
+
+    user_authorized = 'user_id' in login_session and \
+                      item.user_id == login_session['user_id']
+    return _render("item.html", item=item, user_authorized=user_authorized)
+
+
+def _catalog_rows():
+    return select(Category.id, Category.name,
+                  Item.id, Item.title, Item.description)\
+        .outerjoin(Item, Item.category_id == Category.id)\
+        .order_by(Category.id, Item.id)
+
+
+async def catalog_json(db):
+    if not _paginated():
+        return serializers.json_response(Categories=catalog_tree(
+            await db.execute(_catalog_rows())))
+
+    page = await _page(db, select(Category.id), [Category.id])
+    rows = await db.execute(_catalog_rows().filter(
+        Category.id.in_([c.id for c in page.rows])))
+    return serializers.json_response(Categories=catalog_tree(rows),
+                                     next=page.next_cursor)
+
+
+async def category_json(db, category_name):
+    category = await _find_category(db, category_name)
+    if category is None:
+        return serializers.json_response(Error='Category {0} not found'
+                                         .format(category_name))
+
+    items = select(*serializers.ITEM_COLUMNS)\
+        .filter_by(category_id=category.id)
+    if not _paginated():
+        rows = await db.execute(items.order_by(Item.id))
+        return serializers.json_response(
+            Categories={'name': category.name,
+                        'id': category.id,
+                        'Items': [serializers.item(row) for row in rows]})
+
+    page = await _page(db, items.add_columns(Item.creation_date),
+                       [Item.creation_date, Item.id], descending=True)
+    return serializers.json_response(
+        Categories={'name': category.name,
+                    'id': category.id,
+                    'Items': [serializers.item(row) for row in page.rows]},
+        next=page.next_cursor)
+
+
+async def item_json(db, category_name, item_name):
+    category = await _find_category(db, category_name)
+    item = await _find_item(db, item_name)
+    if category is None or item is None:
+        return serializers.json_response(
+            Error='Item or Category not found')
+
+    if item.category_id != category.id:
+        return serializers.json_response(
+            Error='Item {0} does not belong to Category {1}'
+            .format(item_name, category_name))
+
+    row = (await db.execute(select(*serializers.ITEM_COLUMNS)
+                            .filter_by(id=item.id))).first()
+    if row is None:
+        # the cached ref outlived the item, deleted by another process
+        item_refs.invalidate(item_name)
+        return serializers.json_response(
+            Error='Item or Category not found')
+    return serializers.json_response(Categories=serializers.item(row))
+
+
+# endpoint -> coroutine, every one answering conditional GETs
+VIEWS = {'show_catalog': show_catalog,
+         'show_category': show_category,
+         'show_item': show_item,
+         'catalog_json': catalog_json,
+         'category_json': category_json,
+         'item_json': item_json}
+
+
+async def _conditional(view, db, view_args):
+    """As catalog_service's __conditional"""
+    if '_flashes' in login_session:
+        return app.make_response(await view(db, **view_args))
+
+    revision, updated = await _revision(db)
+    g.catalog_revision = revision
+    etag, updated, not_modified = catalog_validators(revision, updated)
+    if not_modified:
+        response = app.response_class(status=304)
+    else:
+        response = app.make_response(await view(db, **view_args))
+        if response.status_code != 200:
+            return response
+    return set_catalog_validators(response, etag, updated)
+
+
+def _environ(scope):
+    """WSGI environ of an ASGI http scope without a body"""
+    script_name = scope.get('root_path', '').encode('utf8').decode('latin1')
+    path_info = scope['path'].encode('utf8').decode('latin1')
+    if path_info.startswith(script_name):
+        path_info = path_info[len(script_name):]
+    server = scope.get('server') or ('localhost', 80)
+    environ = {'REQUEST_METHOD': scope['method'],
+               'SCRIPT_NAME': script_name,
+               'PATH_INFO': path_info,
+               'QUERY_STRING': scope['query_string'].decode('latin1'),
+               'SERVER_NAME': server[0],
+               'SERVER_PORT': str(server[1]),
+               'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+               'wsgi.version': (1, 0),
+               'wsgi.url_scheme': scope.get('scheme', 'http'),
+               'wsgi.input': io.BytesIO(),
+               'wsgi.errors': sys.stderr,
+               'wsgi.multithread': True,
+               'wsgi.multiprocess': True,
+               'wsgi.run_once': False}
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin1').upper().replace('-', '_')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        value = value.decode('latin1')
+        environ[name] = environ[name] + ',' + value if name in environ \
+            else value
+    return environ
+
+
+def _snapshot_ready():
+    snapshots = app.extensions['catalog'].snapshots
+    # never waits for the first load on the event loop
+    return snapshots is not None and snapshots.current is not None and \
+        current_snapshot() is not None
+
+
+async def _respond(view, view_args):
+    if _snapshot_ready():
+        # memory lookups only, the Flask view can run on the event loop
+        return app.view_functions[request.endpoint](**view_args)
+
+    async with AsyncDBSession() as db:
+        if reads_from_primary():
+            db.sync_session.use_primary()
+        try:
+            return await _conditional(view, db, view_args)
+        except DBAPIError:
+            replica = db.sync_session.info.get('replica')
+            if replica is None or async_replica_set.is_up(replica):
+                raise
+    # the replica failed and is left out from now on, ask the primary
+    async with AsyncDBSession() as db:
+        db.sync_session.use_primary()
+        return await _conditional(view, db, view_args)
+
+
+async def _dispatch(view, view_args):
+    """Response of view, run the way Flask runs its views: request hooks,
+    error handlers and the session saved by process_response
+    """
+    try:
+        response = None
+        if 'admission' in app.extensions:
+            response = await app.extensions['admission'].admit_async()
+        if response is None:
+            response = app.preprocess_request()
+        if response is None:
+            response = await _respond(view, view_args)
+    except HTTPException as e:
+        response = app.handle_user_exception(e)
+    except Exception as e:
+        response = app.handle_exception(e)
+    return app.process_response(app.make_response(response))
+
+
+async def _send(response, send, head):
+    headers = [(name.lower().encode('latin1'), value.encode('latin1'))
+               for name, value in response.headers.items()]
+    await send({'type': 'http.response.start',
+                'status': response.status_code,
+                'headers': headers})
+    await send({'type': 'http.response.body',
+                'body': b'' if head else response.get_data()})
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                check_secret_key(app.secret_key, app.debug)
+            except RuntimeError as e:
+                await send({'type': 'lifespan.startup.failed',
+                            'message': str(e)})
+                return
+            snapshots = app.extensions['catalog'].snapshots
+            if snapshots is not None:
+                await asyncio.get_running_loop().run_in_executor(
+                    None, snapshots.get)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            for engine in [async_engine] + async_replicas:
+                await engine.dispose()
+            app.extensions['catalog'].dispose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await _lifespan(receive, send)
+    if scope['type'] != 'http' or scope['method'] not in ('GET', 'HEAD'):
+        return await flask_application(scope, receive, send)
+
+    environ = _environ(scope)
+    try:
+        endpoint, view_args = app.url_map.bind_to_environ(environ).match()
+    except HTTPException:
+        endpoint = None
+    view = VIEWS.get(endpoint)
+    if view is None:
+        return await flask_application(scope, receive, send)
+
+    with app.request_context(environ):
+        response = await _dispatch(view, view_args)
+    await _send(response, send, scope['method'] == 'HEAD')
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""Fingerprinted static files.
+
+asset_url('style.css') in the templates is the URL of the file built by
+build_assets.py, /assets/style.3f2a9c1d0b4e.css, served with a year
+long immutable Cache-Control: its name changes with its content, so
+browsers never revalidate it. Clients accepting brotli or gzip get the
+precompressed variant. Without a build (no manifest) asset_url is the
+plain static URL, revalidated as before.
+"""
+
+import json
+import mimetypes
+import os
+import threading
+
+from flask import request, send_from_directory, url_for
+from werkzeug.security import safe_join
+
+from build_assets import BUILD_DIR, MANIFEST
+
+
+# precompressed variants, preferred first
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+class Assets(object):
+
+    def __init__(self, app=None):
+        self._manifest = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.directory = os.path.join(app.static_folder, BUILD_DIR)
+        self.max_age = app.config['ASSET_MAX_AGE']
+        app.add_url_rule('/assets/<path:filename>', 'asset', self.send)
+        app.jinja_env.globals['asset_url'] = self.url
+
+    @property
+    def manifest(self):
+        """Source name -> built name, read once, empty without a build"""
+        with self._lock:
+            if self._manifest is None:
+                try:
+                    with open(os.path.join(self.directory, MANIFEST)) as f:
+                        self._manifest = json.load(f)
+                except FileNotFoundError:
+                    self._manifest = {}
+            return self._manifest
+
+    def url(self, filename):
+        built = self.manifest.get(filename)
+        if built is None:
+            return url_for('static', filename=filename)
+        return url_for('asset', filename=built)
+
+    def send(self, filename):
+        mimetype = mimetypes.guess_type(filename)[0]
+        for encoding, suffix in ENCODINGS:
+            path = safe_join(self.directory, filename + suffix)
+            if request.accept_encodings[encoding] and path and \
+                    os.path.isfile(path):
+                response = send_from_directory(
+                    self.directory, filename + suffix, mimetype=mimetype,
+                    max_age=self.max_age)
+                response.content_encoding = encoding
+                break
+        else:
+            response = send_from_directory(self.directory, filename,
+                                           mimetype=mimetype,
+                                           max_age=self.max_age)
+        response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
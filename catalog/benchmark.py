@@ -0,0 +1,458 @@
+#!/usr/bin/env python3
+"""Benchmark of the catalog routes.
+
+Drives every page, the JSON endpoints and the add/edit/delete item flow
+through the Flask test client against the database at --database-url
+(a throwaway SQLite file by default, seeded by seed_data), and reports
+per scenario requests/sec, latency percentiles, SQL statements and
+bytes sent per request (compressed with --accept-encoding gzip or br).
+Results are written as JSON so runs on different commits can
+be compared.
+
+--serialization also times encoding --serialization-rows items to JSON
+through ORM instances and their serialize property, as the JSON
+endpoints used to, against the column rows of serializers, reporting
+rows/sec and the peak memory (tracemalloc) of each path.
+
+--startup times new processes importing catalog_service and serving
+their first page, with the on-disk Jinja bytecode cache off and warm.
+
+--workers 1 2 4 serves the database with gunicorn (gunicorn.conf.py) at
+each of these worker counts in turn and sends the read scenarios over
+HTTP from --clients threads, each on its own keep-alive connection,
+reporting requests/sec and latency percentiles per worker count.
+
+Usage:
+    python benchmark.py --items 100000 --requests 500 --output run.json
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import secrets
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from instrumentation import percentile
+
+
+class Recorder(object):
+    """Counts the statements the app sends to the database"""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.statements = 0
+        event.listen(engine, 'after_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self.statements += 1
+
+
+def run_scenario(client, recorder, requests, headers=None):
+    """Issues requests, a list of (method, url, form data) and returns
+    their statistics
+    """
+    latencies = []
+    statuses = {}
+    sent = 0
+    statements = recorder.statements
+    started = time.perf_counter()
+    for method, url, data in requests:
+        begin = time.perf_counter()
+        response = client.open(url, method=method, data=data,
+                               headers=headers)
+        sent += len(response.get_data())
+        latencies.append((time.perf_counter() - begin) * 1000)
+        statuses[response.status_code] = \
+            statuses.get(response.status_code, 0) + 1
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {'requests': len(requests),
+            'requests_per_sec': len(requests) / elapsed,
+            'latency_ms': {'p50': percentile(latencies, 0.50),
+                           'p95': percentile(latencies, 0.95),
+                           'p99': percentile(latencies, 0.99),
+                           'max': latencies[-1]},
+            'queries_per_request':
+                (recorder.statements - statements) / len(requests),
+            'bytes_per_request': sent / len(requests),
+            'statuses': {str(k): v for k, v in statuses.items()}}
+
+
+def run_http_scenario(address, requests, clients, headers=None):
+    """Issues the GET requests of a scenario to the server at address,
+    (host, port), from clients threads and returns their statistics
+    """
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+
+    def client(share):
+        connection = http.client.HTTPConnection(*address, timeout=60)
+        for _, url, _ in share:
+            begin = time.perf_counter()
+            connection.request('GET', url, headers=headers or {})
+            response = connection.getresponse()
+            response.read()
+            latency = (time.perf_counter() - begin) * 1000
+            with lock:
+                latencies.append(latency)
+                statuses[response.status] = \
+                    statuses.get(response.status, 0) + 1
+        connection.close()
+
+    threads = [threading.Thread(target=client, args=(requests[n::clients],))
+               for n in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {'requests': len(requests),
+            'requests_per_sec': len(requests) / elapsed,
+            'latency_ms': {'p50': percentile(latencies, 0.50),
+                           'p95': percentile(latencies, 0.95),
+                           'p99': percentile(latencies, 0.99),
+                           'max': latencies[-1]},
+            'statuses': {str(k): v for k, v in statuses.items()}}
+
+
+def _wait_for_workers(server, log, workers, timeout=300):
+    """Waits until the workers of the gunicorn server logging to log
+    are warmed up
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError('gunicorn exited with {0}'
+                               .format(server.returncode))
+        log.seek(0)
+        if log.read().count(b'warmed up') >= workers:
+            return
+        time.sleep(0.2)
+    raise RuntimeError('gunicorn workers not up in {0} s'.format(timeout))
+
+
+def measure_workers(database_url, scenarios, counts, clients, headers=None):
+    """Statistics of the GET scenarios by scenario, served by gunicorn
+    with each of counts workers
+    """
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        address = probe.getsockname()
+    # no recycling of the workers while they are measured
+    env = dict(os.environ, DATABASE_URL=database_url,
+               BIND='{0}:{1}'.format(*address), MAX_REQUESTS='0')
+    env.setdefault('SECRET_KEY', secrets.token_hex(16))
+    results = {}
+    for workers in counts:
+        env['WEB_CONCURRENCY'] = str(workers)
+        with tempfile.TemporaryFile() as log:
+            server = subprocess.Popen(
+                [sys.executable, '-m', 'gunicorn'], env=env,
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                stdout=subprocess.DEVNULL, stderr=log)
+            try:
+                _wait_for_workers(server, log, workers)
+                results[workers] = {
+                    name: run_http_scenario(address, requests, clients,
+                                            headers)
+                    for name, requests in scenarios
+                    if all(method == 'GET' for method, _, _ in requests)}
+            finally:
+                server.terminate()
+                server.wait()
+    return results
+
+
+def build_scenarios(session, count, rnd):
+    """Requests of every scenario, on categories and items picked from
+    the database, plus the owner to log in for the write scenarios
+    """
+    from urllib.parse import quote
+    from database_setup import Category, Item
+
+    categories = session.query(Category.name, Category.user_id).all()
+    items = session\
+        .query(Item.title, Category.name)\
+        .join(Category, Item.category_id == Category.id)\
+        .order_by(Item.id.desc())\
+        .limit(10000)\
+        .all()
+
+    def some_category():
+        return quote(rnd.choice(categories).name)
+
+    def some_item():
+        title, category = rnd.choice(items)
+        return quote(category), quote(title)
+
+    scenarios = [
+        ('catalog', [('GET', '/catalog', None)] * count),
+        ('category', [('GET', '/catalog/{}/items'.format(some_category()),
+                       None) for _ in range(count)]),
+        ('item', [('GET', '/catalog/{0}/{1}'.format(*some_item()), None)
+                  for _ in range(count)]),
+        ('catalog_json', [('GET', '/catalog/json', None)] *
+         max(1, count // 10)),
+        ('category_json', [('GET', '/catalog/{}/json'
+                            .format(some_category()), None)
+                           for _ in range(count)]),
+        ('item_json', [('GET', '/catalog/{0}/{1}/json'.format(*some_item()),
+                        None) for _ in range(count)]),
+    ]
+
+    owner_category, owner = rnd.choice(categories)
+    titles = ['bench {0} {1}'.format(rnd.getrandbits(32), n)
+              for n in range(count)]
+    scenarios += [
+        ('add_item', [('POST', '/catalog/{}/items/new'
+                       .format(quote(owner_category)),
+                       {'title': t, 'description': 'benchmark'})
+                      for t in titles]),
+        ('edit_item', [('POST', '/catalog/{0}/{1}/edit'
+                        .format(quote(owner_category), quote(t)),
+                        {'title': t, 'description': 'edited',
+                         'category': owner_category})
+                       for t in titles]),
+        ('delete_item', [('POST', '/catalog/items/{}/delete'.format(quote(t)),
+                          None) for t in titles]),
+    ]
+    return scenarios, owner
+
+
+def compare_serialization(session_factory, rows, rounds=5):
+    """rows/sec and peak memory of serializing rows items through the
+    ORM and through serializers, best of rounds
+    """
+    import serializers
+    from database_setup import Item
+
+    def orm(session):
+        items = session.query(Item).order_by(Item.id).limit(rows)
+        return json.dumps({'Items': [i.serialize for i in items]},
+                          sort_keys=True, separators=(',', ':')).encode()
+
+    def lean(session):
+        items = session\
+            .query(*serializers.ITEM_COLUMNS)\
+            .order_by(Item.id)\
+            .limit(rows)
+        return serializers.dumps(
+            {'Items': [serializers.item(row) for row in items]})
+
+    results = {}
+    outputs = {}
+    for name, path in (('orm', orm), ('lean', lean)):
+        best = None
+        for _ in range(rounds):
+            session = session_factory()
+            started = time.perf_counter()
+            outputs[name] = path(session)
+            elapsed = time.perf_counter() - started
+            session.close()
+            best = elapsed if best is None else min(best, elapsed)
+
+        session = session_factory()
+        tracemalloc.start()
+        path(session)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        session.close()
+        results[name] = {'rows_per_sec': rows / best,
+                         'peak_memory_kb': peak / 1024.0}
+    results['rows'] = rows
+    results['same_output'] = outputs['orm'] == outputs['lean']
+    return results
+
+
+# run by the new processes of measure_startup
+STARTUP = """
+import json, time
+started = time.perf_counter()
+import catalog_service
+imported = time.perf_counter()
+response = catalog_service.app.test_client().get('/catalog')
+response.get_data()
+print(json.dumps({'import_ms': (imported - started) * 1000,
+                  'first_request_ms': (time.perf_counter() - imported) * 1000,
+                  'status': response.status_code}))
+"""
+
+
+def measure_startup(database_url, runs=5):
+    """Median import and first request times of runs new processes,
+    compiling the templates in every process and reusing the ones
+    compiled by a first process
+    """
+    template_dir = tempfile.mkdtemp(prefix='catalog-bench-templates-')
+    results = {}
+    try:
+        for name, cache_dir in (('no_template_cache', ''),
+                                ('template_cache', template_dir)):
+            env = dict(os.environ, DATABASE_URL=database_url,
+                       TEMPLATE_CACHE_DIR=cache_dir)
+            timings = []
+            # the first process fills the cache
+            for _ in range(runs + 1):
+                started = time.perf_counter()
+                output = subprocess.check_output(
+                    [sys.executable, '-c', STARTUP], env=env,
+                    cwd=os.path.dirname(os.path.abspath(__file__)),
+                    stderr=subprocess.DEVNULL)
+                timing = json.loads(output.decode().splitlines()[-1])
+                timing['process_ms'] = (time.perf_counter() - started) * 1000
+                timings.append(timing)
+            timings = timings[1:]
+            results[name] = {
+                key: sorted(t[key] for t in timings)[len(timings) // 2]
+                for key in ('import_ms', 'first_request_ms', 'process_ms')}
+    finally:
+        shutil.rmtree(template_dir, ignore_errors=True)
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the catalog '
+                                                 'routes')
+    parser.add_argument('--database-url',
+                        help='database to run against, a new SQLite file '
+                             'when omitted')
+    parser.add_argument('--no-seed', action='store_true',
+                        help='use the data already in the database')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--categories', type=int, default=200)
+    parser.add_argument('--items', type=int, default=20000)
+    parser.add_argument('--requests', type=int, default=200,
+                        help='requests per scenario')
+    parser.add_argument('--only', nargs='*',
+                        help='names of the scenarios to run')
+    parser.add_argument('--serialization', action='store_true',
+                        help='compare ORM and column row serialization')
+    parser.add_argument('--serialization-rows', type=int, default=5000)
+    parser.add_argument('--startup', action='store_true',
+                        help='time the start of new processes')
+    parser.add_argument('--workers', type=int, nargs='*',
+                        help='gunicorn worker counts to serve the read '
+                             'scenarios over HTTP with')
+    parser.add_argument('--clients', type=int, default=8,
+                        help='concurrent HTTP clients of --workers')
+    parser.add_argument('--accept-encoding',
+                        help='Accept-Encoding header of the requests')
+    parser.add_argument('--output', help='file to write the results to')
+    args = parser.parse_args()
+
+    scratch = None
+    if args.database_url is None:
+        handle, scratch = tempfile.mkstemp(suffix='.db',
+                                           prefix='catalog-bench-')
+        os.close(handle)
+        args.database_url = 'sqlite:///' + scratch
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, '.')
+
+    from catalog_service import create_app
+    from database_setup import create_tables
+    from seed_data import seed
+
+    app = create_app({'DATABASE_URL': args.database_url})
+    resources = app.extensions['catalog']
+    create_tables(resources.engine)
+    dataset = None
+    if not args.no_seed:
+        dataset = seed(resources.engine, args.users, args.categories,
+                       args.items)
+
+    rnd = random.Random(1)
+    recorder = Recorder(resources.engine)
+    scenarios, owner = build_scenarios(resources.session_factory(),
+                                       args.requests, rnd)
+
+    client = app.test_client()
+    headers = {}
+    if args.accept_encoding:
+        headers['Accept-Encoding'] = args.accept_encoding
+    with client.session_transaction() as login_session:
+        login_session['user_id'] = owner
+
+    if args.only:
+        scenarios = [(name, requests) for name, requests in scenarios
+                     if name in args.only]
+
+    results = {}
+    for name, requests in scenarios:
+        results[name] = run_scenario(client, recorder, requests, headers)
+        print('{0:15} {1:9.1f} req/s  p50 {2:7.2f} ms  p99 {3:7.2f} ms  '
+              '{4:6.1f} queries/req {5:9.0f} bytes/req'
+              .format(name, results[name]['requests_per_sec'],
+                      results[name]['latency_ms']['p50'],
+                      results[name]['latency_ms']['p99'],
+                      results[name]['queries_per_request'],
+                      results[name]['bytes_per_request']))
+
+    if args.serialization:
+        results['serialization'] = compare_serialization(
+            resources.session_factory, args.serialization_rows)
+        for name in ('orm', 'lean'):
+            print('{0:15} {1:9.1f} rows/s  peak {2:9.1f} KiB'
+                  .format('serialize_' + name,
+                          results['serialization'][name]['rows_per_sec'],
+                          results['serialization'][name]['peak_memory_kb']))
+
+    if args.workers:
+        results['workers'] = measure_workers(
+            args.database_url, scenarios, args.workers, args.clients,
+            headers)
+        for workers, stats in sorted(results['workers'].items()):
+            for name, result in stats.items():
+                print('{0} workers {1:15} {2:9.1f} req/s  p50 {3:7.2f} ms  '
+                      'p99 {4:7.2f} ms'
+                      .format(workers, name, result['requests_per_sec'],
+                              result['latency_ms']['p50'],
+                              result['latency_ms']['p99']))
+
+    if args.startup:
+        results['startup'] = measure_startup(args.database_url)
+        for name, timing in sorted(results['startup'].items()):
+            print('{0:18} import {1:7.1f} ms  first request {2:7.1f} ms  '
+                  'process {3:7.1f} ms'
+                  .format(name, timing['import_ms'],
+                          timing['first_request_ms'], timing['process_ms']))
+
+    report = {'revision': git_revision(),
+              'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'database': resources.engine.url.get_backend_name(),
+              'dataset': dataset,
+              'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    if scratch is not None:
+        resources.dispose()
+        os.remove(scratch)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""Build step of the static files.
+
+Copies every file of static/ to static/build/ under a name carrying a
+hash of its content (style.css -> style.3f2a9c1d0b4e.css), next to its
+gzip and, when the brotli package is installed, brotli variants
+compressed at their highest level, and writes static/build/manifest.json
+mapping the source names to the built ones for assets.py. Files of
+earlier builds are kept for the pages still referring to them unless
+--clean is given. Run it on deploy, after any change of the static
+files:
+
+    python build_assets.py
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'static')
+BUILD_DIR = 'build'
+MANIFEST = 'manifest.json'
+# files worth compressing, by extension
+COMPRESSIBLE = ('.css', '.js', '.svg', '.json', '.txt', '.html')
+
+
+def hashed_name(name, data):
+    """name with the first 12 hex digits of the SHA-256 of data"""
+    base, extension = os.path.splitext(name)
+    return '{0}.{1}{2}'.format(base, hashlib.sha256(data).hexdigest()[:12],
+                               extension)
+
+
+def _write(path, data):
+    """Writes path atomically, running workers never see half a file"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(data)
+    os.replace(path + '.tmp', path)
+
+
+def _variants(data):
+    """(suffix, data) of the compressed variants smaller than data"""
+    variants = [('.gz', gzip.compress(data, 9, mtime=0))]
+    if brotli is not None:
+        variants.append(('.br', brotli.compress(data, quality=11)))
+    return [(suffix, compressed) for suffix, compressed in variants
+            if len(compressed) < len(data)]
+
+
+def build(static_dir=STATIC_DIR, clean=False):
+    """Builds the files of static_dir, returning the manifest"""
+    build_dir = os.path.join(static_dir, BUILD_DIR)
+    manifest = {}
+    written = set()
+    for root, dirs, files in os.walk(static_dir):
+        dirs[:] = [d for d in dirs if os.path.join(root, d) != build_dir]
+        for filename in sorted(files):
+            source = os.path.join(root, filename)
+            name = os.path.relpath(source, static_dir).replace(os.sep, '/')
+            with open(source, 'rb') as f:
+                data = f.read()
+
+            built = hashed_name(name, data)
+            target = os.path.join(build_dir, built)
+            _write(target, data)
+            written.add(target)
+            if name.endswith(COMPRESSIBLE):
+                for suffix, compressed in _variants(data):
+                    _write(target + suffix, compressed)
+                    written.add(target + suffix)
+            manifest[name] = built
+
+    _write(os.path.join(build_dir, MANIFEST),
+           json.dumps(manifest, indent=2, sort_keys=True).encode('utf8'))
+    if clean:
+        written.add(os.path.join(build_dir, MANIFEST))
+        for root, dirs, files in os.walk(build_dir):
+            for filename in files:
+                path = os.path.join(root, filename)
+                if path not in written:
+                    os.remove(path)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Build the fingerprinted and compressed static files')
+    parser.add_argument('--static-dir', default=STATIC_DIR)
+    parser.add_argument('--clean', action='store_true',
+                        help='remove the files of earlier builds')
+    args = parser.parse_args()
+
+    manifest = build(args.static_dir, args.clean)
+    for name, built in sorted(manifest.items()):
+        print('{0} -> {1}'.format(name, built))
+    if brotli is None:
+        print('brotli is not installed, only gzip variants were written')
+
+
+if __name__ == "__main__":
+    main()
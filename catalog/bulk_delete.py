@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""Deletion of many categories or items at once.
+
+Each call issues a handful of set-based statements whatever the number
+of rows: the change log entries are written with INSERT ... SELECT, the
+rows deleted with one DELETE per table and the summaries adjusted in
+SQL. No row is
+loaded into the session, so memory stays flat. Callers commit.
+
+Usage:
+    python bulk_delete.py categories "Old stuff" Misc
+    python bulk_delete.py items --owner someone@example.com --dry-run
+"""
+
+import argparse
+
+from database_setup import Category, Item
+import revisions
+import changes as change_log
+import summaries
+
+
+def delete_categories(session, id_query):
+    """Deletes the categories selected by id_query, a query of
+    Category.id, with their items. Returns the number of categories
+    deleted
+    """
+    revisions.bump(session)
+    ids = id_query.statement
+    change_log.record_selected(session, change_log.ITEM,
+                               session.query(Item.id)
+                               .filter(Item.category_id.in_(ids)),
+                               change_log.DELETE)
+    change_log.record_selected(session, change_log.CATEGORY, id_query,
+                               change_log.DELETE)
+    # not left to ON DELETE CASCADE, which older databases (SQLite files
+    # above all, migrate can not alter them) do not have
+    session\
+        .query(Item)\
+        .filter(Item.category_id.in_(ids))\
+        .delete(synchronize_session=False)
+    deleted = session\
+        .query(Category)\
+        .filter(Category.id.in_(ids))\
+        .delete(synchronize_session=False)
+    summaries.category_deleted(session)
+    return deleted
+
+
+def delete_items(session, id_query):
+    """Deletes the items selected by id_query, a query of Item.id.
+    Returns the number of items deleted
+    """
+    revisions.bump(session)
+    ids = id_query.statement
+    change_log.record_selected(session, change_log.ITEM, id_query,
+                               change_log.DELETE)
+    summaries.items_deleting(session, ids)
+    deleted = session\
+        .query(Item)\
+        .filter(Item.id.in_(ids))\
+        .delete(synchronize_session=False)
+    summaries.rebuild_latest(session)
+    return deleted
+
+
+def _chunks(lines, size):
+    chunk = []
+    for line in lines:
+        line = line.strip()
+        if line:
+            chunk.append(line)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+if __name__ == "__main__":
+    from sqlalchemy.orm import sessionmaker
+
+    from config import Config
+    from database_setup import User, create_db_engine
+
+    parser = argparse.ArgumentParser(description='Delete categories (with '
+                                                 'their items) or items of '
+                                                 'the catalog at DATABASE_URL '
+                                                 'in one transaction')
+    parser.add_argument('what', choices=['categories', 'items'])
+    parser.add_argument('names', nargs='*',
+                        help='names of the categories or titles of the items')
+    parser.add_argument('--file',
+                        help='file of names or titles, one per line')
+    parser.add_argument('--owner',
+                        help='email of the user whose categories or items '
+                             'to delete')
+    parser.add_argument('--category',
+                        help='with items, the category whose items to delete')
+    parser.add_argument('--chunk-size', type=int, default=1000,
+                        help='names per statement')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='report what would be deleted, change nothing')
+    args = parser.parse_args()
+
+    session = sessionmaker(bind=create_db_engine(Config.DATABASE_URL))()
+    model, key, delete = (Category, Category.name, delete_categories) \
+        if args.what == 'categories' else (Item, Item.title, delete_items)
+
+    filters = []
+    if args.owner:
+        user = session.query(User).filter_by(email=args.owner).first()
+        if user is None:
+            raise SystemExit('No user with email {}'.format(args.owner))
+        filters.append(model.user_id == user.id)
+    if args.category and model is Item:
+        filters.append(Item.category_id.in_(
+            session.query(Category.id)
+            .filter_by(name=args.category)
+            .statement))
+
+    deleted = 0
+    names = args.names
+    if args.file:
+        names = open(args.file, encoding='utf-8')
+    if args.names or args.file:
+        for chunk in _chunks(names, args.chunk_size):
+            deleted += delete(session, session
+                              .query(model.id)
+                              .filter(key.in_(chunk), *filters))
+    elif filters:
+        deleted = delete(session, session.query(model.id).filter(*filters))
+    else:
+        raise SystemExit('Name the {} to delete, or select them with '
+                         '--owner or --category'.format(args.what))
+
+    if args.dry_run:
+        session.rollback()
+        print('{0} {1} would be deleted'.format(deleted, args.what))
+    else:
+        session.commit()
+        print('{0} {1} deleted'.format(deleted, args.what))
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""Batch import of items (and their categories) from JSON or CSV.
+
+Records have a `title`, a `category` name and an optional
+`description`. Category names are resolved with one query per chunk of
+names, ownership is checked once per category, and the items are
+written with one multi-row INSERT per chunk, each chunk in its own
+transaction. Invalid rows are reported with their position and skipped,
+the rest of the batch still goes in.
+
+Usage:
+    python bulk_import.py items.csv --email owner@example.com
+"""
+
+import argparse
+import csv
+import io
+import json
+
+from sqlalchemy.exc import IntegrityError
+
+from database_setup import Category, Item, User
+import revisions
+import changes as change_log
+import summaries
+
+
+TITLE_LENGTH = Item.__table__.c.title.type.length
+DESCRIPTION_LENGTH = Item.__table__.c.description.type.length
+NAME_LENGTH = Category.__table__.c.name.type.length
+
+
+def parse_records(data, content_type):
+    """List of record dicts from a JSON or CSV document"""
+    if isinstance(data, bytes):
+        data = data.decode('utf-8')
+    if 'csv' in content_type:
+        return list(csv.DictReader(io.StringIO(data)))
+    records = json.loads(data)
+    if isinstance(records, dict):
+        records = records.get('Items', [])
+    if not isinstance(records, list):
+        raise ValueError('Expected a list of items')
+    return records
+
+
+def _chunks(values, size):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def _validate(records, errors):
+    """(row number, title, description, category name) of the valid
+    records, errors of the others appended to errors
+    """
+    valid = []
+    seen = set()
+    for number, record in enumerate(records, 1):
+        if not isinstance(record, dict):
+            errors.append({'row': number, 'error': 'Not an object'})
+            continue
+        if any(not isinstance(record.get(field), (str, type(None)))
+               for field in ('title', 'category', 'description')):
+            errors.append({'row': number,
+                           'error': 'title, category and description must '
+                                    'be strings'})
+            continue
+        title = (record.get('title') or '').strip()
+        category = (record.get('category') or '').strip()
+        description = record.get('description') or None
+        if not title or not category:
+            errors.append({'row': number,
+                           'error': 'title and category are required'})
+        elif len(title) > TITLE_LENGTH or len(category) > NAME_LENGTH or \
+                (description and len(description) > DESCRIPTION_LENGTH):
+            errors.append({'row': number, 'error': 'Value too long'})
+        elif title in seen:
+            errors.append({'row': number,
+                           'error': 'Duplicate title {}'.format(title)})
+        else:
+            seen.add(title)
+            valid.append((number, title, description, category))
+    return valid
+
+
+def _resolve_categories(session, user_id, names, chunk_size,
+                        create_categories):
+    """Maps category names to (id, owner id), creating the missing ones
+    for user_id when create_categories is set
+    """
+    categories = {}
+    for chunk in _chunks(sorted(names), chunk_size):
+        rows = session\
+            .query(Category.name, Category.id, Category.user_id)\
+            .filter(Category.name.in_(chunk))
+        categories.update((name, (id, owner)) for name, id, owner in rows)
+
+    missing = [name for name in names if name not in categories]
+    if missing and create_categories:
+        revisions.bump(session)
+        for chunk in _chunks(missing, chunk_size):
+            session.execute(Category.__table__.insert(),
+                            [{'name': name, 'user_id': user_id}
+                             for name in chunk])
+            change_log.record_categories(session, chunk, change_log.INSERT)
+            rows = session\
+                .query(Category.name, Category.id, Category.user_id)\
+                .filter(Category.name.in_(chunk))
+            categories.update((name, (id, owner)) for name, id, owner in rows)
+        session.commit()
+    return categories, len(missing) if create_categories else 0
+
+
+def _category_counts(rows):
+    counts = {}
+    for row in rows:
+        counts[row['category_id']] = counts.get(row['category_id'], 0) + 1
+    return counts
+
+
+def _insert_chunk(session, rows, numbers, errors):
+    """Inserts rows in one statement and commits them. When that fails,
+    retries them one by one to report which ones are at fault
+    """
+    try:
+        revisions.bump(session)
+        session.execute(Item.__table__.insert(), rows)
+        change_log.record_items(session, rows, change_log.INSERT)
+        summaries.items_inserted(session, _category_counts(rows))
+        session.commit()
+        return len(rows)
+    except IntegrityError:
+        session.rollback()
+
+    revisions.bump(session)
+    inserted = []
+    for number, row in zip(numbers, rows):
+        try:
+            with session.begin_nested():
+                session.execute(Item.__table__.insert(), [row])
+            inserted.append(row)
+        except IntegrityError:
+            errors.append({'row': number,
+                           'error': 'Item {} already exists'
+                           .format(row['title'])})
+    if inserted:
+        change_log.record_items(session, inserted, change_log.INSERT)
+        summaries.items_inserted(session, _category_counts(inserted))
+    session.commit()
+    return len(inserted)
+
+
+def import_items(session, user_id, records, chunk_size=1000,
+                 create_categories=True):
+    """Imports records as items owned by user_id.
+
+    Returns {'inserted': n, 'categories_created': n, 'errors': [...]},
+    every error naming the 1-based position of its record.
+    """
+    errors = []
+    valid = _validate(records, errors)
+
+    categories, created = _resolve_categories(
+        session, user_id, {category for _, _, _, category in valid},
+        chunk_size, create_categories)
+
+    pending = []
+    for number, title, description, category_name in valid:
+        category = categories.get(category_name)
+        if category is None:
+            errors.append({'row': number,
+                           'error': 'Category {} not found'
+                           .format(category_name)})
+        elif category[1] != user_id:
+            errors.append({'row': number,
+                           'error': 'You are not authorized to add item to {}'
+                           .format(category_name)})
+        else:
+            pending.append((number, {'title': title,
+                                     'description': description,
+                                     'category_id': category[0],
+                                     'user_id': user_id}))
+
+    inserted = 0
+    for chunk in _chunks(pending, chunk_size):
+        numbers = [number for number, _ in chunk]
+        rows = [row for _, row in chunk]
+        existing = {title for title, in session
+                    .query(Item.title)
+                    .filter(Item.title.in_([r['title'] for r in rows]))}
+        if existing:
+            for number, row in zip(numbers, rows):
+                if row['title'] in existing:
+                    errors.append({'row': number,
+                                   'error': 'Item {} already exists'
+                                   .format(row['title'])})
+            chunk = [(n, r) for n, r in zip(numbers, rows)
+                     if r['title'] not in existing]
+            numbers = [number for number, _ in chunk]
+            rows = [row for _, row in chunk]
+        if rows:
+            inserted += _insert_chunk(session, rows, numbers, errors)
+
+    errors.sort(key=lambda e: e['row'])
+    return {'inserted': inserted,
+            'categories_created': created,
+            'errors': errors}
+
+
+if __name__ == "__main__":
+    from sqlalchemy.orm import sessionmaker
+
+    from config import Config
+    from database_setup import create_db_engine
+
+    parser = argparse.ArgumentParser(description='Import items into the '
+                                                 'catalog at DATABASE_URL')
+    parser.add_argument('file', help='.json or .csv file of items')
+    parser.add_argument('--email', required=True,
+                        help='email of the user owning the items')
+    parser.add_argument('--chunk-size', type=int, default=1000,
+                        help='items per INSERT and transaction')
+    parser.add_argument('--no-create-categories', action='store_true',
+                        help='reject items of unknown categories instead '
+                             'of creating them')
+    args = parser.parse_args()
+
+    session = sessionmaker(bind=create_db_engine(Config.DATABASE_URL))()
+    user = session.query(User).filter_by(email=args.email).first()
+    if user is None:
+        raise SystemExit('No user with email {}'.format(args.email))
+
+    with open(args.file, encoding='utf-8') as f:
+        records = parse_records(f.read(), 'csv' if args.file.endswith('.csv')
+                                else 'json')
+    result = import_items(session, user.id, records, args.chunk_size,
+                          not args.no_create_categories)
+
+    for error in result['errors']:
+        print('row {row}: {error}'.format(**error))
+    print('{0} items imported, {1} categories created, {2} rows rejected'
+          .format(result['inserted'], result['categories_created'],
+                  len(result['errors'])))
@@ -2,54 +2,368 @@
 
 from flask import Flask, redirect,\
     url_for, render_template,\
-    request, flash, jsonify
+    request, flash, jsonify, abort, Response, stream_with_context, g,\
+    current_app
 # imports for the login
 from flask import session as login_session
-from oauth2client.client import flow_from_clientsecrets
-from oauth2client.client import FlowExchangeError
-import httplib2
 import json
 from flask import make_response
-import requests
+import csv
 import random
 import string
+import functools
+import datetime
+import os
+import time
+
+from jinja2 import FileSystemBytecodeCache
+from sqlalchemy.exc import DBAPIError, IntegrityError
+from sqlalchemy.orm import scoped_session, exc
+from werkzeug.local import LocalProxy
+from database_setup import Category, Item, User, Change
+from instrumentation import Instrumentation
+from admission import Admission
+from assets import Assets
+from compression import Compression
+from lookup_cache import CategoryRef, ItemRef
+from pagination import keyset_page, encode_cursor, decode_cursor
+import revisions
+import changes as change_log
+import bulk_import
+import bulk_delete
+import summaries
+import serializers
+from search import search_items
+from fragment_cache import FragmentCacheExtension, create_backend
+from server_session import create_session_interface
+from google_auth import AuthError
+from resources import Resources
+from snapshot import Snapshot
+
+
+# Views of the app, (rule, view, options) registered on every app made
+# by create_app under the name of their view, as app.route would
+routes = []
+
+
+def route(rule, **options):
+    def register(view):
+        routes.append((rule, view, options))
+        return view
+    return register
+
+
+def resources():
+    """Resources of the current app"""
+    return current_app.extensions['catalog']
+
+
+# One session per request (thread), released in remove_session
+session = scoped_session(lambda: resources().session_factory())
+# Sign in calls to Google and the lookup caches of the current app
+google = LocalProxy(lambda: resources().google)
+category_refs = LocalProxy(lambda: resources().category_refs)
+item_refs = LocalProxy(lambda: resources().item_refs)
+APPLICATION_NAME = "Catalog app Client"
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, exc
-from database_setup import Base, Category, Item, User
 
+def reads_from_primary():
+    """Whether the request has to read from the primary: it is not a
+    GET, or its client wrote less than REPLICA_STICKY_SECONDS ago and
+    replicas may not have its change yet
+    """
+    return request.method not in ('GET', 'HEAD') or\
+        login_session.get('primary_until', 0) > time.time()
 
-app = Flask(__name__)
 
-engine = create_engine('postgresql:///catalog')
-Base.metadata.bind = engine
-DBSession = sessionmaker(bind=engine)
-session = DBSession()
+def route_reads():
+    if resources().replica_set is not None and reads_from_primary():
+        session().use_primary()
 
 
-CLIENT_ID = json.loads(
-    open('client_secrets.json', 'r').read())['web']['client_id']
-APPLICATION_NAME = "Catalog app Client"
+def stick_to_primary(response):
+    """Keeps the client of a write on the primary for a while, and off
+    the catalog snapshot until it has the revision the write produced
+    """
+    if not session().wrote:
+        return response
+    if resources().replica_set is not None:
+        login_session['primary_until'] = \
+            time.time() + current_app.config['REPLICA_STICKY_SECONDS']
+    if resources().snapshots is not None:
+        # read from the primary after the commit, a write rolled back
+        # leaves the revision where it was
+        login_session['written_revision'] = revisions.current(session)[0]
+    return response
+
+
+def remove_session(exception=None):
+    """Rolls back whatever the request left uncommitted and returns its
+    connection to the pool
+    """
+    if exception is not None:
+        session.rollback()
+    session.remove()
+
+
+def __commit_catalog_change(duplicate_message=None, write=None, log=()):
+    """Commits a change of categories or items together with a bump of
+    the catalog revision and its change log entries. write, when given,
+    is called to issue the change's statements after the bump; log
+    lists the (entity, instance or id, operation) to record once the
+    session is flushed. When write returns False, the row it changes is
+    gone (e.g. deleted by another process): nothing is committed and None
+    is returned. When the change breaks a unique constraint (category
+    name, item title) and a duplicate_message is given, it is rolled
+    back, the message flashed and False returned
+    """
+    try:
+        revisions.bump(session)
+        if write is not None and write() is False:
+            session.rollback()
+            return None
+        session.flush()
+        for entity, target, operation in log:
+            change_log.record(session, entity, getattr(target, 'id', target),
+                              operation)
+        session.commit()
+    except IntegrityError:
+        if duplicate_message is None:
+            raise
+        session.rollback()
+        flash(duplicate_message)
+        return False
+    __catalog_changed()
+    return True
+
+
+def __catalog_changed():
+    """Drops what the committed change of the catalog made stale"""
+    if current_app.jinja_env.fragment_cache is not None:
+        # unreachable with the new revision anyway, free them
+        current_app.jinja_env.fragment_cache.clear()
+    snapshots = resources().snapshots
+    if snapshots is not None:
+        snapshots.changed()
+
+
+def __item_added(item):
+    """Flushes the new item and counts it in its category and the
+    latest items
+    """
+    session.flush()
+    summaries.item_inserted(session, item.id, item.category_id)
+
+
+def __catalog_revision():
+    """Current catalog revision, read at most once per request"""
+    if 'catalog_revision' not in g:
+        snapshot = __snapshot()
+        g.catalog_revision = snapshot.revision if snapshot is not None \
+            else revisions.current(session)[0]
+    return g.catalog_revision
+
+
+def current_snapshot():
+    """Catalog snapshot the request can read, None when it reads the
+    database: SNAPSHOT is off, the request is not a GET or the snapshot
+    is older than the last write of its client
+    """
+    snapshots = resources().snapshots
+    if snapshots is None or request.method not in ('GET', 'HEAD'):
+        return None
+    snapshot = snapshots.get()
+    written = login_session.get('written_revision')
+    if written is not None:
+        if snapshot.revision < written:
+            return None
+        login_session.pop('written_revision')
+    return snapshot
+
+
+def __snapshot():
+    """Catalog snapshot the request reads, the same one all along (see
+    current_snapshot)
+    """
+    if 'snapshot' not in g:
+        g.snapshot = current_snapshot()
+    return g.snapshot
+
+
+def catalog_validators(revision, updated):
+    """(ETag, Last-Modified) of the pages of the catalog at revision,
+    updated at updated, and whether the client already has them
+    """
+    # pages differ for the logged in user
+    etag = '{0}-{1}'.format(revision, login_session.get('user_id', ''))
+    if updated is not None:
+        updated = updated.replace(microsecond=0,
+                                  tzinfo=datetime.timezone.utc)
+
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains_weak(etag)
+    else:
+        not_modified = updated is not None and\
+            request.if_modified_since is not None and\
+            request.if_modified_since >= updated
+    return etag, updated, not_modified
+
+
+def set_catalog_validators(response, etag, updated):
+    # weak: the revision is shared by the plain and compressed bodies, so
+    # 200 and 304 responses carry the same ETag whatever the encoding
+    response.set_etag(etag, weak=True)
+    response.last_modified = updated
+    response.cache_control.no_cache = True
+    if 'user_id' in login_session:
+        # pages of a signed in user, never kept by shared caches
+        response.cache_control.private = True
+    else:
+        # anonymous pages carry no cookie, shared caches may keep them
+        response.cache_control.public = True
+    return response
+
+
+def __conditional(view):
+    """Answers conditional GETs of view with 304 Not Modified as long as
+    the catalog revision is the one the client has, without running the
+    view. Responses carry the revision as ETag and its time as
+    Last-Modified
+    """
+    @functools.wraps(view)
+    def conditional_view(*args, **kwargs):
+        if '_flashes' in login_session:
+            # the page has to show (and consume) the flashed messages
+            return view(*args, **kwargs)
+
+        snapshot = __snapshot()
+        if snapshot is not None:
+            revision, updated = snapshot.revision, snapshot.updated
+        else:
+            revision, updated = revisions.current(session)
+        g.catalog_revision = revision
+        etag, updated, not_modified = catalog_validators(revision, updated)
+        if not_modified:
+            response = current_app.response_class(status=304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        return set_catalog_validators(response, etag, updated)
+    return conditional_view
+
+
+def __find_category(category_name):
+    """Id and owner of the named category, None if there is none.
+    Served from category_refs when possible
+    """
+    ref = category_refs.get(category_name)
+    if ref is None:
+        row = session\
+            .query(Category.id, Category.name, Category.user_id)\
+            .filter_by(name=category_name)\
+            .first()
+        if row is None:
+            return None
+        ref = CategoryRef(*row)
+        category_refs.set(category_name, ref)
+    return ref
+
+
+def __find_item(item_name):
+    """Id, category and owner of the item with that title, None if there
+    is none. Served from item_refs when possible
+    """
+    ref = item_refs.get(item_name)
+    if ref is None:
+        row = session\
+            .query(Item.id, Item.title, Item.category_id, Item.user_id)\
+            .filter_by(title=item_name)\
+            .first()
+        if row is None:
+            return None
+        ref = ItemRef(*row)
+        item_refs.set(item_name, ref)
+    return ref
+
+
+def __page(query, columns, cursor_arg='next', descending=False,
+           limit=None):
+    """Page of query, or of a tuple of snapshot entries already in the
+    order of columns, after the cursor found in the cursor_arg request
+    argument, at most limit (or the `limit` argument) rows. Aborts with
+    400 on bad arguments
+    """
+    config = current_app.config
+    page = Snapshot.page if isinstance(query, tuple) else keyset_page
+    try:
+        if limit is None:
+            limit = int(request.args.get('limit', config['PAGE_SIZE']))
+        return page(query, columns,
+                    max(1, min(limit, config['MAX_PAGE_SIZE'])),
+                    request.args.get(cursor_arg),
+                    descending=descending)
+    except ValueError:
+        abort(400)
+
+
+def __page_url(cursor_arg, cursor):
+    """URL of the current page with cursor_arg set to cursor, None when
+    there is no further page
+    """
+    if cursor is None:
+        return None
+    args = request.args.to_dict()
+    args.update(request.view_args)
+    args[cursor_arg] = cursor
+    return url_for(request.endpoint, **args)
+
+
+def sidebar_page():
+    """Category sidebar page, paginated with the sidebar_next argument.
+    Called from the cached sidebar fragment, so it only runs on a miss
+    """
+    snapshot = __snapshot()
+    categories = session.query(Category.id, Category.name) \
+        if snapshot is None else snapshot.categories
+    page = __page(categories, [Category.id], cursor_arg='sidebar_next',
+                  limit=current_app.config['PAGE_SIZE'])
+    more = None
+    if page.next_cursor is not None:
+        more = url_for('show_catalog', sidebar_next=page.next_cursor)
+    return page.rows, more
 
 
 def __render_template_with_state(template_name_or_list, **context):
-    """Utility function to create secret session key as well as
-    login checks, before rendering any page
+    """Utility function to run login checks before rendering any page.
+    The state token is only issued by gconnect_state, so rendering
+    leaves the session (and the cookie) alone
     """
-    state = ''.join(
-        random.choice(string.ascii_uppercase + string.digits)
-        for x in range(32))
-    login_session["state"] = state
     user_logged_in = 'user_id' in login_session
-    return render_template(template_name_or_list, STATE=state,
+    return render_template(template_name_or_list,
                            user_logged_in=user_logged_in,
                            **context)
 
 
-@app.route('/gconnect', methods=['POST'])
+@route('/gconnect/state', methods=['POST'])
+def gconnect_state():
+    """Issues the anti forgery state token, asked for by the sign in
+    button when it is used
+    """
+    state = ''.join(
+        random.SystemRandom().choice(string.ascii_uppercase + string.digits)
+        for x in range(32))
+    login_session["state"] = state
+    response = jsonify(state=state)
+    response.cache_control.no_store = True
+    return response
+
+
+@route('/gconnect', methods=['POST'])
 def gconnect():
-    # Validate state token
-    if request.args.get('state') != login_session['state']:
+    # Validate state token, good for one sign in only
+    state = login_session.pop('state', None)
+    if state is None or request.args.get('state') != state:
         response = make_response(json.dumps('Invalid state parameter.'), 401)
         response.headers['Content-Type'] = 'application/json'
         return response
@@ -58,44 +372,11 @@ def gconnect():
     code = request.data.decode('utf-8')
 
     try:
-        # Upgrade the authorization code into a credentials object
-        oauth_flow = flow_from_clientsecrets('client_secrets.json', scope='')
-        oauth_flow.redirect_uri = 'postmessage'
-        credentials = oauth_flow.step2_exchange(code)
-    except FlowExchangeError:
-        response = make_response(
-            json.dumps('Failed to upgrade the authorization code.'), 401)
-        response.headers['Content-Type'] = 'application/json'
-        return response
-
-    # Check that the access token is valid.
-    access_token = credentials.access_token
-    url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?access_token=%s'
-           % access_token)
-    # Submit request, parse response - Python3 compatible
-    h = httplib2.Http()
-    response = h.request(url, 'GET')[1]
-    str_response = response.decode('utf-8')
-    result = json.loads(str_response)
-
-    # If there was an error in the access token info, abort.
-    if result.get('error') is not None:
-        response = make_response(json.dumps(result.get('error')), 500)
-        response.headers['Content-Type'] = 'application/json'
-        return response
-
-    # Verify that the access token is used for the intended user.
-    gplus_id = credentials.id_token['sub']
-    if result['user_id'] != gplus_id:
-        response = make_response(
-            json.dumps("Token's user ID doesn't match given user ID."), 401)
-        response.headers['Content-Type'] = 'application/json'
-        return response
-
-    # Verify that the access token is valid for this app.
-    if result['issued_to'] != CLIENT_ID:
-        response = make_response(
-            json.dumps("Token's client ID does not match app's."), 401)
+        # Upgrade the authorization code and verify the ID token against
+        # Google's (cached) signing keys
+        access_token, gplus_id, data = google.sign_in(code)
+    except AuthError as e:
+        response = make_response(json.dumps(str(e)), 401)
         response.headers['Content-Type'] = 'application/json'
         return response
 
@@ -108,17 +389,14 @@ def gconnect():
         response.headers['Content-Type'] = 'application/json'
         return response
 
+    # A new session id for the signed in session, the one of the state
+    # token may be known to others (signed cookie sessions change anyway)
+    if hasattr(login_session, 'regenerate'):
+        login_session.regenerate()
     # Store the access token in the session for later use.
     login_session['access_token'] = access_token
     login_session['gplus_id'] = gplus_id
 
-    # Get user info
-    userinfo_url = "https://www.googleapis.com/oauth2/v1/userinfo"
-    params = {'access_token': access_token, 'alt': 'json'}
-    answer = requests.get(userinfo_url, params=params)
-
-    data = answer.json()
-
     login_session['username'] = data['name']
     login_session['picture'] = data['picture']
     login_session['email'] = data['email']
@@ -138,7 +416,7 @@ def gconnect():
     return output
 
 
-@app.route('/gdisconnect')
+@route('/gdisconnect')
 def gdisconnect():
     # Only disconnect a connected user.
     access_token = login_session.get('access_token')
@@ -147,16 +425,7 @@ def gdisconnect():
             json.dumps('Current user not connected.'), 401)
         response.headers['Content-Type'] = 'application/json'
         return response
-    url = 'https://accounts.google.com/o/oauth2/revoke?token=%s' % access_token
-    h = httplib2.Http()
-    responseData = h.request(url, 'GET')
-    result = responseData[0]
-
-    str_response = responseData[1].decode('utf-8')
-    response_json = json.loads(str_response)
-
-    if result['status'] == '200' \
-            or response_json.get('error') == "invalid_token":
+    if google.revoke(access_token):
         # Reset the user's sesson.
         del login_session['access_token']
         del login_session['gplus_id']
@@ -198,50 +467,60 @@ def get_user_id(email):
         return None
 
 
-@app.route('/')
+@route('/')
 def root():
     return redirect(url_for('show_catalog'))
 
 
-@app.route('/catalog')
+@route('/catalog')
+@__conditional
 def show_catalog():
-    categories = session.query(Category).all()
-    items = session.query(Item).order_by(Item.creation_date.desc()).limit(3)
-    return __render_template_with_state("catalog.html", categories=categories,
+    # both are only loaded by the template when not in the fragment cache
+    snapshot = __snapshot()
+    if snapshot is not None:
+        items = snapshot.latest[:3]
+    else:
+        items = summaries.latest(session.query(Item))
+    return __render_template_with_state("catalog.html",
+                                        sidebar=sidebar_page,
+                                        revision=__catalog_revision(),
                                         items=items)
 
 
-@app.route('/catalog/<string:category_name>/items')
+@route('/catalog/<string:category_name>/items')
+@__conditional
 def show_category(category_name):
-    categories = session\
-        .query(Category)\
-        .all()
-
-    try:
-        selected_category = session\
-            .query(Category)\
-            .filter_by(name=category_name)\
-            .one()
-    except exc.NoResultFound:
+    snapshot = __snapshot()
+    if snapshot is not None:
+        selected_category = snapshot.categories_by_name.get(category_name)
+    else:
+        selected_category = __find_category(category_name)
+    if selected_category is None:
         flash('{} not found'.format(category_name))
         return redirect(url_for('show_catalog'))
 
-    items = session\
-        .query(Item)\
-        .filter_by(category_id=selected_category.id)\
-        .all()
+    if snapshot is not None:
+        items = selected_category.newest
+    else:
+        items = session\
+            .query(Item)\
+            .filter_by(category_id=selected_category.id)
+    items = __page(items, [Item.creation_date, Item.id], descending=True)
 
     user_authorized = 'user_id' in login_session and\
-                      selected_category.user.id == login_session["user_id"]
+                      selected_category.user_id == login_session["user_id"]
 
     return __render_template_with_state("category.html",
-                                        categories=categories,
-                                        items=items,
+                                        sidebar=sidebar_page,
+                                        revision=__catalog_revision(),
+                                        items=items.rows,
+                                        more_items=__page_url(
+                                            'next', items.next_cursor),
                                         selectedCategory=selected_category,
                                         user_authorized=user_authorized)
 
 
-@app.route('/catalog/categories/new', methods=['GET', 'POST'])
+@route('/catalog/categories/new', methods=['GET', 'POST'])
 def add_category():
     if 'user_id' not in login_session:
         flash('Please login to add new category!')
@@ -251,14 +530,19 @@ def add_category():
             new_category = Category(name=request.form['name'],
                                     user_id=login_session['user_id'])
             session.add(new_category)
-            session.commit()
-            flash('New Category added successfully!')
+            if __commit_catalog_change('Category {} already exists!'
+                                       .format(new_category.name),
+                                       log=[(change_log.CATEGORY,
+                                             new_category,
+                                             change_log.INSERT)]):
+                flash('New Category added successfully!')
+            category_refs.invalidate(request.form['name'])
         return redirect(url_for('show_catalog'))
     else:
         return __render_template_with_state('newCategory.html')
 
 
-@app.route('/catalog/<string:category_name>/edit', methods=['GET', 'POST'])
+@route('/catalog/<string:category_name>/edit', methods=['GET', 'POST'])
 def edit_category(category_name):
     try:
         category = session\
@@ -279,9 +563,14 @@ def edit_category(category_name):
             if request.form['name']:
                 category.name = request.form['name']
                 session.add(category)
-                session.commit()
-                flash('Category {0} edited successfully!'
-                      .format(category_name))
+                if __commit_catalog_change('Category {} already exists!'
+                                           .format(request.form['name']),
+                                           log=[(change_log.CATEGORY,
+                                                 category,
+                                                 change_log.UPDATE)]):
+                    flash('Category {0} edited successfully!'
+                          .format(category_name))
+                category_refs.invalidate(category_name, request.form['name'])
             return redirect(url_for('show_catalog'))
         else:
             return __render_template_with_state('editCategory.html',
@@ -291,7 +580,7 @@ def edit_category(category_name):
         return redirect(url_for('show_catalog'))
 
 
-@app.route('/catalog/<string:category_name>/delete', methods=['GET', 'POST'])
+@route('/catalog/<string:category_name>/delete', methods=['GET', 'POST'])
 def delete_category(category_name):
     try:
         category = session\
@@ -309,15 +598,22 @@ def delete_category(category_name):
                   .format(category.name))
             return redirect(url_for('show_catalog'))
         if request.method == 'POST':
-            items = session\
-                .query(Item)\
-                .filter_by(category_id=category.id)\
-                .delete()
-
-            session.delete(category)
-            session.commit()
-            flash('Category {0} deleted successfully !'
-                  .format(category.name))
+            def delete_row():
+                # set-based, whatever the number of items; nothing to
+                # delete when another request deleted the category
+                return bulk_delete.delete_categories(
+                    session,
+                    session.query(Category.id).filter_by(id=category.id)) > 0
+
+            committed = __commit_catalog_change(write=delete_row)
+            category_refs.invalidate(category_name)
+            # titles of the deleted items are not known here
+            item_refs.clear()
+            if committed is None:
+                flash('{} not found'.format(category_name))
+            else:
+                flash('Category {0} deleted successfully !'
+                      .format(category_name))
             return redirect(url_for('show_catalog'))
         else:
             return __render_template_with_state("deleteCategory.html",
@@ -327,14 +623,19 @@ def delete_category(category_name):
         return redirect(url_for('show_catalog'))
 
 
-@app.route('/catalog/<string:category_name>/<string:item_name>')
+@route('/catalog/<string:category_name>/<string:item_name>')
+@__conditional
 def show_item(category_name, item_name):
+    snapshot = __snapshot()
     try:
-        item = session\
-            .query(Item)\
-            .filter_by(title=item_name)\
-            .one()
-    except exc.NoResultFound:
+        if snapshot is not None:
+            item = snapshot.items_by_title[item_name]
+        else:
+            item = session\
+                .query(Item)\
+                .filter_by(title=item_name)\
+                .one()
+    except (KeyError, exc.NoResultFound):
         flash('{} not found'.format(item_name))
         return redirect(url_for('show_catalog'))
 
@@ -350,7 +651,7 @@ def show_item(category_name, item_name):
         return redirect(url_for('show_catalog'))
 
 
-@app.route('/catalog/items/new', methods=['GET', 'POST'])
+@route('/catalog/items/new', methods=['GET', 'POST'])
 def add_item():
     if 'user_id' not in login_session:
         flash('Please login to add new Item!')
@@ -359,12 +660,8 @@ def add_item():
     if request.method == 'POST':
         if request.form['title']:
             category_name = request.form['category']
-            try:
-                category = session\
-                    .query(Category)\
-                    .filter_by(name=category_name)\
-                    .one()
-            except exc.NoResultFound:
+            category = __find_category(category_name)
+            if category is None:
                 flash('Item add error. Category selected not present!')
                 return redirect(url_for('show_catalog'))
 
@@ -379,8 +676,13 @@ def add_item():
                             user_id=category.user_id)
 
             session.add(new_item)
-            session.commit()
-            flash('New Item added successfully!')
+            if __commit_catalog_change('Item {} already exists!'
+                                       .format(new_item.title),
+                                       write=lambda: __item_added(new_item),
+                                       log=[(change_log.ITEM, new_item,
+                                             change_log.INSERT)]):
+                flash('New Item added successfully!')
+            item_refs.invalidate(request.form['title'])
 
         return redirect(url_for('show_catalog'))
     else:
@@ -393,19 +695,15 @@ def add_item():
                                             category=None)
 
 
-@app.route('/catalog/<string:category_name>/items/new',
-           methods=['GET', 'POST'])
+@route('/catalog/<string:category_name>/items/new',
+       methods=['GET', 'POST'])
 def add_item_to_category(category_name):
     if 'user_id' not in login_session:
         flash('Please login to add new Item!')
         return redirect(url_for('show_catalog'))
 
-    try:
-        category = session\
-            .query(Category)\
-            .filter_by(name=category_name)\
-            .one()
-    except exc.NoResultFound:
+    category = __find_category(category_name)
+    if category is None:
         flash('{} not found'.format(category_name))
         return redirect(url_for('show_catalog'))
 
@@ -420,8 +718,13 @@ def add_item_to_category(category_name):
                             description=request.form['description'],
                             category_id=category.id)
             session.add(new_item)
-            session.commit()
-            flash('New Item added successfully!')
+            if __commit_catalog_change('Item {} already exists!'
+                                       .format(new_item.title),
+                                       write=lambda: __item_added(new_item),
+                                       log=[(change_log.ITEM, new_item,
+                                             change_log.INSERT)]):
+                flash('New Item added successfully!')
+            item_refs.invalidate(request.form['title'])
         return redirect(url_for('show_catalog'))
     else:
         return __render_template_with_state('newItem.html',
@@ -429,8 +732,8 @@ def add_item_to_category(category_name):
                                             category=category)
 
 
-@app.route('/catalog/<string:category_name>/<string:item_name>/edit',
-           methods=['GET', 'POST'])
+@route('/catalog/<string:category_name>/<string:item_name>/edit',
+       methods=['GET', 'POST'])
 def edit_item(category_name, item_name):
     if 'user_id' not in login_session:
         flash('Please login to edit an Item!')
@@ -439,12 +742,8 @@ def edit_item(category_name, item_name):
     if request.method == 'POST':
         if request.form['title']:
             category_name = request.form['category']
-            try:
-                category = session\
-                    .query(Category)\
-                    .filter_by(name=category_name)\
-                    .one()
-            except exc.NoResultFound:
+            category = __find_category(category_name)
+            if category is None:
                 flash('{} not found'.format(category_name))
                 return redirect(url_for('show_catalog'))
 
@@ -453,24 +752,36 @@ def edit_item(category_name, item_name):
                       .format(category_name))
                 return redirect(url_for('show_catalog'))
 
-            try:
-                item = session\
-                    .query(Item)\
-                    .filter_by(title=item_name)\
-                    .one()
-            except exc.NoResultFound:
+            item = __find_item(item_name)
+            if item is None:
                 flash('{} not found'.format(item_name))
-                redirect(url_for('show_catalog'))
-
-            if category and item:
-                item.title = request.form['title']
-                item.description = request.form['description']
-                item.category_id = category.id
-                session.add(item)
-                session.commit()
+                return redirect(url_for('show_catalog'))
+
+            def update_row():
+                # the cached ref may predate a move by another process
+                moved_from = session\
+                    .query(Item.category_id)\
+                    .filter_by(id=item.id)\
+                    .scalar()
+                if not session\
+                        .query(Item)\
+                        .filter_by(id=item.id)\
+                        .update({'title': request.form['title'],
+                                 'description': request.form['description'],
+                                 'category_id': category.id},
+                                synchronize_session=False):
+                    return False
+                summaries.item_moved(session, moved_from, category.id)
+
+            committed = __commit_catalog_change(
+                'Item {} already exists!'.format(request.form['title']),
+                write=update_row,
+                log=[(change_log.ITEM, item.id, change_log.UPDATE)])
+            if committed is None:
+                flash('{} not found'.format(item_name))
+            elif committed:
                 flash('New Item added successfully!')
-            else:
-                flash('Item add error. Category or Item selected not present!')
+            item_refs.invalidate(item_name, request.form['title'])
 
         return redirect(url_for('show_catalog'))
     else:
@@ -498,15 +809,14 @@ def edit_item(category_name, item_name):
                                             item=item)
 
 
-@app.route('/catalog/items/<string:item_name>/delete', methods=['GET', 'POST'])
+@route('/catalog/items/<string:item_name>/delete', methods=['GET', 'POST'])
 def delete_item(item_name):
     if 'user_id' not in login_session:
         flash('Please login to delete an Item!')
         return redirect(url_for('show_catalog'))
 
-    try:
-        item = session.query(Item).filter_by(title=item_name).one()
-    except exc.NoResultFound:
+    item = __find_item(item_name)
+    if item is None:
         flash('{} not found'.format(item_name))
         return redirect(url_for('show_catalog'))
 
@@ -515,51 +825,387 @@ def delete_item(item_name):
               .format(item_name))
 
     if request.method == 'POST':
-        session.delete(item)
-        session.commit()
-        flash('Item {0} deleted successfully !'.format(item.title))
+        def delete_row():
+            category_id = session\
+                .query(Item.category_id)\
+                .filter_by(id=item.id)\
+                .scalar()
+            if not session.query(Item).filter_by(id=item.id).delete():
+                return False
+            summaries.item_deleted(session, item.id, category_id)
+
+        committed = __commit_catalog_change(
+            write=delete_row,
+            log=[(change_log.ITEM, item.id, change_log.DELETE)])
+        item_refs.invalidate(item_name)
+        if committed is None:
+            flash('{} not found'.format(item_name))
+        else:
+            flash('Item {0} deleted successfully !'.format(item.title))
         return redirect(url_for('show_catalog'))
     else:
         return __render_template_with_state("deleteItem.html", item=item)
 
 
-@app.route('/catalog/json')
-def catalog_json():
-    categories = session.query(Category).all()
-    return jsonify(Categories=[c.serialize for c in categories])
+def __paginated():
+    """Whether a JSON endpoint was asked for a page rather than
+    everything
+    """
+    return 'limit' in request.args or 'next' in request.args
 
 
-@app.route('/catalog/<string:category_name>/json')
-def category_json(category_name):
-    try:
-        category = session\
-            .query(Category)\
-            .filter_by(name=category_name)\
-            .one()
-    except exc.NoResultFound:
-        return jsonify(Error='Category {0} not found'
-                       .format(category_name))
+def __catalog_rows():
+    """(category id, category name, item id, title, description) of every
+    item, grouped by category, with a row of None item columns for empty
+    categories
+    """
+    return session\
+        .query(Category.id, Category.name,
+               Item.id, Item.title, Item.description)\
+        .outerjoin(Item, Item.category_id == Category.id)\
+        .order_by(Category.id, Item.id)
 
-    return jsonify(Categories=category.serialize)
 
+def __serialize_catalog(category_ids=None):
+    """Builds the nested Categories/Items structure of the full catalog,
+    or of the given categories, from a single outer join, instead of
+    lazy loading Category.items once per category
+    """
+    rows = __catalog_rows()
+    if category_ids is not None:
+        rows = rows.filter(Category.id.in_(category_ids))
+    return catalog_tree(rows)
+
+
+def catalog_tree(rows):
+    """Nested Categories/Items structure of the rows of __catalog_rows"""
+    categories = []
+    current = None
+    for category_id, category_name, item_id, title, description in rows:
+        if current is None or current['id'] != category_id:
+            current = {'name': category_name, 'id': category_id, 'Items': []}
+            categories.append(current)
+        if item_id is not None:
+            current['Items'].append({'title': title,
+                                     'id': item_id,
+                                     'description': description,
+                                     'category_id': category_id})
+    return categories
+
+
+@route('/catalog/json')
+@__conditional
+def catalog_json():
+    snapshot = __snapshot()
+    if snapshot is not None:
+        categories = snapshot.categories
+        if not __paginated():
+            return serializers.json_response(
+                Categories=[serializers.category(c, c.items)
+                            for c in categories])
+        page = __page(categories, [Category.id])
+        return serializers.json_response(
+            Categories=[serializers.category(c, c.items)
+                        for c in page.rows],
+            next=page.next_cursor)
+
+    if not __paginated():
+        return serializers.json_response(Categories=__serialize_catalog())
+
+    page = __page(session.query(Category.id), [Category.id])
+    return serializers.json_response(
+        Categories=__serialize_catalog([c.id for c in page.rows]),
+        next=page.next_cursor)
+
+
+def __search():
+    """Query, page number, hits and whether there is a next page of the
+    search request
+    """
+    query = request.args.get('q', '').strip()
+    try:
+        page = max(1, int(request.args.get('page', 1)))
+        limit = int(request.args.get('limit', current_app.config['PAGE_SIZE']))
+    except ValueError:
+        abort(400)
+    limit = max(1, min(limit, current_app.config['MAX_PAGE_SIZE']))
+    hits = search_items(session, query, limit + 1, (page - 1) * limit)
+    return query, page, hits[:limit], len(hits) > limit
+
+
+@route('/catalog/search')
+@__conditional
+def search():
+    query, page, hits, has_next = __search()
+    return __render_template_with_state("search.html", query=query,
+                                        page=page, items=hits,
+                                        has_next=has_next)
+
+
+@route('/catalog/search.json')
+@__conditional
+def search_json():
+    query, page, hits, has_next = __search()
+    return serializers.json_response(
+        Items=[dict(serializers.item(hit), category=hit.category)
+               for hit in hits],
+        page=page,
+        next_page=page + 1 if has_next else None)
+
+
+@route('/catalog/changes')
+@__conditional
+def catalog_changes():
+    """Inserts, updates and deletes of categories and items after the
+    `since` cursor, oldest first, at most `limit`, with the cursor to
+    read on from. No `since` reads the log from its start
+    """
+    try:
+        since = 0
+        if request.args.get('since'):
+            since = decode_cursor(request.args['since'], [Change.id])[0]
+        limit = int(request.args.get('limit', current_app.config['PAGE_SIZE']))
+    except ValueError:
+        abort(400)
+    changes, last = change_log.feed(
+        session, since,
+        max(1, min(limit, current_app.config['MAX_PAGE_SIZE'])))
+    return jsonify(Changes=changes, next=encode_cursor([last]))
+
+
+@route('/catalog/import', methods=['POST'])
+def import_items():
+    """Adds a batch of items, sent as a JSON list or a CSV document of
+    title, description and category, to categories of the logged in
+    user. Unknown categories are created. Answers with the number of
+    items imported and the rows rejected
+    """
+    if 'user_id' not in login_session:
+        return jsonify(Error='Please login to import items'), 401
 
-@app.route('/catalog/<string:category_name>/<string:item_name>/json')
-def item_json(category_name, item_name):
+    upload = request.files.get('file')
+    if upload is not None:
+        data = upload.read()
+        content_type = upload.filename or upload.mimetype
+    else:
+        data = request.get_data()
+        content_type = request.mimetype
     try:
-        category = session.query(Category).filter_by(name=category_name).one()
-        item = session.query(Item).filter_by(title=item_name).one()
-    except exc.NoResultFound:
-        return jsonify(
+        records = bulk_import.parse_records(data, content_type)
+    except (ValueError, csv.Error) as e:
+        return jsonify(Error='Invalid import data: {}'.format(e)), 400
+
+    result = bulk_import.import_items(session, login_session['user_id'],
+                                      records,
+                                      current_app.config['IMPORT_CHUNK_SIZE'])
+    if result['inserted'] or result['categories_created']:
+        __catalog_changed()
+    return jsonify(**result)
+
+
+@route('/catalog/export.ndjson')
+@__conditional
+def catalog_export():
+    """Whole catalog as newline delimited JSON, one category record
+    followed by one record per item of it. Rows are read through a
+    server side cursor and written out as they come, so memory use does
+    not depend on the catalog size
+    """
+    batch_size = current_app.config['EXPORT_BATCH_SIZE']
+    rows = __catalog_rows()\
+        .execution_options(stream_results=True)\
+        .yield_per(batch_size)
+
+    def generate():
+        lines = []
+        current = None
+        for category_id, category_name, item_id, title, description in rows:
+            if category_id != current:
+                current = category_id
+                lines.append(json.dumps({'type': 'category',
+                                         'id': category_id,
+                                         'name': category_name}))
+            if item_id is not None:
+                lines.append(json.dumps({'type': 'item',
+                                         'title': title,
+                                         'id': item_id,
+                                         'description': description,
+                                         'category_id': category_id}))
+            if len(lines) >= batch_size:
+                yield '\n'.join(lines) + '\n'
+                lines = []
+        if lines:
+            yield '\n'.join(lines) + '\n'
+
+    return Response(stream_with_context(generate()),
+                    mimetype='application/x-ndjson')
+
+
+@route('/catalog/<string:category_name>/json')
+@__conditional
+def category_json(category_name):
+    snapshot = __snapshot()
+    if snapshot is not None:
+        category = snapshot.categories_by_name.get(category_name)
+    else:
+        category = __find_category(category_name)
+    if category is None:
+        return serializers.json_response(Error='Category {0} not found'
+                                         .format(category_name))
+
+    if snapshot is not None:
+        if not __paginated():
+            return serializers.json_response(
+                Categories=serializers.category(category, category.items))
+        items = category.newest
+    else:
+        # rows, not Items, creation_date for the keyset of the pages
+        items = session\
+            .query(*serializers.ITEM_COLUMNS)\
+            .filter_by(category_id=category.id)
+        if not __paginated():
+            return serializers.json_response(
+                Categories=serializers.category(category,
+                                                items.order_by(Item.id)))
+        items = items.add_columns(Item.creation_date)
+
+    page = __page(items, [Item.creation_date, Item.id], descending=True)
+    return serializers.json_response(
+        Categories=serializers.category(category, page.rows),
+        next=page.next_cursor)
+
+
+@route('/catalog/<string:category_name>/<string:item_name>/json')
+@__conditional
+def item_json(category_name, item_name):
+    snapshot = __snapshot()
+    if snapshot is not None:
+        category = snapshot.categories_by_name.get(category_name)
+        item = snapshot.items_by_title.get(item_name)
+    else:
+        category = __find_category(category_name)
+        item = __find_item(item_name)
+    if category is None or item is None:
+        return serializers.json_response(
             Error='Item or Category not found')
 
     if item.category_id != category.id:
-        return jsonify(Error='Item {0} does not belong to Category {1}'
-                       .format(item_name, category_name))
+        return serializers.json_response(
+            Error='Item {0} does not belong to Category {1}'
+            .format(item_name, category_name))
+
+    if snapshot is not None:
+        return serializers.json_response(Categories=serializers.item(item))
+    row = session\
+        .query(*serializers.ITEM_COLUMNS)\
+        .filter_by(id=item.id)\
+        .first()
+    if row is None:
+        # the cached ref outlived the item, deleted by another process
+        item_refs.invalidate(item_name)
+        return serializers.json_response(
+            Error='Item or Category not found')
+    return serializers.json_response(Categories=serializers.item(row))
+
+
+@route('/stats/cache/json')
+def cache_stats_json():
+    return jsonify(Categories=category_refs.stats, Items=item_refs.stats)
+
+
+@route('/stats/replicas/json')
+def replica_stats_json():
+    replica_set = resources().replica_set
+    return jsonify(Replicas=replica_set.stats if replica_set else [])
+
+
+@route('/stats/snapshot/json')
+def snapshot_stats_json():
+    snapshots = resources().snapshots
+    return jsonify(Snapshot=snapshots.stats if snapshots else None)
+
+
+def create_app(config=None):
+    """The catalog application, set up by config.Config and then config
+    (a mapping or an object) when given. Its database engines and sign
+    in client are made on first use, see resources.py
+    """
+    app = Flask(__name__)
+    app.config.from_object('config.Config')
+    if isinstance(config, dict):
+        app.config.from_mapping(config)
+    elif config is not None:
+        app.config.from_object(config)
+
+    # before_request hooks run first registered first: requests turned
+    # away by admission control cost nothing more
+    Admission(app)
+    # after_request hooks run last registered first, compression last
+    Compression(app)
+    instrumentation = Instrumentation(app)
+    Assets(app)
+    app.extensions['catalog'] = Resources(app.config, instrumentation)
+
+    # Session data on the server, only its id in the cookie
+    session_interface = create_session_interface(
+        app.config['SESSION_STORE'],
+        app.config['SESSION_STORE_PATH'],
+        app.config['SESSION_LIFETIME'])
+    if session_interface is not None:
+        app.session_interface = session_interface
+
+    # {% cache %} blocks of the templates, keyed by catalog revision
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    app.jinja_env.fragment_cache = create_backend(
+        app.config['FRAGMENT_CACHE'],
+        app.config['FRAGMENT_CACHE_SIZE'],
+        app.config['FRAGMENT_CACHE_DIR'])
+    # Compiled templates, kept for the processes started next
+    if app.config['TEMPLATE_CACHE_DIR']:
+        os.makedirs(app.config['TEMPLATE_CACHE_DIR'], exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(
+            app.config['TEMPLATE_CACHE_DIR'])
+
+    app.before_request(route_reads)
+    app.after_request(stick_to_primary)
+    app.teardown_appcontext(remove_session)
+    for rule, view, options in routes:
+        app.add_url_rule(rule, view_func=view, **options)
+    return app
+
+
+def warm_up(app, connections=1):
+    """Readies a new worker process before it takes requests: compiles
+    the templates, opens connections to the databases, loads the catalog
+    snapshot and requests the WARMUP_PATHS to fill the caches
+    """
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+
+    extension = app.extensions['catalog']
+    engines = [extension.engine]
+    if extension.replica_set is not None:
+        engines.extend(extension.replica_set.engines)
+    try:
+        for engine in engines:
+            opened = [engine.connect() for _ in range(connections)]
+            for connection in opened:
+                connection.close()
+        if extension.snapshots is not None:
+            extension.snapshots.get()
+    except DBAPIError:
+        # the worker still starts, the requests retry the database
+        app.logger.exception('Failed to warm up the database connections')
+        return
+
+    client = app.test_client()
+    for path in app.config['WARMUP_PATHS']:
+        client.get(path)
+
 
-    return jsonify(Categories=item.serialize)
+app = create_app()
 
 
 if __name__ == "__main__":
-    app.secret_key = 'super_secret_key'
     app.debug = True
-    app.run(host='0.0.0.0', port=5000, threaded=False)
+    app.run(host='0.0.0.0', port=5000, threaded=True)
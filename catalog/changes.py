@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""Change log of categories and items.
+
+The write views append an insert, update or delete entry for every
+category and item they touch, in the same transaction as the change and
+after revisions.bump, whose row lock makes log ids grow in commit order.
+Mirrors read the log from the id they last saw on with feed() to apply
+only the deltas.
+"""
+
+import datetime
+
+from sqlalchemy import literal
+
+from database_setup import Category, Change, Item
+
+
+CATEGORY = 'category'
+ITEM = 'item'
+
+INSERT = 'insert'
+UPDATE = 'update'
+DELETE = 'delete'
+
+
+def record(session, entity, entity_id, operation):
+    session.add(Change(entity=entity, entity_id=entity_id,
+                       operation=operation,
+                       changed=datetime.datetime.utcnow()))
+
+
+def record_selected(session, entity, id_query, operation):
+    """Logs operation for each id selected by id_query, a query of a
+    single id column, with one INSERT ... SELECT
+    """
+    selected = id_query.add_columns(
+        literal(entity), literal(operation),
+        literal(datetime.datetime.utcnow()))
+    session.execute(Change.__table__.insert().from_select(
+        ['entity_id', 'entity', 'operation', 'changed'],
+        selected.statement))
+
+
+def record_items(session, rows, operation):
+    """Logs operation for the items with the titles of rows, dicts as
+    written by a bulk insert
+    """
+    record_selected(session, ITEM,
+                    session.query(Item.id)
+                    .filter(Item.title.in_([row['title'] for row in rows])),
+                    operation)
+
+
+def record_categories(session, names, operation):
+    """Logs operation for the categories named names"""
+    record_selected(session, CATEGORY,
+                    session.query(Category.id)
+                    .filter(Category.name.in_(names)),
+                    operation)
+
+
+def feed(session, since=0, limit=100):
+    """Changes logged after id since, oldest first, with the current
+    state of their category or item (None once deleted) and the id to
+    read on from
+    """
+    entries = session\
+        .query(Change)\
+        .filter(Change.id > since)\
+        .order_by(Change.id)\
+        .limit(limit)\
+        .all()
+
+    item_ids = {e.entity_id for e in entries
+                if e.entity == ITEM and e.operation != DELETE}
+    category_ids = {e.entity_id for e in entries
+                    if e.entity == CATEGORY and e.operation != DELETE}
+    items = {}
+    if item_ids:
+        items = {i.id: i.serialize for i in
+                 session.query(Item).filter(Item.id.in_(item_ids))}
+    categories = {}
+    if category_ids:
+        categories = {id: {'name': name, 'id': id} for id, name in
+                      session
+                      .query(Category.id, Category.name)
+                      .filter(Category.id.in_(category_ids))}
+
+    changes = []
+    for entry in entries:
+        current = items if entry.entity == ITEM else categories
+        changes.append({'entity': entry.entity,
+                        'id': entry.entity_id,
+                        'operation': entry.operation,
+                        'changed': entry.changed.isoformat() + 'Z',
+                        'data': current.get(entry.entity_id)})
+    return changes, entries[-1].id if entries else since
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""Compression of the HTML and JSON responses.
+
+Bodies of at least COMPRESS_MIN_SIZE bytes are sent brotli (when the
+brotli package is installed) or gzip compressed to the clients
+accepting it. The catalog pages already carry a weak ETag, matching
+their 304s; other strong ETags are weakened, the compressed bytes
+differ from the ones they named.
+Streamed responses (the NDJSON export) are sent as they are.
+"""
+
+import gzip
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+COMPRESSED_TYPES = ('text/html', 'application/json')
+
+
+class Compression(object):
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not app.config['COMPRESS_RESPONSES']:
+            return
+        self.min_size = app.config['COMPRESS_MIN_SIZE']
+        self.level = app.config['COMPRESS_LEVEL']
+        self.brotli_quality = app.config['COMPRESS_BROTLI_QUALITY']
+        app.after_request(self.compress)
+
+    def _encoding(self):
+        """Encoding to send, None when the client accepts none"""
+        accepted = request.accept_encodings
+        if brotli is not None and accepted['br']:
+            return 'br'
+        if accepted['gzip']:
+            return 'gzip'
+        return None
+
+    def compress(self, response):
+        if response.status_code != 200 or response.direct_passthrough or \
+                response.is_streamed or response.content_encoding or \
+                response.mimetype not in COMPRESSED_TYPES:
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = self._encoding()
+        if encoding is None:
+            return response
+        data = response.get_data()
+        if len(data) < self.min_size:
+            return response
+
+        if encoding == 'br':
+            data = brotli.compress(data, quality=self.brotli_quality)
+        else:
+            data = gzip.compress(data, self.level, mtime=0)
+        response.set_data(data)
+        response.content_encoding = encoding
+        etag, weak = response.get_etag()
+        if etag is not None and not weak:
+            response.set_etag(etag, weak=True)
+        return response
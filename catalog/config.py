@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""Default configuration of the catalog service.
+
+Every setting can be overridden with an environment variable of the
+same name, e.g. `SQL_INSTRUMENTATION=1 python catalog_service.py`.
+"""
+
+import os
+import tempfile
+
+
+def env_flag(name, default=False):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.lower() in ('1', 'true', 'yes', 'on')
+
+
+def env_int(name, default):
+    value = os.environ.get(name)
+    return default if value is None else int(value)
+
+
+def env_float(name, default):
+    value = os.environ.get(name)
+    return default if value is None else float(value)
+
+
+def env_limits(name, default):
+    """default, a dict of route class -> (concurrency, queue size,
+    timeout), with the classes given as 'class=2/8/5.0,...' in the
+    environment variable replaced
+    """
+    limits = dict(default)
+    for entry in os.environ.get(name, '').split(','):
+        if entry.strip():
+            route_class, values = entry.split('=')
+            concurrency, queue_size, timeout = values.split('/')
+            limits[route_class.strip()] = (int(concurrency), int(queue_size),
+                                           float(timeout))
+    return limits
+
+
+# placeholder of the development server, never to sign the sessions of
+# a production server: anyone could forge them, user_id included
+DEFAULT_SECRET_KEY = 'super_secret_key'
+
+
+def check_secret_key(secret_key, debug=False):
+    """Raises RuntimeError when a server outside debug would sign its
+    sessions with no SECRET_KEY or the DEFAULT_SECRET_KEY
+    """
+    if not debug and secret_key in (None, '', DEFAULT_SECRET_KEY):
+        raise RuntimeError('SECRET_KEY is not set, refusing to serve with '
+                           'the default one')
+
+
+class Config(object):
+    SECRET_KEY = os.environ.get('SECRET_KEY', DEFAULT_SECRET_KEY)
+    DATABASE_URL = os.environ.get('DATABASE_URL', 'postgresql:///catalog')
+    # Connection pool of the engine, ignored for SQLite
+    DB_POOL_SIZE = env_int('DB_POOL_SIZE', 5)
+    DB_MAX_OVERFLOW = env_int('DB_MAX_OVERFLOW', 10)
+    DB_POOL_TIMEOUT = env_float('DB_POOL_TIMEOUT', 30.0)
+    DB_POOL_RECYCLE = env_int('DB_POOL_RECYCLE', 1800)
+    DB_POOL_PRE_PING = env_flag('DB_POOL_PRE_PING', True)
+
+    # Per request SQL/template timing, Server-Timing headers and /stats/json
+    SQL_INSTRUMENTATION = env_flag('SQL_INSTRUMENTATION')
+    # Requests slower than this (in ms) are written to the slow query log
+    SLOW_REQUEST_MS = env_float('SLOW_REQUEST_MS', 500.0)
+    # Number of slowest statements kept per request
+    SLOWEST_STATEMENTS = env_int('SLOWEST_STATEMENTS', 5)
+    # Number of recent requests per route used for the percentiles
+    STATS_WINDOW = env_int('STATS_WINDOW', 1000)
+    # Entries of the category and item name lookup caches and their time
+    # to live in seconds, 0 keeps them until a local write drops them
+    LOOKUP_CACHE_SIZE = env_int('LOOKUP_CACHE_SIZE', 4096)
+    LOOKUP_CACHE_TTL = env_float('LOOKUP_CACHE_TTL', 30.0)
+    # Default and largest `limit` of the paginated pages and JSON endpoints
+    PAGE_SIZE = env_int('PAGE_SIZE', 50)
+    MAX_PAGE_SIZE = env_int('MAX_PAGE_SIZE', 500)
+    # Rows fetched from the database per round trip by the NDJSON export
+    EXPORT_BATCH_SIZE = env_int('EXPORT_BATCH_SIZE', 1000)
+    # Store of the rendered sidebar/latest items fragments: 'memory',
+    # 'file' (shared by the processes of a host) or 'none'
+    FRAGMENT_CACHE = os.environ.get('FRAGMENT_CACHE', 'memory')
+    FRAGMENT_CACHE_SIZE = env_int('FRAGMENT_CACHE_SIZE', 256)
+    FRAGMENT_CACHE_DIR = os.environ.get(
+        'FRAGMENT_CACHE_DIR',
+        os.path.join(tempfile.gettempdir(), 'catalog-fragments'))
+    # Compiled templates kept on disk, so that new processes skip
+    # compiling them; empty to compile them in every process
+    TEMPLATE_CACHE_DIR = os.environ.get(
+        'TEMPLATE_CACHE_DIR',
+        os.path.join(tempfile.gettempdir(), 'catalog-templates'))
+    # Cache lifetime (in s) of the fingerprinted files of build_assets.py
+    ASSET_MAX_AGE = env_int('ASSET_MAX_AGE', 365 * 24 * 3600)
+    # Compression of the HTML and JSON responses of at least
+    # COMPRESS_MIN_SIZE bytes, gzip level and brotli quality; off when a
+    # proxy in front compresses them
+    COMPRESS_RESPONSES = env_flag('COMPRESS_RESPONSES', True)
+    COMPRESS_MIN_SIZE = env_int('COMPRESS_MIN_SIZE', 1024)
+    COMPRESS_LEVEL = env_int('COMPRESS_LEVEL', 6)
+    COMPRESS_BROTLI_QUALITY = env_int('COMPRESS_BROTLI_QUALITY', 4)
+    # Items per INSERT and transaction of /catalog/import
+    IMPORT_CHUNK_SIZE = env_int('IMPORT_CHUNK_SIZE', 1000)
+    # Where session data is kept: 'sqlite' (a file shared by the processes
+    # of a host), 'memory' (this process only) or 'cookie' for Flask's
+    # signed cookie sessions; sessions expire SESSION_LIFETIME seconds
+    # after their last request
+    SESSION_STORE = os.environ.get('SESSION_STORE', 'sqlite')
+    SESSION_STORE_PATH = os.environ.get(
+        'SESSION_STORE_PATH',
+        os.path.join(tempfile.gettempdir(), 'catalog-sessions.db'))
+    SESSION_LIFETIME = env_int('SESSION_LIFETIME', 7 * 24 * 3600)
+    # Google sign in: client secrets file, timeout (in s) of the calls to
+    # Google, the discovery document of another OpenID provider (e.g. the
+    # local stub of stub_identity_provider.py) and endpoints overriding
+    # those of Google, the discovery document or the secrets file
+    OAUTH_CLIENT_SECRETS = os.environ.get('OAUTH_CLIENT_SECRETS',
+                                          'client_secrets.json')
+    OAUTH_TIMEOUT = env_float('OAUTH_TIMEOUT', 5.0)
+    OAUTH_DISCOVERY_URI = os.environ.get('OAUTH_DISCOVERY_URI')
+    OAUTH_TOKEN_URI = os.environ.get('OAUTH_TOKEN_URI')
+    OAUTH_CERTS_URI = os.environ.get('OAUTH_CERTS_URI')
+    OAUTH_USERINFO_URI = os.environ.get('OAUTH_USERINFO_URI')
+    OAUTH_REVOKE_URI = os.environ.get('OAUTH_REVOKE_URI')
+    # Database of the async read views of asgi_app, DATABASE_URL with its
+    # async driver (asyncpg, aiosqlite) when not set
+    ASYNC_DATABASE_URL = os.environ.get('ASYNC_DATABASE_URL')
+    # Read replicas of the GET requests, comma separated database URLs,
+    # picked 'round_robin' or by 'least_connections'. A replica that
+    # fails is retried after REPLICA_RETRY_INTERVAL seconds; clients that
+    # wrote read from the primary for REPLICA_STICKY_SECONDS
+    REPLICA_URLS = [url.strip() for url in
+                    os.environ.get('REPLICA_URLS', '').split(',')
+                    if url.strip()]
+    REPLICA_STRATEGY = os.environ.get('REPLICA_STRATEGY', 'round_robin')
+    REPLICA_RETRY_INTERVAL = env_float('REPLICA_RETRY_INTERVAL', 30.0)
+    REPLICA_STICKY_SECONDS = env_float('REPLICA_STICKY_SECONDS', 5.0)
+    # Serve the read views from an in-memory snapshot of the catalog,
+    # reloaded when the catalog revision changes: checked every
+    # SNAPSHOT_POLL_INTERVAL seconds and after every local write. Clients
+    # that wrote read the database until the snapshot has their write
+    SNAPSHOT = env_flag('SNAPSHOT')
+    SNAPSHOT_POLL_INTERVAL = env_float('SNAPSHOT_POLL_INTERVAL', 1.0)
+    # Requested by every new worker of gunicorn.conf.py before it takes
+    # requests, filling its caches; comma separated
+    WARMUP_PATHS = [path.strip() for path in
+                    os.environ.get('WARMUP_PATHS', '/catalog').split(',')
+                    if path.strip()]
+    # Admission control, per process: route class (admission.py) ->
+    # (requests served at once, requests waiting, seconds they may
+    # wait). Requests past them get a 503 telling to retry after
+    # ADMISSION_RETRY_AFTER seconds
+    ADMISSION_CONTROL = env_flag('ADMISSION_CONTROL', True)
+    ADMISSION_LIMITS = env_limits('ADMISSION_LIMITS', {
+        'export': (2, 8, 5.0),
+        'search': (8, 32, 2.0),
+        'login': (8, 32, 5.0),
+        'default': (32, 128, 2.0),
+    })
+    # endpoint -> route class, over those of admission.py
+    ADMISSION_ROUTES = {}
+    ADMISSION_RETRY_AFTER = env_int('ADMISSION_RETRY_AFTER', 1)
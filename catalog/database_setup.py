@@ -1,11 +1,16 @@
 #!/usr/bin/env python3
 
-from sqlalchemy import Column, ForeignKey, Integer, String
+import argparse
+import datetime
+
+from sqlalchemy import Column, ForeignKey, Index, Integer, String
+from sqlalchemy import event, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from sqlalchemy.engine import create_engine
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import StaticPool
 from sqlalchemy.types import DateTime
-from sqlalchemy.sql import func
 
 Base = declarative_base()
 
@@ -15,7 +20,7 @@ class User(Base):
 
     id = Column(Integer, primary_key=True)
     name = Column(String(250), nullable=False)
-    email = Column(String(250), nullable=False)
+    email = Column(String(250), nullable=False, unique=True, index=True)
     picture = Column(String(250))
 
 # serializable format for JSON
@@ -33,11 +38,16 @@ class User(Base):
 class Category(Base):
     __tablename__ = 'categories'
 
-    name = Column(String(250), nullable=False)
+    name = Column(String(250), nullable=False, unique=True, index=True)
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, ForeignKey('users.id'))
+    user_id = Column(Integer, ForeignKey('users.id'), index=True)
     user = relationship(User)
-    items = relationship("Item", lazy='select')
+    # the database deletes the items of a deleted category
+    items = relationship("Item", lazy='select', cascade='all, delete',
+                         passive_deletes=True)
+    # kept by the write views, see summaries
+    item_count = Column(Integer, nullable=False, default=0,
+                        server_default='0')
 
 # serializable format for JSON
     @property
@@ -52,14 +62,26 @@ class Category(Base):
 
 class Item(Base):
     __tablename__ = "items"
+    __table_args__ = (
+        Index('ix_items_category_id_title', 'category_id', 'title'),
+        # category pages list items newest first
+        Index('ix_items_category_id_creation_date',
+              'category_id', 'creation_date', 'id'),
+    )
 
-    title = Column(String(80), nullable=False)
+    # items are looked up by title alone, so titles are unique
+    title = Column(String(80), nullable=False, unique=True, index=True)
     id = Column(Integer, primary_key=True)
     description = Column(String(250))
-    creation_date = Column(DateTime, nullable=False, default=func.now())
-    category_id = Column(Integer, ForeignKey('categories.id'))
+    # set in Python: SQLite stores CURRENT_TIMESTAMP without microseconds,
+    # unlike the datetimes bound by the keyset pagination, and the two
+    # would not compare
+    creation_date = Column(DateTime, nullable=False,
+                           default=datetime.datetime.utcnow, index=True)
+    category_id = Column(Integer, ForeignKey('categories.id',
+                                             ondelete='CASCADE'))
     category = relationship(Category)
-    user_id = Column(Integer, ForeignKey('users.id'))
+    user_id = Column(Integer, ForeignKey('users.id'), index=True)
     user = relationship(User)
 
 # serializable format for JSON
@@ -73,7 +95,274 @@ class Item(Base):
             'category_id': self.category_id, }
 
 
-if __name__ == "__main__":
+class LatestItem(Base):
+    """The newest items (summaries.LATEST_KEPT of them), so the home page
+    does not sort the items table
+    """
+    __tablename__ = "latest_items"
+
+    # no foreign key: rows are dropped after their item, see summaries
+    item_id = Column(Integer, primary_key=True)
+    creation_date = Column(DateTime, nullable=False, index=True)
+
+
+class Revision(Base):
+    """Counter bumped by every committed change of the catalog, used to
+    answer conditional requests without loading the catalog
+    """
+    __tablename__ = "revisions"
+
+    name = Column(String(80), primary_key=True)
+    value = Column(Integer, nullable=False, default=0)
+    # UTC
+    updated = Column(DateTime, nullable=False)
+
+
+class Change(Base):
+    """Append only log of the changes of categories and items, in commit
+    order, read by the /catalog/changes feed
+    """
+    __tablename__ = "changes"
+
+    id = Column(Integer, primary_key=True)
+    entity = Column(String(20), nullable=False)
+    entity_id = Column(Integer, nullable=False)
+    operation = Column(String(10), nullable=False)
+    # UTC
+    changed = Column(DateTime, nullable=False)
+
+
+# Full text search documents, the expressions have to match those of the
+# search queries for Postgres to use the indexes
+ITEM_DOCUMENT = "to_tsvector('english', coalesce(items.title, '') || ' ' " \
+                "|| coalesce(items.description, ''))"
+CATEGORY_DOCUMENT = "to_tsvector('english', categories.name)"
+
+POSTGRES_SEARCH_INDEXES = [
+    "CREATE INDEX {concurrently} IF NOT EXISTS ix_items_search "
+    "ON items USING gin ((" + ITEM_DOCUMENT.replace('items.', '') + "))",
+    "CREATE INDEX {concurrently} IF NOT EXISTS ix_categories_search "
+    "ON categories USING gin ((" +
+    CATEGORY_DOCUMENT.replace('categories.', '') + "))",
+]
+
+# SQLite keeps a FTS5 table of items (with their category name) in step
+# with triggers
+SQLITE_SEARCH_TABLE = [
+    "CREATE VIRTUAL TABLE items_fts USING fts5("
+    "title, description, category, tokenize='unicode61')",
+    "INSERT INTO items_fts(rowid, title, description, category) "
+    "SELECT items.id, items.title, coalesce(items.description, ''), "
+    "categories.name FROM items "
+    "LEFT JOIN categories ON categories.id = items.category_id",
+    "CREATE TRIGGER items_fts_insert AFTER INSERT ON items BEGIN "
+    "INSERT INTO items_fts(rowid, title, description, category) "
+    "VALUES (new.id, new.title, coalesce(new.description, ''), "
+    "(SELECT name FROM categories WHERE id = new.category_id)); END",
+    "CREATE TRIGGER items_fts_update AFTER UPDATE ON items BEGIN "
+    "DELETE FROM items_fts WHERE rowid = old.id; "
+    "INSERT INTO items_fts(rowid, title, description, category) "
+    "VALUES (new.id, new.title, coalesce(new.description, ''), "
+    "(SELECT name FROM categories WHERE id = new.category_id)); END",
+    "CREATE TRIGGER items_fts_delete AFTER DELETE ON items BEGIN "
+    "DELETE FROM items_fts WHERE rowid = old.id; END",
+    "CREATE TRIGGER categories_fts_update AFTER UPDATE OF name "
+    "ON categories BEGIN "
+    "UPDATE items_fts SET category = new.name WHERE rowid IN "
+    "(SELECT id FROM items WHERE category_id = new.id); END",
+]
+
+
+def create_search_index(connection, concurrently=False):
+    """Creates the full text search indexes of items and categories if
+    missing: GIN indexes on Postgres, a trigger maintained FTS5 table
+    (filled from the existing items) on SQLite. Other databases search
+    without an index
+    """
+    if connection.dialect.name == 'postgresql':
+        for statement in POSTGRES_SEARCH_INDEXES:
+            connection.execute(statement.format(
+                concurrently='CONCURRENTLY' if concurrently else ''))
+    elif connection.dialect.name == 'sqlite':
+        if not inspect(connection).has_table('items_fts'):
+            for statement in SQLITE_SEARCH_TABLE:
+                connection.execute(statement)
+
+
+def create_tables(engine):
+    """Creates the missing tables. The search indexes are made with them
+    on a new database, and on SQLite where they are a table of their
+    own; those of an existing Postgres database are left to
+    create_indexes, which builds them concurrently
+    """
+    new = not inspect(engine).has_table(Item.__tablename__)
+    Base.metadata.create_all(engine)
+    if new or engine.dialect.name == 'sqlite':
+        with engine.begin() as connection:
+            create_search_index(connection)
+
+
+def enable_foreign_keys(dbapi_connection, connection_record):
+    """Connect listener turning on SQLite's (off by default) enforcement
+    of foreign keys, ON DELETE CASCADE included
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA foreign_keys=ON')
+    cursor.close()
+
+
+def create_db_engine(url, pool_size=5, max_overflow=10, pool_timeout=30,
+                     pool_recycle=1800, pool_pre_ping=True):
+    """Creates an engine with a connection pool suitable for serving
+    concurrent requests. SQLite gets thread sharing enabled and foreign
+    keys enforced instead of the pool settings, and a single shared
+    connection when in memory.
+    """
+    url = make_url(url)
+    if url.get_backend_name() == 'sqlite':
+        options = {'connect_args': {'check_same_thread': False}}
+        if url.database in (None, '', ':memory:'):
+            options['poolclass'] = StaticPool
+        engine = create_engine(url, **options)
+        event.listen(engine, 'connect', enable_foreign_keys)
+        return engine
+
+    return create_engine(url,
+                         pool_size=pool_size,
+                         max_overflow=max_overflow,
+                         pool_timeout=pool_timeout,
+                         pool_recycle=pool_recycle,
+                         pool_pre_ping=pool_pre_ping)
+
+
+# columns added to existing tables since they were created, with the
+# DDL adding them
+ADDED_COLUMNS = [
+    ('categories', 'item_count',
+     'ALTER TABLE categories ADD COLUMN item_count INTEGER NOT NULL '
+     'DEFAULT 0'),
+]
+
+
+def add_columns(engine):
+    """Adds the ADDED_COLUMNS missing from an existing database. Returns
+    the names of those added
+    """
+    added = []
+    with engine.begin() as connection:
+        inspector = inspect(connection)
+        for table, column, ddl in ADDED_COLUMNS:
+            if column not in {c['name'] for c in
+                              inspector.get_columns(table)}:
+                connection.execute(text(ddl))
+                print('{0}.{1} added'.format(table, column))
+                added.append('{0}.{1}'.format(table, column))
+    return added
+
+
+# foreign keys declared ON DELETE CASCADE since their tables were
+# created: (table, column, referred table, referred column)
+CASCADES = [
+    ('items', 'category_id', 'categories', 'id'),
+]
+
+
+def add_cascades(engine):
+    """Recreates the CASCADES foreign keys of an existing Postgres
+    database that are not ON DELETE CASCADE yet. The new constraint is
+    validated in a second transaction, so the tables are only locked
+    briefly. SQLite can not alter constraints, its tables keep theirs.
+    Returns the names of the constraints changed
+    """
+    changed = []
+    if engine.dialect.name != 'postgresql':
+        return changed
+    with engine.begin() as connection:
+        inspector = inspect(connection)
+        for table, column, referred, referred_column in CASCADES:
+            for foreign_key in inspector.get_foreign_keys(table):
+                ondelete = foreign_key['options'].get('ondelete') or ''
+                if foreign_key['constrained_columns'] != [column] or \
+                        ondelete.upper() == 'CASCADE':
+                    continue
+                connection.execute(text(
+                    'ALTER TABLE {0} DROP CONSTRAINT {1}, '
+                    'ADD CONSTRAINT {1} FOREIGN KEY ({2}) '
+                    'REFERENCES {3} ({4}) ON DELETE CASCADE NOT VALID'
+                    .format(table, foreign_key['name'], column, referred,
+                            referred_column)))
+                changed.append((table, foreign_key['name']))
+    for table, name in changed:
+        with engine.begin() as connection:
+            connection.execute(text('ALTER TABLE {0} VALIDATE CONSTRAINT {1}'
+                                    .format(table, name)))
+        print('{0} now ON DELETE CASCADE'.format(name))
+    return [name for _, name in changed]
+
+
+# creation dates stored by SQLite's CURRENT_TIMESTAMP, before they were
+# set in Python, and the table of each
+SECOND_DATES = [('items', 'creation_date'),
+                ('latest_items', 'creation_date')]
+
+
+def normalize_dates(engine):
+    """Rewrites the SECOND_DATES of a SQLite database stored without
+    microseconds in the format of SQLAlchemy ('... 16:29:41.000000'), so
+    they compare with the dates bound to queries. Returns the number of
+    rows changed
+    """
+    if engine.dialect.name != 'sqlite':
+        return 0
+    changed = 0
+    with engine.begin() as connection:
+        for table, column in SECOND_DATES:
+            changed += connection.execute(text(
+                "UPDATE {0} SET {1} = {1} || '.000000' "
+                "WHERE length({1}) = 19".format(table, column))).rowcount
+    if changed:
+        print('{0} creation dates normalized'.format(changed))
+    return changed
+
+
+def create_indexes(engine):
+    """Adds the tables and indexes declared on the models to an existing
+    database, skipping those already present. On Postgres they are built with
+    CREATE INDEX CONCURRENTLY so the tables stay writable meanwhile.
+    A unique index fails to build while duplicates exist; that index
+    is reported and the others are still created.
+    """
+    Base.metadata.create_all(engine)
+    add_columns(engine)
+    add_cascades(engine)
+    normalize_dates(engine)
+
+    postgres = engine.dialect.name == 'postgresql'
+    failed = []
+    with engine.connect() as connection:
+        if postgres:
+            # CONCURRENTLY can not run inside a transaction block
+            connection = connection.execution_options(
+                isolation_level='AUTOCOMMIT')
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                if postgres:
+                    index.dialect_options['postgresql']['concurrently'] = True
+                try:
+                    index.create(bind=connection, checkfirst=True)
+                    print('{0} ok'.format(index.name))
+                except Exception as e:
+                    print('{0} failed: {1}'.format(index.name, e))
+                    failed.append(index.name)
+                finally:
+                    if postgres:
+                        index.dialect_options['postgresql']['concurrently'] =\
+                            False
+        create_search_index(connection, concurrently=postgres)
+    return failed
+
+
+def create_database():
     # Creating database catalog
     # https://stackoverflow.com/questions/6506578/how-to-create-a-new-database-using-sqlalchemy
     engine = create_engine('postgresql:///postgres')
@@ -84,4 +373,35 @@ if __name__ == "__main__":
 
     # Connect to catalog db and create tables
     engine = create_engine('postgresql:///catalog')
-    Base.metadata.create_all(engine)
+    create_tables(engine)
+
+
+if __name__ == "__main__":
+    from config import Config
+
+    parser = argparse.ArgumentParser(description='Catalog database setup')
+    parser.add_argument('command', nargs='?', default='create',
+                        choices=['create', 'migrate', 'reconcile'],
+                        help='create: create the catalog database and its '
+                             'tables (default), migrate: add missing tables, '
+                             'columns, indexes and cascades to the existing '
+                             'database at DATABASE_URL, reconcile: recount '
+                             'the items of each category and rebuild the '
+                             'latest items there')
+    args = parser.parse_args()
+
+    if args.command == 'create':
+        create_database()
+    elif args.command == 'migrate':
+        engine = create_engine(Config.DATABASE_URL)
+        failed = create_indexes(engine)
+        # fills the columns just added
+        import summaries
+        with engine.begin() as connection:
+            summaries.reconcile(connection)
+        if failed:
+            raise SystemExit(1)
+    elif args.command == 'reconcile':
+        import summaries
+        with create_engine(Config.DATABASE_URL).begin() as connection:
+            summaries.reconcile(connection)
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""Cache of rendered template fragments.
+
+Wrapping part of a template in
+
+    {% cache "sidebar", revision %} ... {% endcache %}
+
+renders it once per distinct key and serves the stored HTML afterwards.
+Keys include the catalog revision, so a write anywhere makes the old
+fragments unreachable; whatever the views need for the fragment has to
+be loaded lazily from inside the block for a hit to save the queries.
+The store is pluggable: a bounded in-process LRU or a directory of
+files shared by every worker process of the host.
+"""
+
+import hashlib
+import os
+import tempfile
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+from lookup_cache import LRUCache
+
+
+class MemoryBackend(LRUCache):
+    """In-process store holding at most max_size fragments"""
+
+
+class FileBackend(object):
+    """Store writing one file per fragment in directory, keeping the
+    max_size most recently written
+    """
+
+    def __init__(self, directory, max_size=1024):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, name + '.html')
+
+    def get(self, key):
+        try:
+            with open(self._path(key), encoding='utf-8') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def set(self, key, value):
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(value)
+        # atomic, readers never see a partial fragment
+        os.replace(tmp, self._path(key))
+        self._prune()
+
+    def _prune(self):
+        entries = [e for e in os.scandir(self.directory)
+                   if e.name.endswith('.html')]
+        if len(entries) <= self.max_size:
+            return
+        entries.sort(key=lambda e: e.stat().st_mtime)
+        for entry in entries[:len(entries) - self.max_size]:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.html'):
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+
+def create_backend(kind, max_size, directory=None):
+    """Backend named by the FRAGMENT_CACHE setting, None for no cache"""
+    if kind == 'memory':
+        return MemoryBackend(max_size)
+    if kind == 'file':
+        return FileBackend(directory, max_size)
+    return None
+
+
+def fragment_key(key_parts):
+    return ':'.join(str(part) for part in key_parts)
+
+
+def has_fragment(environment, *key_parts):
+    """Whether the {% cache %} block keyed by key_parts is stored, i.e.
+    its data does not need to be loaded for the next render
+    """
+    cache = environment.fragment_cache
+    return cache is not None and \
+        cache.get(fragment_key(key_parts)) is not None
+
+
+class FragmentCacheExtension(Extension):
+    """Adds the {% cache key, ... %} tag, storing fragments in the
+    environment's fragment_cache backend (no caching when None)
+    """
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super(FragmentCacheExtension, self).__init__(environment)
+        environment.extend(fragment_cache=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(
+            self.call_method('_cached', [nodes.List(args)]),
+            [], [], body).set_lineno(lineno)
+
+    def _cached(self, key_parts, caller):
+        cache = self.environment.fragment_cache
+        if cache is None:
+            return caller()
+        key = fragment_key(key_parts)
+        fragment = cache.get(key)
+        if fragment is None:
+            fragment = caller()
+            cache.set(key, str(fragment))
+        return Markup(fragment)
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""Google sign in, server side.
+
+The client secrets are parsed once, every call to Google goes through
+one keep-alive requests.Session with a timeout, and ID tokens are
+verified locally against Google's signing certificates, cached for as
+long as Google's Cache-Control allows. Another OpenID provider, e.g. the
+local stub of stub_identity_provider.py, is used through its discovery
+document (OAUTH_DISCOVERY_URI), and every endpoint can be overridden on
+its own (OAUTH_* settings).
+
+requests and oauth2client are imported by the first sign in, they would
+take a third of the start up time of the service.
+"""
+
+import json
+import re
+import textwrap
+import threading
+import time
+
+
+TOKEN_URI = 'https://oauth2.googleapis.com/token'
+CERTS_URI = 'https://www.googleapis.com/oauth2/v1/certs'
+USERINFO_URI = 'https://www.googleapis.com/oauth2/v1/userinfo'
+REVOKE_URI = 'https://oauth2.googleapis.com/revoke'
+ISSUERS = ('accounts.google.com', 'https://accounts.google.com')
+
+MAX_AGE = re.compile(r'max-age=(\d+)')
+
+
+class AuthError(Exception):
+    """Sign in step that failed, its message fit for the client"""
+
+
+def _jwks_certs(jwks):
+    """{key id: PEM certificate} of the keys of a JSON Web Key Set that
+    carry their certificate (x5c), the form oauth2client verifies with
+    """
+    return {key.get('kid', str(n)):
+            '-----BEGIN CERTIFICATE-----\n{0}\n-----END CERTIFICATE-----\n'
+            .format('\n'.join(textwrap.wrap(key['x5c'][0], 64)))
+            for n, key in enumerate(jwks.get('keys', ())) if key.get('x5c')}
+
+
+class GoogleAuth(object):
+
+    def __init__(self, secrets_file, timeout=5.0, token_uri=None,
+                 certs_uri=None, userinfo_uri=None, revoke_uri=None,
+                 issuers=ISSUERS, pool_size=10, discovery_uri=None):
+        self.secrets_file = secrets_file
+        self.timeout = timeout
+        self.discovery_uri = discovery_uri
+        self.token_uri = token_uri
+        self.certs_uri = certs_uri
+        self._userinfo_uri = userinfo_uri
+        self._revoke_uri = revoke_uri
+        self._issuers = issuers
+        self._discovery = None
+        self._secrets = None
+        self._certs = None
+        self._certs_expire = 0
+        self._lock = threading.RLock()
+        self.pool_size = pool_size
+        self._http = None
+
+    @property
+    def http(self):
+        """requests.Session of every call, keeping connections alive"""
+        with self._lock:
+            if self._http is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                http = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4,
+                                      pool_maxsize=self.pool_size)
+                http.mount('https://', adapter)
+                http.mount('http://', adapter)
+                self._http = http
+            return self._http
+
+    @property
+    def secrets(self):
+        """The 'web' section of the client secrets file, read once"""
+        if self._secrets is None:
+            with open(self.secrets_file, 'r') as f:
+                self._secrets = json.load(f)['web']
+        return self._secrets
+
+    @property
+    def client_id(self):
+        return self.secrets['client_id']
+
+    @property
+    def discovery(self):
+        """OpenID configuration of the provider at discovery_uri, fetched
+        once; empty for Google
+        """
+        with self._lock:
+            if self._discovery is None:
+                if self.discovery_uri is None:
+                    self._discovery = {}
+                else:
+                    response = self._request('GET', self.discovery_uri)
+                    try:
+                        if response.status_code != 200:
+                            raise ValueError(response.status_code)
+                        self._discovery = dict(response.json())
+                    except (TypeError, ValueError):
+                        raise AuthError(
+                            'Failed to reach the identity provider.')
+            return self._discovery
+
+    @property
+    def userinfo_uri(self):
+        return self._userinfo_uri or \
+            self.discovery.get('userinfo_endpoint', USERINFO_URI)
+
+    @property
+    def revoke_uri(self):
+        return self._revoke_uri or \
+            self.discovery.get('revocation_endpoint', REVOKE_URI)
+
+    @property
+    def issuers(self):
+        if 'issuer' in self.discovery:
+            return (self.discovery['issuer'],)
+        return self._issuers
+
+    def _request(self, method, url, **kwargs):
+        import requests
+
+        try:
+            return self.http.request(method, url, timeout=self.timeout,
+                                     **kwargs)
+        except requests.RequestException:
+            raise AuthError('Failed to reach the identity provider.')
+
+    def exchange_code(self, code):
+        """Token response (access_token, id_token, ...) for a one time
+        authorization code of the sign in button
+        """
+        uri = self.token_uri or self.discovery.get('token_endpoint') or \
+            self.secrets.get('token_uri', TOKEN_URI)
+        response = self._request('POST', uri, data={
+            'code': code,
+            'client_id': self.client_id,
+            'client_secret': self.secrets['client_secret'],
+            'redirect_uri': 'postmessage',
+            'grant_type': 'authorization_code'})
+        try:
+            if response.status_code != 200:
+                raise ValueError(response.status_code)
+            token = dict(response.json())
+        except (TypeError, ValueError):
+            raise AuthError('Failed to upgrade the authorization code.')
+        if 'access_token' not in token or 'id_token' not in token:
+            raise AuthError('Failed to upgrade the authorization code.')
+        return token
+
+    def certs(self):
+        """Signing certificates by key id, refetched once they expire.
+        Google serves them as PEM, discovered providers as a JSON Web Key
+        Set
+        """
+        with self._lock:
+            if self._certs is None or time.time() >= self._certs_expire:
+                uri = self.certs_uri or self.discovery.get('jwks_uri') or \
+                    self.secrets.get('auth_provider_x509_cert_url',
+                                     CERTS_URI)
+                response = self._request('GET', uri)
+                try:
+                    if response.status_code != 200:
+                        raise ValueError(response.status_code)
+                    certs = dict(response.json())
+                    if 'keys' in certs:
+                        certs = _jwks_certs(certs)
+                except (TypeError, ValueError, KeyError, IndexError):
+                    certs = None
+                if not certs:
+                    raise AuthError('Failed to fetch the signing keys.')
+                max_age = MAX_AGE.search(
+                    response.headers.get('Cache-Control', ''))
+                self._certs = certs
+                self._certs_expire = time.time() + \
+                    (int(max_age.group(1)) if max_age else 3600)
+            return self._certs
+
+    def verify_id_token(self, id_token):
+        """Claims of id_token once its signature, expiry, audience and
+        issuer check out
+        """
+        from oauth2client import crypt
+
+        try:
+            claims = crypt.verify_signed_jwt_with_certs(
+                id_token, self.certs(), self.client_id)
+        except crypt.AppIdentityError:
+            raise AuthError('Invalid ID token.')
+        if claims.get('iss') not in self.issuers:
+            raise AuthError('Token was not issued by the identity '
+                            'provider.')
+        return claims
+
+    def user_info(self, access_token, claims):
+        """name, email and picture of the signed in user, from the ID
+        token claims when they have them
+        """
+        if 'name' in claims and 'email' in claims:
+            return {'name': claims['name'],
+                    'email': claims['email'],
+                    'picture': claims.get('picture')}
+        response = self._request(
+            'GET', self.userinfo_uri,
+            headers={'Authorization': 'Bearer ' + access_token})
+        try:
+            if response.status_code != 200:
+                raise ValueError(response.status_code)
+            data = dict(response.json())
+        except (TypeError, ValueError):
+            raise AuthError('Failed to fetch the user info.')
+        if not data.get('email'):
+            # users are told apart by their email
+            raise AuthError('The identity provider gave no email.')
+        return {'name': data.get('name') or data['email'],
+                'email': data['email'],
+                'picture': data.get('picture')}
+
+    def sign_in(self, code):
+        """(access token, Google user id, user info) for an authorization
+        code, raising AuthError when any step fails
+        """
+        token = self.exchange_code(code)
+        claims = self.verify_id_token(token['id_token'])
+        return (token['access_token'], claims['sub'],
+                self.user_info(token['access_token'], claims))
+
+    def revoke(self, access_token):
+        """True once the token is revoked, or was not valid anyway"""
+        try:
+            # revoke_uri may fetch the discovery document
+            uri = self.revoke_uri
+            response = self._request('POST', uri,
+                                     data={'token': access_token})
+        except AuthError:
+            return False
+        if response.status_code == 200:
+            return True
+        try:
+            return response.json().get('error') == 'invalid_token'
+        except ValueError:
+            return False
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""Production server of the catalog service.
+
+gunicorn reads this file when started from this directory:
+
+    gunicorn                      # catalog_service:app on 0.0.0.0:5000
+
+The master forks WEB_CONCURRENCY worker processes (default one per
+core), each serving WORKER_THREADS requests at a time. A worker opens
+its own connection pools, warms up (see catalog_service.warm_up) before
+it accepts requests, and is replaced after about MAX_REQUESTS requests.
+`kill -HUP <master pid>` reloads the code gracefully: new workers are
+started, and the old ones finish their requests in flight (within
+GRACEFUL_TIMEOUT seconds) before they exit. With PRELOAD_APP=1 the app
+is imported once by the master, so workers start faster and share its
+memory, but a HUP no longer reloads the code.
+
+It refuses to start without a SECRET_KEY of its own.
+"""
+
+import multiprocessing
+import os
+import sys
+
+from config import Config, check_secret_key, env_flag, env_int
+
+
+wsgi_app = 'catalog_service:app'
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+workers = env_int('WEB_CONCURRENCY', multiprocessing.cpu_count())
+threads = env_int('WORKER_THREADS', 1)
+# recycled with some jitter, so workers do not all restart at once
+max_requests = env_int('MAX_REQUESTS', 1000)
+max_requests_jitter = env_int('MAX_REQUESTS_JITTER', max_requests // 10)
+timeout = env_int('WORKER_TIMEOUT', 30)
+graceful_timeout = env_int('GRACEFUL_TIMEOUT', 30)
+keepalive = env_int('KEEPALIVE', 5)
+preload_app = env_flag('PRELOAD_APP')
+accesslog = os.environ.get('ACCESS_LOG')
+
+
+def on_starting(server):
+    # catalog_service:app is made from Config, checked before any worker
+    check_secret_key(Config.SECRET_KEY)
+
+
+def post_fork(server, worker):
+    service = sys.modules.get('catalog_service')
+    if service is not None:
+        # imported by the master (PRELOAD_APP), its connections belong to
+        # it
+        service.app.extensions['catalog'].dispose(close=False)
+
+
+def post_worker_init(worker):
+    from catalog_service import warm_up
+
+    warm_up(worker.wsgi, connections=worker.cfg.threads)
+    worker.log.info('Worker %s warmed up', worker.pid)
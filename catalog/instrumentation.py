@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""Opt-in per request instrumentation.
+
+Records, for every request, the number of SQL statements issued, the
+time spent in the database, the time spent rendering templates and the
+slowest statements. The figures are sent back in a `Server-Timing`
+header, aggregated per route on `/stats/json` and requests slower than
+`SLOW_REQUEST_MS` are written to the `catalog.slow` log.
+
+Enable it with `SQL_INSTRUMENTATION = True` in the app config.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+
+from flask import g, request, jsonify, has_request_context
+from flask import before_render_template, template_rendered
+from sqlalchemy import event
+
+
+slow_log = logging.getLogger('catalog.slow')
+
+
+def percentile(sorted_values, fraction):
+    """Nearest rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = int(round(fraction * (len(sorted_values) - 1)))
+    return sorted_values[rank]
+
+
+class RequestStats(object):
+    """Timings collected while serving a single request"""
+
+    def __init__(self, keep_slowest):
+        self.started = time.perf_counter()
+        self.statement_count = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        # start of the template being rendered
+        self.render_started = None
+        self.keep_slowest = keep_slowest
+        self.slowest = []
+
+    def add_statement(self, statement, duration):
+        self.statement_count += 1
+        self.db_time += duration
+        self.slowest.append((duration, statement))
+        self.slowest.sort(key=lambda s: s[0], reverse=True)
+        del self.slowest[self.keep_slowest:]
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+class RouteStats(object):
+    """Rolling window of the most recent requests of one route"""
+
+    def __init__(self, window):
+        self.count = 0
+        self.total = deque(maxlen=window)
+        self.db = deque(maxlen=window)
+        self.template = deque(maxlen=window)
+        self.statements = deque(maxlen=window)
+
+    def add(self, stats, elapsed):
+        self.count += 1
+        self.total.append(elapsed * 1000)
+        self.db.append(stats.db_time * 1000)
+        self.template.append(stats.template_time * 1000)
+        self.statements.append(stats.statement_count)
+
+    def summary(self):
+        summary = {'count': self.count}
+        for name, values in (('total_ms', self.total),
+                             ('db_ms', self.db),
+                             ('template_ms', self.template),
+                             ('statements', self.statements)):
+            ordered = sorted(values)
+            summary[name] = {
+                'p50': percentile(ordered, 0.50),
+                'p95': percentile(ordered, 0.95),
+                'p99': percentile(ordered, 0.99),
+                'max': ordered[-1] if ordered else 0,
+            }
+        return summary
+
+
+class Instrumentation(object):
+
+    def __init__(self, app=None, engine=None):
+        self.routes = {}
+        self.lock = threading.Lock()
+        self.enabled = False
+        if app is not None:
+            self.init_app(app, engine)
+
+    def init_app(self, app, engine=None):
+        """Hooks into app, and into engine when given; engines made later
+        are handed to watch()
+        """
+        if not app.config.get('SQL_INSTRUMENTATION'):
+            return
+        self.enabled = True
+        self.slow_request_ms = app.config['SLOW_REQUEST_MS']
+        self.keep_slowest = app.config['SLOWEST_STATEMENTS']
+        self.window = app.config['STATS_WINDOW']
+
+        if engine is not None:
+            self.watch(engine)
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._after_render, app)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.add_url_rule('/stats/json', 'request_stats', self.stats_json)
+
+    def watch(self, engine):
+        """Times the statements of engine, when instrumentation is on"""
+        if not self.enabled:
+            return
+        event.listen(engine, 'before_cursor_execute',
+                     self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute',
+                     self._after_cursor_execute)
+        event.listen(engine, 'handle_error', self._handle_error)
+
+    @staticmethod
+    def _current():
+        if has_request_context():
+            return g.get('request_stats')
+        return None
+
+    def _before_request(self):
+        g.request_stats = RequestStats(self.keep_slowest)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters,
+                               context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters,
+                              context, executemany):
+        duration = time.perf_counter() - conn.info['query_start'].pop()
+        stats = self._current()
+        if stats is not None:
+            stats.add_statement(statement, duration)
+
+    def _handle_error(self, context):
+        # a statement that failed gets no after_cursor_execute; without an
+        # execution context it failed before before_cursor_execute
+        starts = context.connection is not None and \
+            context.connection.info.get('query_start')
+        if context.execution_context is None or not starts:
+            return
+        duration = time.perf_counter() - starts.pop()
+        stats = self._current()
+        if stats is not None:
+            stats.add_statement(context.statement, duration)
+
+    def _before_render(self, sender, template, context, **extra):
+        stats = self._current()
+        if stats is not None:
+            stats.render_started = time.perf_counter()
+
+    def _after_render(self, sender, template, context, **extra):
+        stats = self._current()
+        if stats is not None and stats.render_started is not None:
+            stats.template_time += \
+                time.perf_counter() - stats.render_started
+            stats.render_started = None
+
+    def _after_request(self, response):
+        stats = self._current()
+        if stats is None:
+            return response
+        elapsed = stats.elapsed()
+        route = request.url_rule.rule if request.url_rule else '<unmatched>'
+
+        with self.lock:
+            route_stats = self.routes.get(route)
+            if route_stats is None:
+                route_stats = self.routes[route] = RouteStats(self.window)
+            route_stats.add(stats, elapsed)
+
+        response.headers['Server-Timing'] = ', '.join([
+            'db;dur={0:.2f};desc="{1} queries"'
+            .format(stats.db_time * 1000, stats.statement_count),
+            'tpl;dur={0:.2f}'.format(stats.template_time * 1000),
+            'total;dur={0:.2f}'.format(elapsed * 1000),
+        ])
+
+        if elapsed * 1000 >= self.slow_request_ms:
+            slow_log.warning(
+                '%s %s took %.1f ms (%d queries, %.1f ms in db, '
+                '%.1f ms rendering); slowest: %s',
+                request.method, request.path, elapsed * 1000,
+                stats.statement_count, stats.db_time * 1000,
+                stats.template_time * 1000,
+                ' | '.join('{0:.1f} ms {1}'.format(d * 1000, s)
+                           for d, s in stats.slowest))
+        return response
+
+    def stats_json(self):
+        with self.lock:
+            routes = {route: stats.summary()
+                      for route, stats in self.routes.items()}
+        return jsonify(Routes=routes)
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""Bounded in-process cache of the name -> id lookups done by the views.
+
+Every route resolves a category name or an item title from the URL
+before doing any work. The few columns needed for that (id and owner)
+are kept here, keyed by name, and dropped by the views that write
+categories or items. The optional TTL bounds how long another process
+can keep serving an entry after a write it did not see.
+"""
+
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+
+CategoryRef = namedtuple('CategoryRef', 'id name user_id')
+ItemRef = namedtuple('ItemRef', 'id title category_id user_id')
+
+
+class LRUCache(object):
+
+    def __init__(self, max_size=1024, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Returns the cached value of key, None if absent or expired"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires is None or expires > time.monotonic():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self.lock:
+            self.entries[key] = (value, expires)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    @property
+    def stats(self):
+        return {'size': len(self.entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions}
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""Keyset (cursor) pagination.
+
+Instead of an OFFSET, a page starts right after the sort key of the last
+row of the previous page, so every page is a range scan on an index and
+page N costs the same as page 1. The sort key is handed to clients as an
+opaque url-safe cursor.
+"""
+
+import base64
+import json
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import literal, tuple_
+from sqlalchemy.types import DateTime, Integer, String
+
+
+Page = namedtuple('Page', 'rows next_cursor')
+
+
+def encode_cursor(values):
+    values = [v.isoformat() if isinstance(v, datetime) else v
+              for v in values]
+    data = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, columns):
+    """Sort key values of cursor, typed after columns. Raises
+    ValueError when the cursor is not one of ours
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (TypeError, ValueError, UnicodeError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list) or len(values) != len(columns):
+        raise ValueError('Invalid cursor')
+    return [_decode_value(c, v) for c, v in zip(columns, values)]
+
+
+def _decode_value(column, value):
+    """value of a cursor, checked against the type of its column"""
+    if isinstance(column.type, Integer):
+        # bool is an int too
+        if not isinstance(value, int) or isinstance(value, bool):
+            raise ValueError('Invalid cursor')
+    elif isinstance(column.type, (DateTime, String)):
+        if not isinstance(value, str):
+            raise ValueError('Invalid cursor')
+        if isinstance(column.type, DateTime):
+            return datetime.fromisoformat(value)
+    return value
+
+
+def keyset_query(query, columns, limit, cursor=None, descending=False):
+    """query (a Query or a select()) narrowed to the page following
+    cursor, ordered by columns, with one row more than limit to tell
+    whether another page follows.
+
+    columns must be unique together (end them with the primary key) and
+    be selected by the query under their own names, so the key of the
+    last row can be read back from it.
+    """
+    if cursor:
+        key = tuple_(*columns)
+        values = tuple_(*[literal(v, type_=c.type) for c, v in
+                          zip(columns, decode_cursor(cursor, columns))])
+        query = query.filter(key < values if descending else key > values)
+    order = [c.desc() for c in columns] if descending else list(columns)
+    return query.order_by(*order).limit(limit + 1)
+
+
+def page_of(rows, columns, limit):
+    """Page of the rows fetched with keyset_query"""
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor([getattr(last, c.key) for c in columns])
+    return Page(rows, next_cursor)
+
+
+def keyset_page(query, columns, limit, cursor=None, descending=False):
+    """Returns the page of query following cursor, ordered by columns
+    (see keyset_query)
+    """
+    rows = keyset_query(query, columns, limit, cursor, descending).all()
+    return page_of(rows, columns, limit)
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""Routing of reads to read replicas.
+
+A RoutingSession sends its statements to one replica of a ReplicaSet,
+picked round-robin or by least connections in use, until it writes
+(a flush or an INSERT/UPDATE/DELETE) or is told to use_primary(); from
+then on everything goes to the primary, so a session reads its own
+writes. A replica that drops its connections is left out for
+retry_interval seconds and probed with SELECT 1 before it is used again.
+"""
+
+import itertools
+import threading
+import time
+
+from sqlalchemy import event, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.dml import UpdateBase
+
+
+ROUND_ROBIN = 'round_robin'
+LEAST_CONNECTIONS = 'least_connections'
+
+
+class ReplicaSet(object):
+
+    def __init__(self, engines, strategy=ROUND_ROBIN, retry_interval=30.0,
+                 probe=True):
+        if strategy not in (ROUND_ROBIN, LEAST_CONNECTIONS):
+            raise ValueError('Unknown replica strategy {}'.format(strategy))
+        self.engines = list(engines)
+        self.strategy = strategy
+        self.retry_interval = retry_interval
+        # async engines can't be probed from here, their traffic is
+        self.probe = probe
+        self.lock = threading.Lock()
+        self.turn = itertools.count()
+        self.in_use = {engine: 0 for engine in self.engines}
+        self.picks = {engine: 0 for engine in self.engines}
+        # probed before their first use
+        self.down_until = {engine: 0 for engine in self.engines} \
+            if probe else {}
+        for engine in self.engines:
+            self._watch(engine)
+
+    def _watch(self, engine):
+        @event.listens_for(engine, 'checkout')
+        def checkout(*args):
+            with self.lock:
+                self.in_use[engine] += 1
+
+        @event.listens_for(engine, 'checkin')
+        def checkin(*args):
+            with self.lock:
+                self.in_use[engine] -= 1
+
+        @event.listens_for(engine, 'handle_error')
+        def handle_error(context):
+            # lost connections, or no connection to begin with
+            if context.is_disconnect or context.connection is None:
+                self.mark_down(engine)
+
+    def mark_down(self, engine):
+        with self.lock:
+            self.down_until[engine] = time.monotonic() + self.retry_interval
+
+    def is_up(self, engine):
+        with self.lock:
+            return self.down_until.get(engine, 0) <= time.monotonic()
+
+    def _healthy(self, engine):
+        """SELECT 1 on engine, marking it down when that fails"""
+        try:
+            with engine.connect() as connection:
+                connection.execute(text('SELECT 1'))
+        except DBAPIError:
+            self.mark_down(engine)
+            return False
+        with self.lock:
+            self.down_until.pop(engine, None)
+        return True
+
+    def choose(self):
+        """A healthy replica, None when there is none"""
+        now = time.monotonic()
+        with self.lock:
+            due = [e for e, until in self.down_until.items() if until <= now]
+        for engine in due:
+            if self.probe:
+                self._healthy(engine)
+            else:
+                with self.lock:
+                    self.down_until.pop(engine, None)
+
+        with self.lock:
+            candidates = [e for e in self.engines
+                          if e not in self.down_until]
+            if not candidates:
+                return None
+            if self.strategy == LEAST_CONNECTIONS:
+                engine = min(candidates, key=lambda e: self.in_use[e])
+            else:
+                engine = candidates[next(self.turn) % len(candidates)]
+            self.picks[engine] += 1
+            return engine
+
+    @property
+    def stats(self):
+        now = time.monotonic()
+        with self.lock:
+            return [{'url': engine.url.render_as_string(hide_password=True),
+                     'healthy': self.down_until.get(engine, 0) <= now,
+                     'in_use': self.in_use[engine],
+                     'picks': self.picks[engine]}
+                    for engine in self.engines]
+
+
+class RoutingSession(Session):
+    """Session reading from replicas, None to use the bind only"""
+
+    def __init__(self, replicas=None, **kwargs):
+        super(RoutingSession, self).__init__(**kwargs)
+        self.replicas = replicas
+
+    def use_primary(self):
+        self.info['primary'] = True
+
+    @property
+    def wrote(self):
+        """Whether the session sent anything to the primary"""
+        return self.info.get('wrote', False)
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        writing = self._flushing or isinstance(clause, UpdateBase)
+        if writing:
+            self.info['wrote'] = True
+        if self.replicas is None or writing or self.info.get('primary'):
+            # reads after a write see it
+            self.info['primary'] = True
+            return super(RoutingSession, self).get_bind(mapper, clause,
+                                                        **kwargs)
+        replica = self.info.get('replica')
+        if replica is None:
+            replica = self.replicas.choose()
+            if replica is None:
+                return super(RoutingSession, self).get_bind(mapper, clause,
+                                                            **kwargs)
+            self.info['replica'] = replica
+        return replica
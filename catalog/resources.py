@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""Resources of a catalog application, made on first use.
+
+create_app() only reads the configuration. The database engine, its
+read replicas, the session factory, the catalog snapshots and the
+Google sign in client are created the first time a request or a script
+asks for them, so importing catalog_service or booting a worker opens
+no connection pool and reads no file.
+"""
+
+import threading
+
+from sqlalchemy.orm import sessionmaker
+
+from database_setup import create_db_engine
+from google_auth import GoogleAuth
+from lookup_cache import LRUCache
+from replicas import ReplicaSet, RoutingSession
+from snapshot import Snapshots
+
+
+class Resources(object):
+
+    def __init__(self, config, instrumentation=None):
+        self.config = config
+        # watches the statements of the engines, once they exist
+        self.instrumentation = instrumentation
+        self._lock = threading.RLock()
+        self._made = {}
+
+        # name -> CategoryRef and title -> ItemRef, dropped by the write
+        # views
+        self.category_refs = LRUCache(config['LOOKUP_CACHE_SIZE'],
+                                      config['LOOKUP_CACHE_TTL'])
+        self.item_refs = LRUCache(config['LOOKUP_CACHE_SIZE'],
+                                  config['LOOKUP_CACHE_TTL'])
+
+    def _once(self, name, make):
+        try:
+            return self._made[name]
+        except KeyError:
+            pass
+        with self._lock:
+            if name not in self._made:
+                self._made[name] = make()
+            return self._made[name]
+
+    def _engine(self, url):
+        engine = create_db_engine(
+            url,
+            pool_size=self.config['DB_POOL_SIZE'],
+            max_overflow=self.config['DB_MAX_OVERFLOW'],
+            pool_timeout=self.config['DB_POOL_TIMEOUT'],
+            pool_recycle=self.config['DB_POOL_RECYCLE'],
+            pool_pre_ping=self.config['DB_POOL_PRE_PING'])
+        if self.instrumentation is not None:
+            self.instrumentation.watch(engine)
+        return engine
+
+    @property
+    def engine(self):
+        """Engine of the primary database"""
+        return self._once('engine',
+                          lambda: self._engine(self.config['DATABASE_URL']))
+
+    @property
+    def replica_set(self):
+        """Read replicas of the GET requests, None without REPLICA_URLS"""
+        def make():
+            if not self.config['REPLICA_URLS']:
+                return None
+            return ReplicaSet(
+                [self._engine(url) for url in self.config['REPLICA_URLS']],
+                strategy=self.config['REPLICA_STRATEGY'],
+                retry_interval=self.config['REPLICA_RETRY_INTERVAL'])
+        return self._once('replica_set', make)
+
+    @property
+    def session_factory(self):
+        return self._once('session_factory', lambda: sessionmaker(
+            bind=self.engine, class_=RoutingSession,
+            replicas=self.replica_set))
+
+    @property
+    def snapshots(self):
+        """In-memory snapshots of the catalog, None without SNAPSHOT"""
+        def make():
+            if not self.config['SNAPSHOT']:
+                return None
+            return Snapshots(self.engine,
+                             self.config['SNAPSHOT_POLL_INTERVAL'])
+        return self._once('snapshots', make)
+
+    @property
+    def google(self):
+        """Sign in calls to Google, sharing keep-alive connections"""
+        return self._once('google', lambda: GoogleAuth(
+            self.config['OAUTH_CLIENT_SECRETS'],
+            timeout=self.config['OAUTH_TIMEOUT'],
+            token_uri=self.config['OAUTH_TOKEN_URI'],
+            certs_uri=self.config['OAUTH_CERTS_URI'],
+            userinfo_uri=self.config['OAUTH_USERINFO_URI'],
+            revoke_uri=self.config['OAUTH_REVOKE_URI'],
+            discovery_uri=self.config['OAUTH_DISCOVERY_URI']))
+
+    def dispose(self, close=True):
+        """Closes the connections of the engines made so far. A forked
+        process passes close=False: it drops the connections of its
+        parent without closing them under it
+        """
+        with self._lock:
+            engines = []
+            if 'engine' in self._made:
+                engines.append(self._made['engine'])
+            if self._made.get('replica_set') is not None:
+                engines.extend(self._made['replica_set'].engines)
+        for engine in engines:
+            engine.dispose(close=close)
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""Catalog revision counter.
+
+Every view that changes categories or items bumps the counter in the
+same transaction as the change. Readers compare it with what a client
+or a cache saw last to tell whether anything changed, with a single
+primary key lookup instead of loading the catalog.
+"""
+
+import datetime
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import scoped_session
+
+from database_setup import Revision
+
+
+CATALOG = 'catalog'
+
+
+def current(session, name=CATALOG):
+    """(value, updated) of the revision, (0, None) before the first
+    change
+    """
+    row = session\
+        .query(Revision.value, Revision.updated)\
+        .filter_by(name=name)\
+        .first()
+    return (row.value, row.updated) if row else (0, None)
+
+
+def bump(session, name=CATALOG):
+    """Increments the revision as part of the session's transaction,
+    once per transaction. The row lock taken makes concurrent writers of
+    the catalog commit one after the other from here on
+    """
+    if isinstance(session, scoped_session):
+        session = session()
+    transaction = session.get_transaction()
+    bumped = session.info.setdefault('revisions_bumped', {})
+    if transaction is not None and bumped.get(name) is transaction:
+        return
+    now = datetime.datetime.utcnow()
+    updated = session\
+        .query(Revision)\
+        .filter_by(name=name)\
+        .update({'value': Revision.value + 1, 'updated': now},
+                synchronize_session=False)
+    if not updated:
+        try:
+            with session.begin_nested():
+                session.add(Revision(name=name, value=1, updated=now))
+        except IntegrityError:
+            # created meanwhile by a concurrent transaction
+            bump(session, name)
+            return
+    bumped[name] = session.get_transaction()
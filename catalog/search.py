@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""Full text search of items by title, description and category name.
+
+Backed by the indexes of database_setup.create_search_index: tsvector
+GIN indexes on Postgres, a FTS5 table on SQLite. Every word of the query
+matches as a prefix ("foot" finds "football"), in the item's title or
+description or in its category's name, and results are ranked by
+relevance. Other databases fall back to an unranked LIKE scan.
+"""
+
+import re
+from collections import namedtuple
+
+from sqlalchemy import func, literal_column, or_, text, union
+
+from database_setup import Category, Item
+from database_setup import ITEM_DOCUMENT, CATEGORY_DOCUMENT
+
+
+Hit = namedtuple('Hit', 'id title description category_id category')
+
+WORD = re.compile(r'\w+', re.UNICODE)
+# weight of a match on the category name, against one on the item
+CATEGORY_WEIGHT = 0.5
+
+
+def words(query):
+    return WORD.findall(query.lower())[:10]
+
+
+def _term_matches(session, term):
+    """ids of the items with term in their own text or in the name of
+    their category, each half found on its GIN index
+    """
+    tsquery = func.to_tsquery('english', term + ':*')
+    return union(
+        session
+        .query(Item.id)
+        .filter(literal_column(ITEM_DOCUMENT).op('@@')(tsquery))
+        .statement.correlate(None),
+        session
+        .query(Item.id)
+        .join(Category, Item.category_id == Category.id)
+        .filter(literal_column(CATEGORY_DOCUMENT).op('@@')(tsquery))
+        .statement.correlate(None))
+
+
+def _postgres(session, terms, limit, offset):
+    # every term, in the item or its category: "soccer ball" finds a
+    # ball of the Soccer category, as FTS5 does on SQLite
+    any_term = func.to_tsquery(
+        'english', ' | '.join(term + ':*' for term in terms))
+    rank = func.ts_rank(literal_column(ITEM_DOCUMENT), any_term) + \
+        func.ts_rank(literal_column(CATEGORY_DOCUMENT), any_term) * \
+        CATEGORY_WEIGHT
+
+    query = session\
+        .query(Item.id, Item.title, Item.description, Item.category_id,
+               Category.name)\
+        .join(Category, Item.category_id == Category.id)
+    for term in terms:
+        query = query.filter(Item.id.in_(_term_matches(session, term)))
+    return query\
+        .order_by(rank.desc(), Item.id)\
+        .limit(limit)\
+        .offset(offset)\
+        .all()
+
+
+def _sqlite(session, terms, limit, offset):
+    match = ' '.join('"{}"*'.format(term) for term in terms)
+    return session.execute(text(
+        "SELECT items.id, items.title, items.description, "
+        "items.category_id, categories.name FROM items_fts "
+        "JOIN items ON items.id = items_fts.rowid "
+        "JOIN categories ON categories.id = items.category_id "
+        "WHERE items_fts MATCH :match "
+        "ORDER BY bm25(items_fts), items.id LIMIT :limit OFFSET :offset"),
+        {'match': match, 'limit': limit, 'offset': offset}).fetchall()
+
+
+def _scan(session, terms, limit, offset):
+    query = session\
+        .query(Item.id, Item.title, Item.description, Item.category_id,
+               Category.name)\
+        .join(Category, Item.category_id == Category.id)
+    for term in terms:
+        pattern = '%{}%'.format(term)
+        query = query.filter(or_(Item.title.ilike(pattern),
+                                 Item.description.ilike(pattern),
+                                 Category.name.ilike(pattern)))
+    return query.order_by(Item.id).limit(limit).offset(offset).all()
+
+
+def search_items(session, query, limit=20, offset=0):
+    """Items matching every word of query, best first, as Hit tuples"""
+    terms = words(query)
+    if not terms:
+        return []
+    dialect = session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        rows = _postgres(session, terms, limit, offset)
+    elif dialect == 'sqlite':
+        rows = _sqlite(session, terms, limit, offset)
+    else:
+        rows = _scan(session, terms, limit, offset)
+    return [Hit(*row) for row in rows]
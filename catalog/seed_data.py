@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""Synthetic catalog generator.
+
+Fills the database at DATABASE_URL (or --database-url) with users,
+categories and items. Sizes are skewed the way real catalogs are: a few
+users own most categories and a few categories hold most items (Zipf
+like, exponent --skew). Creation dates are spread over the last year.
+
+Usage:
+    python seed_data.py --users 50 --categories 500 --items 100000
+"""
+
+import argparse
+import datetime
+import random
+
+from sqlalchemy import func, select
+
+from database_setup import Category, Item, User, Revision
+from database_setup import create_db_engine, create_tables
+import summaries
+
+
+WORDS = ('ball bat glove helmet net racket stick shoe board goal puck '
+         'jersey shorts sock skate ski pole rope mat bag bottle cap '
+         'light heavy pro junior indoor outdoor classic carbon leather '
+         'training match official replica team club').split()
+
+
+def zipf_weights(count, skew):
+    return [1.0 / (rank ** skew) for rank in range(1, count + 1)]
+
+
+def _insert(connection, table, rows, chunk_size=5000):
+    for start in range(0, len(rows), chunk_size):
+        connection.execute(table.insert(), rows[start:start + chunk_size])
+
+
+def seed(engine, users=10, categories=50, items=1000, skew=1.1, seed=0):
+    """Creates the tables if needed and adds the generated rows. Returns
+    the number of rows added per table
+    """
+    rnd = random.Random(seed)
+    create_tables(engine)
+    now = datetime.datetime.utcnow()
+
+    with engine.begin() as connection:
+        # numbering names after the highest id keeps them unique
+        user_base, category_base, item_base = [
+            (connection.execute(select([func.max(table.c.id)])).scalar()
+             or 0) + 1
+            for table in (User.__table__, Category.__table__,
+                          Item.__table__)]
+
+        _insert(connection, User.__table__, [
+            {'name': 'User {}'.format(user_base + n),
+             'email': 'user{}@example.com'.format(user_base + n),
+             'picture': None}
+            for n in range(users)])
+        user_ids = [id for id, in connection.execute(
+            User.__table__.select()
+            .with_only_columns([User.__table__.c.id])
+            .order_by(User.__table__.c.id.desc())
+            .limit(users))]
+
+        owners = rnd.choices(user_ids, zipf_weights(len(user_ids), skew),
+                             k=categories)
+        _insert(connection, Category.__table__, [
+            {'name': '{0} {1}'.format(rnd.choice(WORDS).title(),
+                                      category_base + n),
+             'user_id': owner}
+            for n, owner in enumerate(owners)])
+        category_rows = list(connection.execute(
+            Category.__table__.select()
+            .with_only_columns([Category.__table__.c.id,
+                                Category.__table__.c.user_id])
+            .order_by(Category.__table__.c.id.desc())
+            .limit(categories)))
+
+        placed = rnd.choices(category_rows,
+                             zipf_weights(len(category_rows), skew),
+                             k=items)
+        _insert(connection, Item.__table__, [
+            {'title': '{0} {1} {2}'.format(rnd.choice(WORDS).title(),
+                                           rnd.choice(WORDS),
+                                           item_base + n),
+             'description': ' '.join(rnd.choice(WORDS)
+                                     for _ in range(rnd.randint(3, 20))),
+             'creation_date': now - datetime.timedelta(
+                 seconds=rnd.randint(0, 365 * 24 * 3600)),
+             'category_id': category_id,
+             'user_id': owner}
+            for n, (category_id, owner) in enumerate(placed)])
+        summaries.reconcile(connection)
+
+        # make readers notice the new data
+        updated = connection.execute(
+            Revision.__table__.update()
+            .where(Revision.__table__.c.name == 'catalog')
+            .values(value=Revision.__table__.c.value + 1, updated=now))
+        if not updated.rowcount:
+            connection.execute(Revision.__table__.insert(),
+                               {'name': 'catalog', 'value': 1,
+                                'updated': now})
+
+    return {'users': users, 'categories': categories, 'items': items}
+
+
+if __name__ == "__main__":
+    from config import Config
+
+    parser = argparse.ArgumentParser(description='Generate a synthetic '
+                                                 'catalog')
+    parser.add_argument('--database-url', default=Config.DATABASE_URL)
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--categories', type=int, default=50)
+    parser.add_argument('--items', type=int, default=1000)
+    parser.add_argument('--skew', type=float, default=1.1,
+                        help='Zipf exponent of the categories per user and '
+                             'items per category distributions')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    counts = seed(create_db_engine(args.database_url), args.users,
+                  args.categories, args.items, args.skew, args.seed)
+    print('Added {users} users, {categories} categories and {items} items'
+          .format(**counts))
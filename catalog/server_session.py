@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""Server side sessions.
+
+Session data stays on the server, in memory or in a SQLite file shared
+by the processes of a host, and the cookie only carries a signed random
+session id. The cookie is only sent when a session is created, so
+requests that do not write to the session (anonymous page views
+included) get no Set-Cookie header and can be cached. A session expires
+after SESSION_LIFETIME seconds without a request: a request reading it
+pushes its expiry out once less than half of that is left, so reads
+update the store at most once per half lifetime. Signing in issues a
+new session id (see regenerate), so an id handed out before it can not
+be used to ride on the signed in session.
+"""
+
+import secrets
+import sqlite3
+import threading
+import time
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import BadSignature, Signer
+from werkzeug.datastructures import CallbackDict
+
+
+class ServerSession(CallbackDict, SessionMixin):
+
+    def __init__(self, initial=None, sid=None, expires=None):
+        def on_update(self):
+            self.modified = True
+        super(ServerSession, self).__init__(initial, on_update)
+        self.sid = sid
+        self.expires = expires
+        self.modified = False
+        self.regenerated = False
+
+    def regenerate(self):
+        """Has the session saved under a new id, the old one deleted, e.g.
+        when its user signs in
+        """
+        self.regenerated = True
+        self.modified = True
+
+
+class MemoryStore(object):
+    """Sessions of this process only"""
+
+    def __init__(self):
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.writes = 0
+
+    def load(self, sid):
+        """(data, expires) of the session, None once it expired"""
+        with self.lock:
+            entry = self.sessions.get(sid)
+        if entry is None or entry[1] < time.time():
+            return None
+        return entry
+
+    def touch(self, sid, expires):
+        with self.lock:
+            entry = self.sessions.get(sid)
+            if entry is not None:
+                self.sessions[sid] = (entry[0], expires)
+
+    def save(self, sid, data, expires):
+        with self.lock:
+            self.sessions[sid] = (data, expires)
+            self.writes += 1
+            if self.writes % 1000 == 0:
+                now = time.time()
+                for key in [k for k, (_, e) in self.sessions.items()
+                            if e < now]:
+                    del self.sessions[key]
+
+    def delete(self, sid):
+        with self.lock:
+            self.sessions.pop(sid, None)
+
+
+class SQLiteStore(object):
+    """Sessions in a SQLite file, shared by all processes using it"""
+
+    def __init__(self, path):
+        self.path = path
+        self.writes = 0
+        # the file is set up by the first request using it
+        self.ready = False
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=10)
+        if not self.ready:
+            with connection:
+                connection.execute('PRAGMA journal_mode=WAL')
+                connection.execute(
+                    'CREATE TABLE IF NOT EXISTS sessions ('
+                    'id TEXT PRIMARY KEY, data TEXT NOT NULL, '
+                    'expires REAL NOT NULL)')
+            self.ready = True
+        return connection
+
+    def load(self, sid):
+        """(data, expires) of the session, None once it expired"""
+        connection = self._connect()
+        try:
+            row = connection.execute(
+                'SELECT data, expires FROM sessions '
+                'WHERE id = ? AND expires >= ?',
+                (sid, time.time())).fetchone()
+        finally:
+            connection.close()
+        return tuple(row) if row else None
+
+    def touch(self, sid, expires):
+        connection = self._connect()
+        try:
+            with connection:
+                connection.execute('UPDATE sessions SET expires = ? '
+                                   'WHERE id = ?', (expires, sid))
+        finally:
+            connection.close()
+
+    def save(self, sid, data, expires):
+        connection = self._connect()
+        try:
+            with connection:
+                connection.execute('INSERT OR REPLACE INTO sessions '
+                                   'VALUES (?, ?, ?)', (sid, data, expires))
+                self.writes += 1
+                if self.writes % 1000 == 0:
+                    connection.execute('DELETE FROM sessions '
+                                       'WHERE expires < ?', (time.time(),))
+        finally:
+            connection.close()
+
+    def delete(self, sid):
+        connection = self._connect()
+        try:
+            with connection:
+                connection.execute('DELETE FROM sessions WHERE id = ?',
+                                   (sid,))
+        finally:
+            connection.close()
+
+
+class ServerSessionInterface(SessionInterface):
+    """Keeps session data in store, sessions expiring lifetime seconds
+    after their last request
+    """
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, store, lifetime):
+        self.store = store
+        self.lifetime = lifetime
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt='catalog-session')
+
+    def open_session(self, app, request):
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if not cookie or not app.secret_key:
+            return ServerSession()
+        try:
+            sid = self._signer(app).unsign(cookie).decode('ascii')
+        except BadSignature:
+            return ServerSession()
+        entry = self.store.load(sid)
+        if entry is None:
+            return ServerSession()
+        data, expires = entry
+        return ServerSession(self.serializer.loads(data), sid=sid,
+                             expires=expires)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if session.sid is not None and session.modified:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        if not session.modified:
+            if session.sid is not None and \
+                    session.expires - time.time() < self.lifetime / 2:
+                self.store.touch(session.sid, time.time() + self.lifetime)
+            return
+
+        if session.regenerated and session.sid is not None:
+            self.store.delete(session.sid)
+            session.sid = None
+        new = session.sid is None
+        if new:
+            session.sid = secrets.token_urlsafe(32)
+        self.store.save(session.sid, self.serializer.dumps(dict(session)),
+                        time.time() + self.lifetime)
+        if new:
+            response.set_cookie(
+                name,
+                self._signer(app).sign(session.sid).decode('ascii'),
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app))
+
+
+def create_session_interface(kind, path, lifetime):
+    """Interface named by the SESSION_STORE setting, None to keep
+    Flask's signed cookie sessions
+    """
+    if kind == 'memory':
+        return ServerSessionInterface(MemoryStore(), lifetime)
+    if kind == 'sqlite':
+        return ServerSessionInterface(SQLiteStore(path), lifetime)
+    return None
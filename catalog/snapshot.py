@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""In-memory read model of the catalog.
+
+A Snapshot holds the users, categories and items in __slots__ objects:
+categories by id and by name, items by title, every category with its
+items by id and newest first, and the newest items of the catalog. With
+SNAPSHOT on, the read views (catalog, category and item pages and their
+JSON) are answered from it without a query, conditional GETs included.
+
+A snapshot is never changed. When the catalog revision moves on, a new
+one is loaded and swapped in with one assignment, so a request keeps
+seeing the one it started with. A thread per process checks the
+revision every SNAPSHOT_POLL_INTERVAL seconds, and right away after a
+write of its own process commits. Every write reloads the whole
+catalog, and the old snapshot stays in memory until the new one is
+swapped in. A client that wrote keeps the revision its write produced
+in its session and reads from the database until the snapshot of the
+process serving it has that revision.
+
+    python snapshot.py    # load time and size of the snapshot
+"""
+
+import heapq
+import logging
+import os
+import threading
+import time
+import tracemalloc
+
+from sqlalchemy import select
+from sqlalchemy.exc import DBAPIError
+
+from database_setup import Category, Item, Revision, User
+from pagination import decode_cursor, page_of
+from revisions import CATALOG
+from summaries import LATEST_KEPT
+
+
+log = logging.getLogger('catalog.snapshot')
+
+users = User.__table__
+categories = Category.__table__
+items = Item.__table__
+revisions = Revision.__table__
+
+
+class UserEntry(object):
+    __slots__ = ('id', 'name', 'picture')
+
+    def __init__(self, id, name, picture):
+        self.id = id
+        self.name = name
+        self.picture = picture
+
+
+class CategoryEntry(object):
+    __slots__ = ('id', 'name', 'user_id', 'items', 'newest')
+
+    def __init__(self, id, name, user_id):
+        self.id = id
+        self.name = name
+        self.user_id = user_id
+        # tuples of ItemEntry, by id and newest first
+        self.items = ()
+        self.newest = ()
+
+
+class ItemEntry(object):
+    __slots__ = ('id', 'title', 'description', 'creation_date', 'category',
+                 'user_id')
+
+    def __init__(self, id, title, description, creation_date, category,
+                 user_id):
+        self.id = id
+        self.title = title
+        self.description = description
+        self.creation_date = creation_date
+        self.category = category
+        self.user_id = user_id
+
+    @property
+    def category_id(self):
+        return self.category.id
+
+
+def _newest_first(item):
+    return item.creation_date, item.id
+
+
+class Snapshot(object):
+    __slots__ = ('revision', 'updated', 'users', 'categories',
+                 'categories_by_name', 'items_by_title', 'latest')
+
+    def __init__(self, revision, updated, users, categories, items_by_title):
+        self.revision = revision
+        self.updated = updated
+        self.users = users
+        # by id
+        self.categories = categories
+        self.categories_by_name = {c.name: c for c in categories}
+        self.items_by_title = items_by_title
+        self.latest = tuple(heapq.nlargest(LATEST_KEPT,
+                                           items_by_title.values(),
+                                           key=_newest_first))
+
+    @staticmethod
+    def page(entries, columns, limit, cursor=None, descending=False):
+        """Page of entries, ordered by columns, following cursor: the page
+        pagination.keyset_page returns for the same rows in the database
+        """
+        start = 0
+        if cursor:
+            values = tuple(decode_cursor(cursor, columns))
+            keys = [c.key for c in columns]
+            # first entry past the cursor
+            high = len(entries)
+            while start < high:
+                middle = (start + high) // 2
+                key = tuple(getattr(entries[middle], k) for k in keys)
+                if key < values if descending else key > values:
+                    high = middle
+                else:
+                    start = middle + 1
+        return page_of(entries[start:start + limit + 1], columns, limit)
+
+
+def load(engine):
+    """Snapshot of the catalog in the database of engine. The revision is
+    read first, so the snapshot is at least as new as its revision
+    """
+    with engine.connect() as connection:
+        row = connection.execute(
+            select(revisions.c.value, revisions.c.updated)
+            .where(revisions.c.name == CATALOG)).first()
+        revision, updated = (row.value, row.updated) if row else (0, None)
+
+        user_entries = {
+            row.id: UserEntry(row.id, row.name, row.picture)
+            for row in connection.execute(
+                select(users.c.id, users.c.name, users.c.picture))}
+        category_entries = [
+            CategoryEntry(row.id, row.name, row.user_id)
+            for row in connection.execute(
+                select(categories.c.id, categories.c.name,
+                       categories.c.user_id)
+                .order_by(categories.c.id))]
+        by_id = {c.id: c for c in category_entries}
+        items_of = {c.id: [] for c in category_entries}
+
+        items_by_title = {}
+        rows = connection\
+            .execution_options(stream_results=True)\
+            .execute(select(items.c.id, items.c.title, items.c.description,
+                            items.c.creation_date, items.c.category_id,
+                            items.c.user_id)
+                     .order_by(items.c.id))
+        for row in rows:
+            category = by_id.get(row.category_id)
+            if category is None:
+                # of a category added after they were read, in the next
+                # snapshot
+                continue
+            item = ItemEntry(row.id, row.title, row.description,
+                             row.creation_date, category, row.user_id)
+            items_of[category.id].append(item)
+            items_by_title[item.title] = item
+
+    for category in category_entries:
+        category.items = tuple(items_of.pop(category.id))
+        category.newest = tuple(sorted(category.items, key=_newest_first,
+                                       reverse=True))
+    return Snapshot(revision, updated, user_entries, tuple(category_entries),
+                    items_by_title)
+
+
+class Snapshots(object):
+    """The current Snapshot of the catalog in the database of engine"""
+
+    def __init__(self, engine, poll_interval=1.0):
+        self.engine = engine
+        self.poll_interval = poll_interval
+        self.current = None
+        self.loads = 0
+        self._lock = threading.Lock()
+        self._changed = threading.Event()
+        # process the poller runs in, it does not survive a fork
+        self._poller_pid = None
+
+    def get(self):
+        """The current snapshot, loading the first one"""
+        if self.current is None or self._poller_pid != os.getpid():
+            with self._lock:
+                if self.current is None:
+                    self._swap(load(self.engine))
+                if self._poller_pid != os.getpid():
+                    self._poller_pid = os.getpid()
+                    threading.Thread(target=self._poll, daemon=True,
+                                     name='catalog-snapshot').start()
+        return self.current
+
+    def _swap(self, snapshot):
+        self.current = snapshot
+        self.loads += 1
+
+    def changed(self):
+        """Has the revision checked now, after a committed write"""
+        self._changed.set()
+
+    def refresh(self):
+        """Loads a new snapshot when the revision moved on, returning
+        whether it did
+        """
+        with self.engine.connect() as connection:
+            revision = connection.execute(
+                select(revisions.c.value)
+                .where(revisions.c.name == CATALOG)).scalar() or 0
+        if self.current is not None and revision == self.current.revision:
+            return False
+        self._swap(load(self.engine))
+        return True
+
+    def _poll(self):
+        while True:
+            self._changed.wait(self.poll_interval)
+            self._changed.clear()
+            try:
+                self.refresh()
+            except DBAPIError:
+                log.exception('Failed to refresh the catalog snapshot')
+
+    @property
+    def stats(self):
+        snapshot = self.current
+        if snapshot is None:
+            return {'loaded': False, 'loads': self.loads}
+        return {'loaded': True,
+                'loads': self.loads,
+                'revision': snapshot.revision,
+                'categories': len(snapshot.categories),
+                'items': len(snapshot.items_by_title)}
+
+
+def measure(engine):
+    """Load time (s) and memory held (bytes, as traced by tracemalloc) of
+    a snapshot of engine's catalog, with its item count. Tracing slows
+    the load down, it is timed on a load of its own
+    """
+    started = time.perf_counter()
+    load(engine)
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    snapshot = load(engine)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return {'items': len(snapshot.items_by_title),
+            'categories': len(snapshot.categories),
+            'load_seconds': elapsed,
+            'bytes': size,
+            'bytes_per_item': size / max(1, len(snapshot.items_by_title))}
+
+
+if __name__ == '__main__':
+    from config import Config
+    from database_setup import create_db_engine
+
+    figures = measure(create_db_engine(Config.DATABASE_URL))
+    print('{items} items in {categories} categories: {load_seconds:.1f} s, '
+          '{megabytes:.1f} MiB, {bytes_per_item:.0f} bytes per item'
+          .format(megabytes=figures['bytes'] / 2 ** 20, **figures))
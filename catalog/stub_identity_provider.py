@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""Stub OpenID identity provider, to sign in without Google.
+
+Serves a discovery document, the token endpoint, the signing keys (a
+JSON Web Key Set), user info and revocation. Any authorization code
+signs in the one user of STUB_USER, with an ID token for the client_id
+the code is exchanged by, signed by a key made at start up. The issuer
+of the tokens is the provider's own URL unless TOKEN_ISSUER is set.
+Needs cryptography.
+
+Usage:
+    python stub_identity_provider.py --port 5001
+
+then start the service with OAUTH_DISCOVERY_URI set to
+http://127.0.0.1:5001/.well-known/openid-configuration.
+"""
+
+import argparse
+import base64
+import datetime
+import time
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+from flask import Flask, jsonify, request
+from oauth2client import crypt
+
+
+STUB_USER = {'sub': '1000',
+             'email': 'stub.user@example.com',
+             'name': 'Stub User',
+             'picture': 'https://example.com/stub-user.png'}
+KEY_ID = 'stub-key'
+TOKEN_LIFETIME = 3600
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _int_b64(value):
+    return _b64(value.to_bytes((value.bit_length() + 7) // 8, 'big'))
+
+
+def make_key():
+    """(private key PEM, JSON Web Key with its self-signed certificate)"""
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'stub')])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = x509.CertificateBuilder()\
+        .subject_name(name)\
+        .issuer_name(name)\
+        .public_key(key.public_key())\
+        .serial_number(x509.random_serial_number())\
+        .not_valid_before(now - datetime.timedelta(days=1))\
+        .not_valid_after(now + datetime.timedelta(days=365))\
+        .sign(key, hashes.SHA256())
+    numbers = key.public_key().public_numbers()
+    jwk = {'kty': 'RSA', 'use': 'sig', 'alg': 'RS256', 'kid': KEY_ID,
+           'n': _int_b64(numbers.n), 'e': _int_b64(numbers.e),
+           'x5c': [base64.b64encode(
+               cert.public_bytes(serialization.Encoding.DER))
+               .decode('ascii')]}
+    pem = key.private_bytes(serialization.Encoding.PEM,
+                            serialization.PrivateFormat.TraditionalOpenSSL,
+                            serialization.NoEncryption())
+    return pem, jwk
+
+
+def create_stub(config=None):
+    """The stub provider, settings (STUB_USER, TOKEN_ISSUER) overridden
+    by config
+    """
+    stub = Flask(__name__)
+    stub.config.update(STUB_USER=STUB_USER, TOKEN_ISSUER=None)
+    stub.config.update(config or {})
+    pem, jwk = make_key()
+    signer = crypt.Signer.from_string(pem)
+
+    def issuer():
+        return request.url_root.rstrip('/')
+
+    @stub.route('/.well-known/openid-configuration')
+    def discovery():
+        return jsonify(issuer=issuer(),
+                       token_endpoint=issuer() + '/token',
+                       jwks_uri=issuer() + '/jwks',
+                       userinfo_endpoint=issuer() + '/userinfo',
+                       revocation_endpoint=issuer() + '/revoke')
+
+    @stub.route('/token', methods=['POST'])
+    def token():
+        if not request.form.get('code'):
+            return jsonify(error='invalid_grant'), 400
+        now = int(time.time())
+        claims = dict(stub.config['STUB_USER'],
+                      iss=stub.config['TOKEN_ISSUER'] or issuer(),
+                      aud=request.form['client_id'],
+                      iat=now, exp=now + TOKEN_LIFETIME)
+        id_token = crypt.make_signed_jwt(signer, claims, key_id=KEY_ID)
+        return jsonify(access_token='stub-access-token',
+                       id_token=id_token.decode('ascii'),
+                       token_type='Bearer', expires_in=TOKEN_LIFETIME)
+
+    @stub.route('/jwks')
+    def jwks():
+        response = jsonify(keys=[jwk])
+        response.cache_control.max_age = TOKEN_LIFETIME
+        return response
+
+    @stub.route('/userinfo')
+    def userinfo():
+        return jsonify(stub.config['STUB_USER'])
+
+    @stub.route('/revoke', methods=['POST'])
+    def revoke():
+        return jsonify()
+
+    return stub
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5001)
+    args = parser.parse_args()
+    create_stub().run(host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""Denormalized summaries of the catalog.
+
+Category.item_count and the latest_items table are kept up to date by
+the write views, in the same transaction as their change, so the home
+page neither counts nor sorts items. The functions only issue core
+statements and take a session or a connection. reconcile() rebuilds
+both from the items table, e.g. after writes that bypassed them:
+
+    python database_setup.py reconcile
+"""
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import joinedload
+
+from database_setup import Category, Item, LatestItem
+
+
+# rows kept in latest_items, the home page shows the first three
+LATEST_KEPT = 10
+
+categories = Category.__table__
+items = Item.__table__
+latest_items = LatestItem.__table__
+
+
+def _count(bind, category_id, delta):
+    bind.execute(categories.update()
+                 .where(categories.c.id == category_id)
+                 .values(item_count=categories.c.item_count + delta))
+
+
+def rebuild_latest(bind):
+    """Refills latest_items with the newest items"""
+    bind.execute(latest_items.delete())
+    newest = select(items.c.id, items.c.creation_date)\
+        .order_by(items.c.creation_date.desc(), items.c.id.desc())\
+        .limit(LATEST_KEPT)
+    bind.execute(latest_items.insert().from_select(
+        ['item_id', 'creation_date'], newest))
+
+
+def item_inserted(bind, item_id, category_id):
+    """Counts the (flushed) item and puts it among the latest ones"""
+    _count(bind, category_id, 1)
+    bind.execute(latest_items.insert().from_select(
+        ['item_id', 'creation_date'],
+        select(items.c.id, items.c.creation_date)
+        .where(items.c.id == item_id)))
+    kept = select(latest_items.c.item_id)\
+        .order_by(latest_items.c.creation_date.desc(),
+                  latest_items.c.item_id.desc())\
+        .limit(LATEST_KEPT)\
+        .scalar_subquery()
+    bind.execute(latest_items.delete()
+                 .where(latest_items.c.item_id.notin_(kept)))
+
+
+def items_inserted(bind, category_counts):
+    """Counts items added in bulk, category_counts mapping category ids
+    to the number of items added to them
+    """
+    for category_id, count in category_counts.items():
+        _count(bind, category_id, count)
+    rebuild_latest(bind)
+
+
+def item_moved(bind, from_category_id, to_category_id):
+    if from_category_id != to_category_id:
+        _count(bind, from_category_id, -1)
+        _count(bind, to_category_id, 1)
+
+
+def item_deleted(bind, item_id, category_id):
+    _count(bind, category_id, -1)
+    removed = bind.execute(latest_items.delete()
+                           .where(latest_items.c.item_id == item_id))
+    if removed.rowcount:
+        rebuild_latest(bind)
+
+
+def items_deleting(bind, item_ids):
+    """Takes the items selected by item_ids, a select of ids, off the
+    counts of their categories. Run right before deleting them
+    """
+    gone = select(func.count(items.c.id))\
+        .where(items.c.category_id == categories.c.id)\
+        .where(items.c.id.in_(item_ids))\
+        .scalar_subquery()
+    bind.execute(categories.update()
+                 .where(categories.c.id.in_(
+                     select(items.c.category_id)
+                     .where(items.c.id.in_(item_ids))))
+                 .values(item_count=categories.c.item_count - gone))
+
+
+def category_deleted(bind):
+    """Replaces the latest items gone with a category's items"""
+    rebuild_latest(bind)
+
+
+def reconcile(bind):
+    """Recounts the items of every category and rebuilds latest_items"""
+    count = select(func.count(items.c.id))\
+        .where(items.c.category_id == categories.c.id)\
+        .scalar_subquery()
+    bind.execute(categories.update().values(item_count=count))
+    rebuild_latest(bind)
+
+
+def latest(query, limit=3):
+    """query of items (a Query or a select()) narrowed to the newest
+    limit ones, with their category loaded
+    """
+    return query\
+        .join(LatestItem, LatestItem.item_id == Item.id)\
+        .options(joinedload(Item.category))\
+        .order_by(LatestItem.creation_date.desc(),
+                  LatestItem.item_id.desc())\
+        .limit(limit)
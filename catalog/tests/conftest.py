@@ -0,0 +1,85 @@
+"""Fixtures of the catalog tests. Run them from catalog/:
+
+    python -m pytest tests
+"""
+
+import os
+import sys
+
+import pytest
+
+# the modules of the service import each other as top level modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from catalog_service import create_app  # noqa: E402
+from database_setup import User, create_db_engine, create_tables  # noqa: E402
+
+
+@pytest.fixture
+def database_url(tmp_path):
+    """URL of a new SQLite database with the catalog tables"""
+    url = 'sqlite:///{0}'.format(tmp_path / 'catalog.db')
+    engine = create_db_engine(url)
+    create_tables(engine)
+    engine.dispose()
+    return url
+
+
+@pytest.fixture
+def make_app(database_url):
+    """Makes apps on the test database, settings overridden by keyword"""
+    apps = []
+
+    def make(**config):
+        settings = {'DATABASE_URL': database_url,
+                    'SESSION_STORE': 'memory',
+                    'TEMPLATE_CACHE_DIR': '',
+                    'TESTING': True}
+        settings.update(config)
+        app = create_app(settings)
+        apps.append(app)
+        return app
+
+    yield make
+    for app in apps:
+        app.extensions['catalog'].dispose()
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def user_id(database_url):
+    """Id of a user of the test database"""
+    engine = create_db_engine(database_url)
+    with engine.begin() as connection:
+        user_id = connection.execute(User.__table__.insert().values(
+            name='Owner', email='owner@example.com')).inserted_primary_key[0]
+    engine.dispose()
+    return user_id
+
+
+@pytest.fixture
+def sign_in(user_id):
+    """Logs a test client in as the user_id user"""
+    def sign_in(client):
+        with client.session_transaction() as login_session:
+            login_session['user_id'] = user_id
+    return sign_in
+
+
+@pytest.fixture
+def flashed():
+    """Messages flashed to a test client and not shown yet"""
+    def flashed(client):
+        with client.session_transaction() as login_session:
+            return [message for _, message
+                    in login_session.get('_flashes', [])]
+    return flashed
@@ -0,0 +1,58 @@
+import asyncio
+import importlib
+
+import httpx
+import pytest
+
+import catalog_service
+from database_setup import create_db_engine, create_tables
+from seed_data import seed
+
+
+@pytest.fixture(scope='module')
+def asgi_app(tmp_path_factory):
+    """asgi_app, serving the module level app on a seeded test database"""
+    url = 'sqlite:///{0}'.format(tmp_path_factory.mktemp('asgi') / 'c.db')
+    engine = create_db_engine(url)
+    create_tables(engine)
+    seed(engine, users=1, categories=3, items=10)
+    engine.dispose()
+
+    config = catalog_service.app.config
+    saved = config['DATABASE_URL']
+    # read by the engines, made on first use
+    config['DATABASE_URL'] = url
+    module = importlib.import_module('asgi_app')
+    yield module
+    asyncio.run(module.async_engine.dispose())
+    catalog_service.app.extensions['catalog'].dispose()
+    config['DATABASE_URL'] = saved
+
+
+def _get(asgi_app, url):
+    async def get():
+        transport = httpx.ASGITransport(app=asgi_app.application)
+        async with httpx.AsyncClient(transport=transport,
+                                     base_url='http://test') as client:
+            return await client.get(url)
+    return asyncio.run(get())
+
+
+@pytest.mark.parametrize('url', ['/catalog', '/catalog/{0}/items'])
+def test_fragments_gone_after_they_were_found(asgi_app, monkeypatch, url):
+    # cleared by a write or evicted between the check and the render
+    monkeypatch.setattr(asgi_app, 'has_fragment', lambda *args: True)
+    catalog_service.app.jinja_env.fragment_cache.clear()
+    engine = catalog_service.app.extensions['catalog'].engine
+    with engine.connect() as connection:
+        names = [row[0] for row in connection.exec_driver_sql(
+            'SELECT name FROM categories')]
+        latest = connection.exec_driver_sql(
+            'SELECT title FROM items ORDER BY creation_date DESC, id DESC '
+            'LIMIT 1').scalar()
+
+    response = _get(asgi_app, url.format(names[0]))
+    assert response.status_code == 200
+    assert all(name in response.text for name in names)
+    if url == '/catalog':
+        assert latest in response.text
@@ -0,0 +1,24 @@
+from benchmark import Recorder
+from seed_data import seed
+
+
+def _statements(client, recorder, url):
+    before = recorder.statements
+    response = client.get(url)
+    assert response.status_code == 200
+    return response.get_json(), recorder.statements - before
+
+
+def test_catalog_json_statements_do_not_grow_with_categories(app, client):
+    engine = app.extensions['catalog'].engine
+    recorder = Recorder(engine)
+
+    seed(engine, users=2, categories=3, items=10)
+    small, small_statements = _statements(client, recorder, '/catalog/json')
+    seed(engine, users=2, categories=40, items=200)
+    large, large_statements = _statements(client, recorder, '/catalog/json')
+
+    assert len(small['Categories']) == 3
+    assert len(large['Categories']) == 43
+    assert sum(len(c['Items']) for c in large['Categories']) == 210
+    assert large_statements == small_statements
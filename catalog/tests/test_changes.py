@@ -0,0 +1,29 @@
+import base64
+import json
+
+import pytest
+
+
+def _cursor(values):
+    data = json.dumps(values).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def test_reading_the_feed_on(client, sign_in):
+    sign_in(client)
+    client.post('/catalog/categories/new', data={'name': 'Soccer'})
+    first = client.get('/catalog/changes').get_json()
+    assert [c['data'] for c in first['Changes']] == [
+        {'id': 1, 'name': 'Soccer'}]
+
+    client.post('/catalog/categories/new', data={'name': 'Hockey'})
+    then = client.get('/catalog/changes?since=' + first['next']).get_json()
+    assert [c['data'] for c in then['Changes']] == [
+        {'id': 2, 'name': 'Hockey'}]
+
+
+@pytest.mark.parametrize('since', [
+    _cursor([[1]]), _cursor(['x']), _cursor([True]), _cursor([1.5]),
+    _cursor([1, 2]), 'not base64 !'])
+def test_bad_since_cursors_are_rejected(client, since):
+    assert client.get('/catalog/changes?since=' + since).status_code == 400
@@ -0,0 +1,38 @@
+import pytest
+
+
+@pytest.mark.parametrize('encoding', ['identity', 'gzip'])
+def test_304_carries_the_etag_of_the_200(client, encoding):
+    headers = {'Accept-Encoding': encoding}
+    full = client.get('/catalog', headers=headers)
+    assert full.status_code == 200
+    assert full.headers['ETag'].startswith('W/')
+
+    headers['If-None-Match'] = full.headers['ETag']
+    again = client.get('/catalog', headers=headers)
+    assert again.status_code == 304
+    assert again.headers['ETag'] == full.headers['ETag']
+
+
+def test_etag_does_not_depend_on_the_encoding(make_app):
+    client = make_app(COMPRESS_MIN_SIZE=0).test_client()
+    plain = client.get('/catalog', headers={'Accept-Encoding': 'identity'})
+    gzipped = client.get('/catalog', headers={'Accept-Encoding': 'gzip'})
+    assert gzipped.headers['Content-Encoding'] == 'gzip'
+    assert plain.headers['ETag'] == gzipped.headers['ETag']
+
+
+@pytest.mark.parametrize('url', ['/catalog', '/catalog/json'])
+def test_pages_of_signed_in_users_are_private(client, sign_in, url):
+    anonymous = client.get(url).headers['Cache-Control']
+    assert 'public' in anonymous and 'private' not in anonymous
+
+    sign_in(client)
+    full = client.get(url)
+    assert 'private' in full.headers['Cache-Control']
+    assert 'public' not in full.headers['Cache-Control']
+    assert 'no-cache' in full.headers['Cache-Control']
+
+    again = client.get(url, headers={'If-None-Match': full.headers['ETag']})
+    assert again.status_code == 304
+    assert 'private' in again.headers['Cache-Control']
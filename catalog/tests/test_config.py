@@ -0,0 +1,15 @@
+import pytest
+
+from config import DEFAULT_SECRET_KEY, check_secret_key
+
+
+@pytest.mark.parametrize('secret_key', [None, '', DEFAULT_SECRET_KEY])
+def test_servers_refuse_the_default_secret_key(secret_key):
+    with pytest.raises(RuntimeError):
+        check_secret_key(secret_key)
+    # the development server may use it
+    check_secret_key(secret_key, debug=True)
+
+
+def test_servers_take_a_secret_key_of_their_own():
+    check_secret_key('a secret of our own')
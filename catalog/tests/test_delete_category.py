@@ -0,0 +1,58 @@
+import sqlite3
+
+import bulk_delete
+
+
+def _add_category(client, items=2):
+    client.post('/catalog/categories/new', data={'name': 'Soccer'})
+    for n in range(items):
+        client.post('/catalog/items/new',
+                    data={'title': 'Ball {0}'.format(n),
+                          'description': 'Round', 'category': 'Soccer'})
+
+
+def _counts(app):
+    with app.extensions['catalog'].engine.connect() as connection:
+        return tuple(connection.exec_driver_sql(
+            'SELECT count(*) FROM {0}'.format(table)).scalar()
+            for table in ('categories', 'items'))
+
+
+def test_delete_without_on_delete_cascade(database_url, make_app, sign_in,
+                                          flashed):
+    # a database made before the foreign key had ON DELETE CASCADE
+    connection = sqlite3.connect(database_url[len('sqlite:///'):])
+    connection.execute('PRAGMA writable_schema=ON')
+    connection.execute("UPDATE sqlite_master SET sql = replace(sql, "
+                       "'ON DELETE CASCADE', '') WHERE name = 'items'")
+    connection.commit()
+    connection.close()
+
+    app = make_app()
+    client = app.test_client()
+    sign_in(client)
+    _add_category(client)
+    assert _counts(app) == (1, 2)
+
+    response = client.post('/catalog/Soccer/delete')
+    assert response.status_code == 302
+    assert flashed(client)[-1] == 'Category Soccer deleted successfully !'
+    assert _counts(app) == (0, 0)
+
+
+def test_delete_of_a_category_deleted_meanwhile(app, client, sign_in,
+                                                flashed, monkeypatch):
+    sign_in(client)
+    _add_category(client)
+    delete_categories = bulk_delete.delete_categories
+
+    def deleted_meanwhile(session, id_query):
+        # by another request, after the view found the category
+        delete_categories(session, id_query)
+        return delete_categories(session, id_query)
+
+    monkeypatch.setattr(bulk_delete, 'delete_categories', deleted_meanwhile)
+    client.post('/catalog/Soccer/delete')
+    assert flashed(client)[-1] == 'Soccer not found'
+    # the whole change rolled back
+    assert _counts(app) == (1, 2)
@@ -0,0 +1,44 @@
+import json
+import time
+
+
+def _import(client, records):
+    response = client.post('/catalog/import', data=json.dumps(records),
+                           content_type='application/json')
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_rows_of_the_wrong_type_are_rejected(client, sign_in):
+    sign_in(client)
+    result = _import(client, [
+        {'title': 5, 'category': 'Soccer'},
+        {'title': 'Ball', 'category': ['Soccer']},
+        {'title': 'Net', 'category': 'Soccer', 'description': 7},
+        {'title': 'Boots', 'category': 'Soccer'},
+    ])
+    assert result['inserted'] == 1
+    assert [error['row'] for error in result['errors']] == [1, 2, 3]
+
+
+def test_a_batch_creating_only_categories_is_seen(make_app, sign_in):
+    # polled too rarely to notice the import by itself
+    app = make_app(SNAPSHOT=True, SNAPSHOT_POLL_INTERVAL=60)
+    # the writer reads its own writes from the database, others from the
+    # snapshot
+    client, reader = app.test_client(), app.test_client()
+    sign_in(client)
+    _import(client, [{'title': 'Ball', 'category': 'Soccer'}])
+    assert reader.get('/catalog/json').status_code == 200
+
+    # the item is a duplicate, only its category is new
+    result = _import(client, [{'title': 'Ball', 'category': 'Hockey'}])
+    assert result['inserted'] == 0
+    assert result['categories_created'] == 1
+    for _ in range(50):
+        names = [c['name'] for c in
+                 reader.get('/catalog/json').get_json()['Categories']]
+        if 'Hockey' in names:
+            break
+        time.sleep(0.1)
+    assert names == ['Soccer', 'Hockey']
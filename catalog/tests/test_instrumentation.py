@@ -0,0 +1,31 @@
+import pytest
+from flask import g
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+
+@pytest.fixture
+def instrumented(make_app):
+    return make_app(SQL_INSTRUMENTATION=True)
+
+
+def test_server_timing_of_a_page(instrumented):
+    response = instrumented.test_client().get('/catalog')
+    assert response.status_code == 200
+    timing = dict(part.split(';', 1)[0:2] for part in
+                  response.headers['Server-Timing'].split(', '))
+    assert set(timing) == {'db', 'tpl', 'total'}
+    assert float(timing['tpl'].split('=')[1]) > 0
+
+
+def test_failed_statement_is_timed_and_forgotten(instrumented):
+    engine = instrumented.extensions['catalog'].engine
+    with instrumented.test_request_context():
+        instrumented.preprocess_request()
+        with engine.connect() as connection:
+            with pytest.raises(OperationalError):
+                connection.execute(text('SELECT * FROM missing_table'))
+            assert connection.info['query_start'] == []
+            connection.execute(text('SELECT 1'))
+            assert connection.info['query_start'] == []
+        assert g.request_stats.statement_count == 2
@@ -0,0 +1,96 @@
+import base64
+import json
+
+import pytest
+from sqlalchemy import select, text
+
+from database_setup import Category, normalize_dates
+from seed_data import seed
+
+
+def _cursor(values):
+    data = json.dumps(values).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+@pytest.fixture(params=[False, True], ids=['database', 'snapshot'])
+def catalog(request, make_app):
+    """Test client of an app with a seeded catalog, and the name of its
+    first category
+    """
+    app = make_app(SNAPSHOT=request.param)
+    engine = app.extensions['catalog'].engine
+    seed(engine, users=1, categories=2, items=20)
+    with engine.connect() as connection:
+        name = connection.execute(select(Category.name)
+                                  .order_by(Category.id)).scalar()
+    return app.test_client(), name
+
+
+def _paged_ids(client, name, limit=3):
+    """ids of the items of category name, following the next cursors of
+    at most 20 pages
+    """
+    ids, url = [], '/catalog/{0}/json?limit={1}'.format(name, limit)
+    for _ in range(20):
+        page = client.get(url).get_json()
+        ids.extend(item['id'] for item in page['Categories']['Items'])
+        if not page['next']:
+            return ids
+        url = '/catalog/{0}/json?limit={1}&next={2}'.format(
+            name, limit, page['next'])
+    raise AssertionError('pages never end: {0}'.format(ids))
+
+
+def test_following_the_next_cursor(catalog):
+    client, name = catalog
+    ids = _paged_ids(client, name)
+    everything = client.get('/catalog/{0}/json'.format(name)).get_json()
+    # newest first, every item once
+    assert sorted(ids) == [item['id']
+                           for item in everything['Categories']['Items']]
+
+
+@pytest.mark.parametrize('cursor', [
+    'not base64 !',
+    _cursor({'a': 1}),
+    _cursor([1]),
+    _cursor([1, 2]),
+    _cursor(['2020-01-01T00:00:00', 'x']),
+    _cursor(['2020-01-01T00:00:00', True]),
+    _cursor(['yesterday', 1]),
+])
+def test_bad_cursors_are_rejected(catalog, cursor):
+    client, name = catalog
+    assert client.get('/catalog/{0}/items?next={1}'
+                      .format(name, cursor)).status_code == 400
+    assert client.get('/catalog/{0}/json?next={1}'
+                      .format(name, cursor)).status_code == 400
+
+
+def _add_items(client, count):
+    client.post('/catalog/categories/new', data={'name': 'S'})
+    for n in range(count):
+        client.post('/catalog/S/items/new',
+                    data={'title': 'item {0}'.format(n),
+                          'description': 'same second'})
+
+
+def test_paging_items_added_by_the_views(client, sign_in):
+    sign_in(client)
+    _add_items(client, 7)
+    ids = _paged_ids(client, 'S')
+    assert sorted(ids) == list(range(1, 8))
+    assert len(ids) == 7
+
+
+def test_paging_dates_stored_without_microseconds(app, client, sign_in):
+    sign_in(client)
+    _add_items(client, 7)
+    engine = app.extensions['catalog'].engine
+    # as stored by CURRENT_TIMESTAMP, the default of older versions
+    with engine.begin() as connection:
+        connection.execute(text(
+            "UPDATE items SET creation_date = '2026-10-18 16:29:41'"))
+    assert normalize_dates(engine) == 7
+    assert sorted(_paged_ids(client, 'S')) == list(range(1, 8))
@@ -0,0 +1,33 @@
+import pytest
+
+
+@pytest.fixture
+def catalog(client, sign_in):
+    sign_in(client)
+    for name in ('Soccer', 'Hockey'):
+        client.post('/catalog/categories/new', data={'name': name})
+    for title, description, category in (
+            ('Ball', 'Round', 'Soccer'),
+            ('Stick', 'Soccer practice', 'Hockey'),
+            ('Puck', 'Black', 'Hockey')):
+        client.post('/catalog/items/new',
+                    data={'title': title, 'description': description,
+                          'category': category})
+    return client
+
+
+def _titles(client, query):
+    response = client.get('/catalog/search.json', query_string={'q': query})
+    return sorted(item['title'] for item in response.get_json()['Items'])
+
+
+@pytest.mark.parametrize('query, titles', [
+    # every word, each in the title, description or category name
+    ('soccer ball', ['Ball']),
+    ('hockey soccer', ['Stick']),
+    ('hock', ['Puck', 'Stick']),
+    ('soccer', ['Ball', 'Stick']),
+    ('soccer puck', []),
+])
+def test_every_word_matches_anywhere_in_the_item(catalog, query, titles):
+    assert _titles(catalog, query) == titles
@@ -0,0 +1,27 @@
+import time
+
+
+def _expires(app):
+    (_, expires), = app.session_interface.store.sessions.values()
+    return expires
+
+
+def test_reads_extend_sessions_close_to_expiring(make_app, sign_in):
+    app = make_app(SESSION_LIFETIME=100)
+    client = app.test_client()
+    sign_in(client)
+    store = app.session_interface.store
+    writes = store.writes
+
+    # plenty of time left, a read leaves the session as it is
+    expires = _expires(app)
+    client.get('/catalog')
+    assert _expires(app) == expires
+
+    sid, = store.sessions
+    store.sessions[sid] = (store.sessions[sid][0], time.time() + 10)
+    client.get('/catalog')
+    assert _expires(app) > time.time() + 90
+    assert store.writes == writes
+    with client.session_transaction() as login_session:
+        assert 'user_id' in login_session
@@ -0,0 +1,126 @@
+import json
+import threading
+
+import pytest
+from werkzeug.serving import make_server
+
+from stub_identity_provider import create_stub
+
+
+@pytest.fixture
+def serve():
+    """Serves WSGI apps on free local ports, returning their URL"""
+    servers = []
+
+    def serve(wsgi_app):
+        server = make_server('127.0.0.1', 0, wsgi_app, threaded=True)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        servers.append((server, thread))
+        return 'http://127.0.0.1:{0}'.format(server.server_port)
+
+    yield serve
+    for server, thread in servers:
+        server.shutdown()
+        thread.join()
+
+
+@pytest.fixture
+def provider(serve):
+    """The stub identity provider and its URL"""
+    stub = create_stub()
+    return stub, serve(stub)
+
+
+@pytest.fixture
+def make_client(make_app, tmp_path):
+    """Makes test clients of apps signing in against the provider of a
+    discovery document URL
+    """
+    secrets = tmp_path / 'client_secrets.json'
+    secrets.write_text(json.dumps(
+        {'web': {'client_id': 'catalog-test', 'client_secret': 'secret'}}))
+
+    def make_client(discovery):
+        return make_app(OAUTH_CLIENT_SECRETS=str(secrets),
+                        OAUTH_DISCOVERY_URI=discovery).test_client()
+    return make_client
+
+
+@pytest.fixture
+def client(make_client, provider):
+    """Test client of an app signing in against the stub provider"""
+    return make_client(provider[1] + '/.well-known/openid-configuration')
+
+
+def _gconnect(client):
+    state = client.post('/gconnect/state').get_json()['state']
+    return client.post('/gconnect?state=' + state, data='one-time-code')
+
+
+def _signed_in(client):
+    with client.session_transaction() as login_session:
+        return login_session.get('user_id'), login_session.get('email')
+
+
+def test_sign_in(client):
+    response = _gconnect(client)
+    assert response.status_code == 200
+    assert b'Welcome, Stub User!' in response.data
+    user_id, email = _signed_in(client)
+    assert user_id is not None
+    assert email == 'stub.user@example.com'
+
+    # the same user on the next sign in
+    client.get('/gdisconnect')
+    assert _signed_in(client) == (None, None)
+    assert _gconnect(client).status_code == 200
+    assert _signed_in(client) == (user_id, 'stub.user@example.com')
+
+
+def test_token_of_another_issuer_is_rejected(client, provider):
+    provider[0].config['TOKEN_ISSUER'] = 'https://accounts.example.com'
+    response = _gconnect(client)
+    assert response.status_code == 401
+    assert response.get_json() == \
+        'Token was not issued by the identity provider.'
+    assert _signed_in(client) == (None, None)
+
+
+def test_sign_in_issues_a_new_session_id(client):
+    client.post('/gconnect/state')
+    fixed = client.get_cookie('session').value
+    assert _gconnect(client).status_code == 200
+    assert client.get_cookie('session').value != fixed
+    assert _signed_in(client)[0] is not None
+
+    # whoever knew the id of the state token is not signed in with it
+    other = client.application.test_client()
+    other.set_cookie('session', fixed)
+    assert _signed_in(other) == (None, None)
+
+
+def test_user_info_without_email_is_rejected(client, provider):
+    # no email in the ID token, nor from the userinfo endpoint
+    provider[0].config['STUB_USER'] = {'sub': '1000', 'name': 'No Mail'}
+    response = _gconnect(client)
+    assert response.status_code == 401
+    assert response.get_json() == 'The identity provider gave no email.'
+    assert _signed_in(client) == (None, None)
+
+
+def test_sign_out_with_a_broken_discovery_document(make_client, serve,
+                                                   flashed):
+    def maintenance(environ, start_response):
+        start_response('200 OK', [('Content-Type', 'text/html')])
+        return [b'<html>Down for maintenance</html>']
+
+    client = make_client(serve(maintenance) + '/openid-configuration')
+    with client.session_transaction() as login_session:
+        login_session.update(access_token='token', gplus_id='1000',
+                             username='Stub User', picture=None,
+                             email='stub.user@example.com', user_id=1)
+    response = client.get('/gdisconnect')
+    assert response.status_code == 302
+    assert flashed(client)[-1] == \
+        'Failed to logoff. Failed to revoke token for given user.'
@@ -0,0 +1,64 @@
+import pytest
+
+
+@pytest.fixture
+def snapshot_app(make_app, monkeypatch):
+    """App serving from a snapshot that is only reloaded by refresh(), as
+    if every load took forever
+    """
+    app = make_app(SNAPSHOT=True, SNAPSHOT_POLL_INTERVAL=3600,
+                   REPLICA_STICKY_SECONDS=0)
+    monkeypatch.setattr(app.extensions['catalog'].snapshots, 'changed',
+                        lambda: None)
+    return app
+
+
+def _titles(client):
+    return [item['title'] for category
+            in client.get('/catalog/json').get_json()['Categories']
+            for item in category['Items']]
+
+
+def _written_revision(client):
+    with client.session_transaction() as login_session:
+        return login_session.get('written_revision')
+
+
+def test_writer_reads_its_write_until_the_snapshot_has_it(snapshot_app,
+                                                          sign_in):
+    writer, reader = snapshot_app.test_client(), snapshot_app.test_client()
+    sign_in(writer)
+    assert _titles(reader) == []
+
+    writer.post('/catalog/categories/new', data={'name': 'Soccer'})
+    writer.post('/catalog/items/new',
+                data={'title': 'Ball', 'description': 'Round',
+                      'category': 'Soccer'})
+    assert _written_revision(writer) == 2
+    # however long after the write, not for a fixed time
+    assert _titles(writer) == ['Ball']
+    assert _titles(reader) == []
+
+    snapshots = snapshot_app.extensions['catalog'].snapshots
+    assert snapshots.refresh()
+    assert snapshots.current.revision == 2
+    assert _titles(writer) == ['Ball']
+    assert _written_revision(writer) is None
+    assert _titles(reader) == ['Ball']
+
+
+def test_write_rolled_back_keeps_the_snapshot(snapshot_app, sign_in):
+    client = snapshot_app.test_client()
+    sign_in(client)
+    client.post('/catalog/categories/new', data={'name': 'Soccer'})
+    snapshot_app.extensions['catalog'].snapshots.refresh()
+    assert _titles(client) == []
+
+    # a duplicate name, rolled back
+    client.post('/catalog/categories/new', data={'name': 'Soccer'})
+    assert _written_revision(client) == 1
+    snapshots_loads = snapshot_app.extensions['catalog'].snapshots.loads
+    assert _titles(client) == []
+    assert _written_revision(client) is None
+    assert snapshot_app.extensions['catalog'].snapshots.loads == \
+        snapshots_loads
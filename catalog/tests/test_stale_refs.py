@@ -0,0 +1,70 @@
+from sqlalchemy import func, select
+
+from database_setup import Change, Revision
+
+
+def _counts(engine):
+    with engine.connect() as connection:
+        return (connection.execute(select(func.count())
+                                   .select_from(Change.__table__)).scalar(),
+                connection.execute(select(Revision.__table__.c.value))
+                .scalar())
+
+
+def _add_item(client, title):
+    client.post('/catalog/categories/new', data={'name': 'Soccer'})
+    client.post('/catalog/items/new',
+                data={'title': title, 'description': 'Round',
+                      'category': 'Soccer'})
+
+
+def _stale(writer, reader):
+    """Adds Ball, caches it in reader, then has writer delete it"""
+    _add_item(writer, 'Ball')
+    reader.get('/catalog/Soccer/Ball/json')
+    writer.post('/catalog/items/Ball/delete')
+
+
+def test_item_json_of_an_item_deleted_by_another_process(make_app, sign_in):
+    # two processes on one database, each with its own lookup caches
+    writer, reader = make_app().test_client(), make_app().test_client()
+    sign_in(writer)
+    _add_item(writer, 'Ball')
+    assert reader.get('/catalog/Soccer/Ball/json').get_json() == {
+        'Categories': {'id': 1, 'title': 'Ball', 'description': 'Round',
+                       'category_id': 1}}
+
+    writer.post('/catalog/items/Ball/delete')
+    response = reader.get('/catalog/Soccer/Ball/json')
+    assert response.status_code == 200
+    assert response.get_json() == {'Error': 'Item or Category not found'}
+
+
+def test_edit_of_an_item_deleted_by_another_process(make_app, sign_in,
+                                                    flashed):
+    reader_app = make_app()
+    writer, reader = make_app().test_client(), reader_app.test_client()
+    sign_in(writer)
+    sign_in(reader)
+    _stale(writer, reader)
+
+    before = _counts(reader_app.extensions['catalog'].engine)
+    reader.post('/catalog/Soccer/Ball/edit',
+                data={'title': 'Ball', 'description': 'Square',
+                      'category': 'Soccer'})
+    assert flashed(reader)[-1] == 'Ball not found'
+    assert _counts(reader_app.extensions['catalog'].engine) == before
+
+
+def test_delete_of_an_item_deleted_by_another_process(make_app, sign_in,
+                                                      flashed):
+    reader_app = make_app()
+    writer, reader = make_app().test_client(), reader_app.test_client()
+    sign_in(writer)
+    sign_in(reader)
+    _stale(writer, reader)
+
+    before = _counts(reader_app.extensions['catalog'].engine)
+    reader.post('/catalog/items/Ball/delete')
+    assert flashed(reader)[-1] == 'Ball not found'
+    assert _counts(reader_app.extensions['catalog'].engine) == before